@@ -2,30 +2,122 @@
 Tools module for handling OpenAI API interactions and JSON processing.
 
 This module provides utilities for:
-1. Chatting with GPT models using OpenAI API
-2. Cleaning and parsing JSON strings
+1. Chatting with GPT models using OpenAI API (sync and async)
+2. Caching chat responses on disk (opt-in, see LLM_CACHE_PATH in config)
+3. Cleaning and parsing JSON strings
 """
 
 # Standard library imports
 import json
-from typing import Union, List, Dict, Tuple
+import time
+import random
+import asyncio
+import threading
+import weakref
+from typing import Union, List, Dict, Tuple, Optional
 
 # Third-party imports
-from openai import OpenAI
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from openai import APIConnectionError, RateLimitError, InternalServerError
 
 # Import configuration
 from config import OPENAI_API_KEY, OPENAI_BASE_URL, DEFAULT_MODEL, DEFAULT_TEMPERATURE, DEFAULT_MAX_TOKENS
+from config import OPENAI_TIMEOUT, OPENAI_MAX_RETRIES, OPENAI_BACKOFF_BASE, OPENAI_BACKOFF_MAX, OPENAI_MAX_CONNECTIONS
+from config import LLM_CACHE_PATH
+from cache import LLMCache
+from instrument import span, recordUsage
+
+# Errors worth retrying, anything else (e.g. a bad request) fails immediately
+RETRYABLE_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+
+_client = None
+_clientLock = threading.Lock()
+# an async client is bound to the event loop it was created in
+_asyncClients = weakref.WeakKeyDictionary()
+_cache = None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_CONNECTIONS)
+
+
+def getClient() -> OpenAI:
+    """Get the process-wide OpenAI client.
+
+    The client is created on first use and keeps its HTTP connections alive,
+    so later calls do not pay for client construction or a new TLS handshake.
+    Retries are done by chatWithGPT, so the client itself never retries.
+    """
+    global _client
+    if _client is None:
+        with _clientLock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=OPENAI_API_KEY,
+                    base_url=OPENAI_BASE_URL,
+                    max_retries=0,
+                    http_client=DefaultHttpxClient(limits=_limits())
+                )
+    return _client
+
+
+def getAsyncClient() -> AsyncOpenAI:
+    """Get the AsyncOpenAI client of the running event loop.
+
+    Same settings and pool limits as getClient. One client is kept per event loop,
+    because async connections can not be shared across loops.
+    """
+    loop = asyncio.get_running_loop()
+    client = _asyncClients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_BASE_URL,
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(limits=_limits())
+        )
+        _asyncClients[loop] = client
+    return client
+
+
+def getCache() -> Optional[LLMCache]:
+    """Get the process-wide LLM response cache, None if LLM_CACHE_PATH is not set."""
+    global _cache
+    if _cache is None and LLM_CACHE_PATH:
+        with _clientLock:
+            if _cache is None:
+                _cache = LLMCache(LLM_CACHE_PATH)
+    return _cache
+
+
+def _backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff before retry `attempt` (starting from 0)."""
+    return random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** attempt))
+
+
+def _toMessages(messages: Union[str, List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    if isinstance(messages, str):
+        return [{"role": "user", "content": messages}]
+    return messages
+
 
 def chatWithGPT(
     messages: Union[str, List[Dict[str, str]]],
     model: str = DEFAULT_MODEL,
     temperature: float = DEFAULT_TEMPERATURE,
-    max_tokens: int = DEFAULT_MAX_TOKENS
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    timeout: float = OPENAI_TIMEOUT,
+    retries: int = OPENAI_MAX_RETRIES,
+    use_cache: bool = True
 ) -> Tuple[str, bool]:
     """Chat with GPT model and get response.
     
     This function handles communication with OpenAI's GPT models. It supports both
     single string messages and structured message lists.
+    All calls share one pooled client, see getClient.
+    Each call is recorded as a "chat" span (see instrument.py) with its token usage,
+    retries and cache hits.
 
     Parameters
     ----------
@@ -38,6 +130,15 @@ def chatWithGPT(
         Controls randomness of the output, by default from config.
     max_tokens : int, optional
         Maximum number of tokens to generate, by default from config.
+    timeout : float, optional
+        Seconds before a single request is given up, by default from config.
+    retries : int, optional
+        Number of retries after a retryable error, with jittered exponential backoff,
+        by default from config.
+    use_cache : bool, optional
+        If False, bypass the LLM response cache for this call, by default True.
+        The cache is only used when LLM_CACHE_PATH is set, and only successful
+        responses are stored.
         
     Returns
     -------
@@ -46,25 +147,87 @@ def chatWithGPT(
         - response_text (str): The generated response from GPT
         - success_status (bool): Boolean indicating if the API call was successful
     """
-    client = OpenAI(
-        api_key=OPENAI_API_KEY,
-        base_url=OPENAI_BASE_URL
-    )
-    
-    if isinstance(messages, str):
-        messages = [{"role": "user", "content": messages}]
-        
-    try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            timeout=60
-        )
-        return response.choices[0].message.content, True
-    except Exception as e:
-        return str(e), False
+    messages = _toMessages(messages)
+    with span("chat", model=model) as chatSpan:
+        cache = getCache() if use_cache else None
+        if cache is not None:
+            key = LLMCache.key(model, messages, temperature, max_tokens)
+            cached = cache.get(key)
+            if cached is not None:
+                chatSpan.add("cache_hits")
+                return cached, True
+        for attempt in range(retries + 1):
+            try:
+                response = getClient().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    timeout=timeout
+                )
+                recordUsage(model, response.usage)
+                content = response.choices[0].message.content
+                if cache is not None and content is not None:
+                    cache.put(key, content)
+                return content, True
+            except RETRYABLE_ERRORS as e:
+                if attempt == retries:
+                    chatSpan.fail(e)
+                    return str(e), False
+                chatSpan.add("retries")
+                time.sleep(_backoff(attempt))
+            except Exception as e:
+                chatSpan.fail(e)
+                return str(e), False
+
+
+async def achatWithGPT(
+    messages: Union[str, List[Dict[str, str]]],
+    model: str = DEFAULT_MODEL,
+    temperature: float = DEFAULT_TEMPERATURE,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    timeout: float = OPENAI_TIMEOUT,
+    retries: int = OPENAI_MAX_RETRIES,
+    use_cache: bool = True
+) -> Tuple[str, bool]:
+    """Async version of chatWithGPT.
+
+    Takes the same parameters and returns the same tuple. Useful to run many
+    requests at once, e.g. with asyncio.gather, without a thread per request.
+    """
+    messages = _toMessages(messages)
+    with span("chat", model=model) as chatSpan:
+        cache = getCache() if use_cache else None
+        if cache is not None:
+            key = LLMCache.key(model, messages, temperature, max_tokens)
+            # SQLite blocks, so the lookup and the store run outside the event loop
+            cached = await asyncio.to_thread(cache.get, key)
+            if cached is not None:
+                chatSpan.add("cache_hits")
+                return cached, True
+        for attempt in range(retries + 1):
+            try:
+                response = await getAsyncClient().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    timeout=timeout
+                )
+                recordUsage(model, response.usage)
+                content = response.choices[0].message.content
+                if cache is not None and content is not None:
+                    await asyncio.to_thread(cache.put, key, content)
+                return content, True
+            except RETRYABLE_ERRORS as e:
+                if attempt == retries:
+                    chatSpan.fail(e)
+                    return str(e), False
+                chatSpan.add("retries")
+                await asyncio.sleep(_backoff(attempt))
+            except Exception as e:
+                chatSpan.fail(e)
+                return str(e), False
 
 def jsonClean(s1: str, keys: List[str] = None) -> Tuple[Dict, bool]:
     """Clean and parse JSON string.
@@ -1,9 +1,11 @@
 import json
 import math
 
-from functools import lru_cache
-from collections import defaultdict
-from config import CACHE_SIZE
+import numpy as np
+
+from collections import defaultdict, deque
+from keywordMatcher import KeywordMatcher, getRecordMatchers
+from config import NMI_MATRIX_MIN_ELEMENTS
 
 
 def bad_partition(grouping_pred:list[list[int]],grouping_true:list[list[int]]):
@@ -65,6 +67,111 @@ def clustering_to_soft_matrix(clustering):
             group_sizes[group_idx] += 1
     return membership, group_sizes
 
+def soft_membership_matrix(clustering, position, N):
+    """
+    Build the soft membership matrix of a clustering.
+
+    Parameters
+    ----------
+    clustering : list[list]
+        List of groups where each group contains elements
+    position : dict
+        Element -> row of the matrix
+    N : int
+        Number of rows
+
+    Returns
+    -------
+    numpy.ndarray
+        N x len(clustering) matrix, entry (x, g) is 1/number of occurrences of x
+        if x is in group g, otherwise 0
+    """
+    counts = np.zeros((N, len(clustering)))
+    membership, _ = clustering_to_soft_matrix(clustering)
+    for element, groups in membership.items():
+        for group_idx in groups:
+            counts[position[element], group_idx] += 1
+    occurrences = counts.sum(axis=1, keepdims=True)
+    return np.divide(counts > 0, occurrences, out=np.zeros_like(counts), where=occurrences > 0)
+
+def compute_soft_nmi_batch(pairs):
+    """
+    Calculate Soft NMI for many (grouping_true, grouping_pred) pairs at once.
+
+    Each pair is turned into weighted soft membership matrices, padded to a common
+    shape, and the contingency matrices, marginals, mutual information and entropies
+    of all pairs are computed together in matrix form.
+    See compute_soft_nmi for the definition.
+
+    Parameters
+    ----------
+    pairs : list[tuple[list[list], list[list]]]
+        List of (grouping_true, grouping_pred)
+
+    Returns
+    -------
+    list[float]
+        Soft NMI score of each pair
+    """
+    if len(pairs) == 0:
+        return []
+    elements = [sorted(set(e for group in t for e in group) | set(e for group in p for e in group)) for t, p in pairs]
+    N = max(1, max(len(e) for e in elements))
+    G = max(1, max(len(t) for t, _ in pairs))
+    H = max(1, max(len(p) for _, p in pairs))
+    U = np.zeros((len(pairs), N, G))
+    V = np.zeros((len(pairs), N, H))
+    for b, ((grouping_true, grouping_pred), elems) in enumerate(zip(pairs, elements)):
+        position = {e: x for x, e in enumerate(elems)}
+        U[b, :, :len(grouping_true)] = soft_membership_matrix(grouping_true, position, N)
+        V[b, :, :len(grouping_pred)] = soft_membership_matrix(grouping_pred, position, N)
+    n = np.array([max(1, len(e)) for e in elements], dtype=float)
+
+    # soft contingency matrix and marginals
+    P = np.einsum('bxi,bxj->bij', U, V) / n[:, None, None]
+    pi = U.sum(axis=1) / n[:, None]
+    pj = V.sum(axis=1) / n[:, None]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = P / (pi[:, :, None] * pj[:, None, :])
+        I_uv = np.where(P > 0, P * np.log(np.where(P > 0, ratio, 1)), 0).sum(axis=(1, 2))
+        H_u = -np.where(pi > 0, pi * np.log(np.where(pi > 0, pi, 1)), 0).sum(axis=1)
+        H_v = -np.where(pj > 0, pj * np.log(np.where(pj > 0, pj, 1)), 0).sum(axis=1)
+    H_sum = H_u + H_v
+    scores = np.where(H_sum > 0, 2 * I_uv / np.where(H_sum > 0, H_sum, 1), 0.0)
+    return [float(score) for score in scores]
+
+def soft_nmi_scalar(grouping_true, grouping_pred):
+    """
+    Soft NMI of one pair with plain loops over the elements, see compute_soft_nmi.
+
+    Only the non-zero cells of the soft contingency matrix are visited, which is faster
+    than building the matrices for the few elements of a usual record.
+    """
+    true_membership, _ = clustering_to_soft_matrix(grouping_true)
+    pred_membership, _ = clustering_to_soft_matrix(grouping_pred)
+    N = len(true_membership.keys() | pred_membership.keys())
+    if N == 0:
+        return 0.0
+    P = defaultdict(float)
+    pi = defaultdict(float)
+    pj = defaultdict(float)
+    for x in true_membership.keys() | pred_membership.keys():
+        true_groups = set(true_membership.get(x, ()))
+        pred_groups = set(pred_membership.get(x, ()))
+        wx = 1 / len(true_membership[x]) if true_groups else 0
+        wy = 1 / len(pred_membership[x]) if pred_groups else 0
+        for i in true_groups:
+            pi[i] += wx
+            for j in pred_groups:
+                P[i, j] += wx * wy
+        for j in pred_groups:
+            pj[j] += wy
+    I_uv = sum(p / N * math.log(p * N / (pi[i] * pj[j])) for (i, j), p in P.items() if p > 0)
+    H_u = -sum(p / N * math.log(p / N) for p in pi.values() if p > 0)
+    H_v = -sum(p / N * math.log(p / N) for p in pj.values() if p > 0)
+    return 2 * I_uv / (H_u + H_v) if (H_u + H_v) > 0 else 0.0
+
 def compute_soft_nmi(grouping_true, grouping_pred):
     """
     Calculate Soft NMI (Normalized Mutual Information) that allows element overlap.
@@ -84,59 +191,100 @@ def compute_soft_nmi(grouping_true, grouping_pred):
     -------
     float
         Soft NMI score between 0 and 1
+
+    Notes
+    -----
+    Pairs with fewer than NMI_MATRIX_MIN_ELEMENTS elements (every graded record) use
+    soft_nmi_scalar, larger ones the matrix form of compute_soft_nmi_batch.
     """
-    # Get all unique elements
-    elements = sorted(set(e for group in grouping_true for e in group) | set(e for group in grouping_pred for e in group))
-    N = len(elements)
+    if len({e for group in grouping_true for e in group} | {e for group in grouping_pred for e in group}) < NMI_MATRIX_MIN_ELEMENTS:
+        return soft_nmi_scalar(grouping_true, grouping_pred)
+    return compute_soft_nmi_batch([(grouping_true, grouping_pred)])[0]
 
-    # Construct soft matrix
-    true_membership, true_group_sizes = clustering_to_soft_matrix(grouping_true)
-    pred_membership, pred_group_sizes = clustering_to_soft_matrix(grouping_pred)
+def max_bipartite_matching(adj: list[list[int]], rows: list[int], cols: set[int]) -> int:
+    """
+    Size of the maximum matching between rows and cols (Hopcroft-Karp).
 
-    # List of all groups
-    true_groups = list(true_group_sizes.keys())
-    pred_groups = list(pred_group_sizes.keys())
+    Parameters
+    ----------
+    adj : list[list[int]]
+        adj[i] is the list of columns row i can be matched with
+    rows : list[int]
+        The rows that take part in the matching
+    cols : set[int]
+        The columns that are still available
 
-    # Calculate mutual information I(U, V)
-    I_uv = 0.0
-    for i in true_groups:
-        for j in pred_groups:
-            pij = 0.0
-            for x in elements:
-                if i in true_membership[x] and j in pred_membership[x]:
-                    wx = 1 / len(true_membership[x])
-                    wy = 1 / len(pred_membership[x])
-                    pij += wx * wy
-            pij /= N
-            if pij > 0:
-                pi = sum(1 / len(true_membership[x]) for x in elements if i in true_membership[x]) / N
-                pj = sum(1 / len(pred_membership[x]) for x in elements if j in pred_membership[x]) / N
-                I_uv += pij * math.log(pij / (pi * pj))
-
-    # Entropy H(U), H(V)
-    H_u = 0.0
-    H_v = 0.0
-    for i in true_groups:
-        pi = sum(1 / len(true_membership[x]) for x in elements if i in true_membership[x]) / N
-        if pi > 0:
-            H_u -= pi * math.log(pi)
-    for j in pred_groups:
-        pj = sum(1 / len(pred_membership[x]) for x in elements if j in pred_membership[x]) / N
-        if pj > 0:
-            H_v -= pj * math.log(pj)
+    Returns
+    -------
+    int
+        Number of matched pairs
+    """
+    match_row = {i: None for i in rows}
+    match_col = {}
+    INF = float('inf')
 
-    return 2 * I_uv / (H_u + H_v) if (H_u + H_v) > 0 else 0.0
+    def bfs():
+        dist = {}
+        queue = deque()
+        for i in rows:
+            if match_row[i] is None:
+                dist[i] = 0
+                queue.append(i)
+        found = False
+        while queue:
+            i = queue.popleft()
+            for j in adj[i]:
+                if j not in cols:
+                    continue
+                k = match_col.get(j)
+                if k is None:
+                    found = True
+                elif k not in dist:
+                    dist[k] = dist[i] + 1
+                    queue.append(k)
+        return found, dist
+
+    def dfs(i, dist):
+        for j in adj[i]:
+            if j not in cols:
+                continue
+            k = match_col.get(j)
+            if k is None or (dist.get(k, INF) == dist[i] + 1 and dfs(k, dist)):
+                match_row[i] = j
+                match_col[j] = i
+                return True
+        dist[i] = INF
+        return False
+
+    size = 0
+    while True:
+        found, dist = bfs()
+        if not found:
+            return size
+        for i in rows:
+            if match_row[i] is None and dfs(i, dist):
+                size += 1
 
-def compare_answer(answers: list[str], info: list[list[str]]) -> tuple[int, list[tuple[int, int]]]:
+def compare_answer(answers: list[str], info: list[list[str]], hits: list[set[int]] = None) -> tuple[int, list[tuple[int, int]]]:
     """
     Compare answers with information and find the best matching path.
 
+    The score is the size of the maximum bipartite matching between answers and
+    info groups, where answer i can be matched with group j if any keyword of
+    group j appears in answer i.
+    The path is the same one the exhaustive search picks: answers are visited in
+    order, each one is left unmatched if the best score is still reachable without
+    it, otherwise it is matched with the first group that keeps the best score reachable.
+
     Parameters
     ----------
     answers : list[str]
         List of answer strings
     info : list[list[str]]
         List of information groups containing keywords
+    hits : list[set[int]], optional
+        The groups hit by each answer, e.g. from a cached KeywordMatcher.
+        If None, it is computed from answers and info.
 
     Returns
     -------
@@ -145,29 +293,28 @@ def compare_answer(answers: list[str], info: list[list[str]]) -> tuple[int, list
         - match_path: List of tuples containing matched indices
     """
     n, m = len(answers), len(info)
-    @lru_cache(maxsize=CACHE_SIZE)
-    def dfs(used_mask: int, idx: int) -> tuple[int, tuple[tuple[int, int], ...]]:
-        if idx == n:
-            return 0, ()
-
-        # Skip current answer[idx]
-        best_score, best_path = dfs(used_mask, idx + 1)
-
-        # Try matching with each info[j]
-        for j in range(m):
-            if not (used_mask & (1 << j)):
-                if any(keyword in answers[idx] for keyword in info[j]):
-                    new_score, new_path = dfs(used_mask | (1 << j), idx + 1)
-                    new_score += 1
-                    new_path = ((idx, j),) + new_path
-                    if new_score > best_score:
-                        best_score = new_score
-                        best_path = new_path
-
-        return best_score, best_path
-
-    score, match_path = dfs(0, 0)
-    return score, list(match_path)
+    if hits is None:
+        hits = KeywordMatcher(info).hit_matrix(answers)
+    adj = [sorted(hits[idx]) for idx in range(n)]
+    free = set(range(m))
+    score = max_bipartite_matching(adj, list(range(n)), free)
+
+    match_path = []
+    need = score
+    for idx in range(n):
+        if need == 0:
+            break
+        rest = list(range(idx + 1, n))
+        # Skip current answer[idx] if the remaining answers can still reach the score
+        if max_bipartite_matching(adj, rest, free) == need:
+            continue
+        for j in adj[idx]:
+            if j in free and max_bipartite_matching(adj, rest, free - {j}) == need - 1:
+                match_path.append((idx, j))
+                free.remove(j)
+                need -= 1
+                break
+    return score, match_path
 
 def test(received,data):
     """
@@ -202,9 +349,8 @@ def test(received,data):
                 info.append(currGroup)
     else:
         raise Exception("Please check the format of the received data")
-    if 'id' not in data:
-        data['id']='0'
-    result={'id':data['id'],'correctAnswer':data['answers'],'gotAnswer':answer}
+    # the record is not modified, an id-less record is reported with id '0'
+    result={'id':data.get('id','0'),'correctAnswer':data['answers'],'gotAnswer':answer}
     received_group=[i['index'] for i in answer]
     newGroupInfo=info
     result['badPartition']=bad_partition(received_group,newGroupInfo)
@@ -216,9 +362,10 @@ def test(received,data):
     result['NMIcorrect']=newGroupInfo
     result['NMIgot']=received_group
     selfinfo=data['answers']
+    matchers=getRecordMatchers(data)
     answers=[i['answer'] for i in answer]
     info=[i['answer_judge_keyword'] for i in selfinfo]
-    answerMatchScore,matchPath= compare_answer(answers,info)
+    answerMatchScore,matchPath= compare_answer(answers,info,matchers.answers.hit_matrix(answers))
     result['answerMatchCount']=answerMatchScore
     result['match']=[]
     result['answerScore']=0
@@ -228,7 +375,7 @@ def test(received,data):
     for match in matchPath:
         answerReason=answer[match[0]]['reason']
         infoReason=[i['reason_judge_keyword'] for i in selfinfo[match[1]]['reason']]
-        reasonMatches,_=compare_answer(answerReason,infoReason)
+        reasonMatches,_=compare_answer(answerReason,infoReason,matchers.reasons[match[1]].hit_matrix(answerReason))
         if len(answerReason)!=0:
             result['reasonScore']+=reasonMatches/((len(answerReason)*len(infoReason))**0.5)
         result['answerScore']+=1
@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import glob
+import argparse
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'generateResult'))
+
+from grade import test
+from resultStore import ResultStore, isStore
+
+
+"""
+Grade many results at once.
+
+Results are joined to dataset records by id, graded on a process pool, and the
+per-item results are streamed to a jsonl file in input order. At the end, the
+average NMI / answerScore / reasonScore and the badPartition counts are printed.
+"""
+
+# keys of a dataset record used by grade.test, the rest (e.g. website content) is not sent to the workers
+RECORD_KEYS = ('id', 'question', 'answers', 'final_answer')
+# keys of a result used by grade.test, the rest (e.g. the prompt) is not sent to the workers
+RESULT_KEYS = ('id', 'answer', 'info', 'answers')
+
+
+def loadResults(path: str):
+    """Yield the results to grade.
+
+    Parameters
+    ----------
+    path : str
+        A ResultStore folder, such as the output of generateResult/runAll.py (streamed
+        shard by shard, only the last record of each id, records that are not done are
+        skipped), a folder of .json files from generateResult/generate.py (the id is the
+        "id" key, or the file name without extension), or a .jsonl file with an "id" key
+        per line.
+    """
+    if isStore(path):
+        for result in ResultStore(path).records(latest=True):
+            if result.get('status', 'done') == 'done':
+                yield result
+    elif os.path.isdir(path):
+        for file in sorted(glob.glob(os.path.join(path, '*.json'))):
+            with open(file, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+            result.setdefault('id', os.path.splitext(os.path.basename(file))[0])
+            yield result
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    if result.get('status', 'done') == 'done':
+                        yield result
+
+
+def loadDataset(source: str, split: str = 'train') -> dict:
+    """Load the dataset records, indexed by id.
+
+    Parameters
+    ----------
+    source : str
+        A store folder from generateResult/datasetStore.py (page content is never read),
+        a result store from reproduceDataset/batch.py, a .jsonl file of records, or the
+        name of a HuggingFace dataset such as OracleY/ConfRAG
+    split : str, optional
+        The split of the HuggingFace dataset, by default "train"
+
+    Returns
+    -------
+    dict
+        id (as str) -> record, with only the keys needed for grading
+    """
+    if isStore(source):
+        records = (r['data'] for r in ResultStore(source).records(latest=True) if r.get('status') == 'done')
+    elif os.path.isdir(source):
+        from datasetStore import DatasetStore
+        store = DatasetStore(source)
+        records = [store.metadata(row) for row in range(len(store))]
+    elif os.path.exists(source):
+        records = []
+        with open(source, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    records.append(record['data'] if 'data' in record and 'answers' not in record else record)
+    else:
+        from datasets import load_dataset
+        records = load_dataset(source)[split]
+    return {str(r['id']): {k: r[k] for k in RECORD_KEYS if k in r} for r in records if 'id' in r}
+
+
+def gradeOne(pair: tuple[dict, dict]) -> dict:
+    received, data = pair
+    try:
+        return test(received, data)
+    except Exception as e:
+        return {'id': data.get('id'), 'error': str(e)}
+
+
+def gradeAll(results, dataset: dict, saveTo: str, workers: int = None, chunksize: int = 16) -> dict:
+    """Grade results against the dataset on a process pool.
+
+    Parameters
+    ----------
+    results : iterable of dict
+        The results to grade, each with an "id"
+    dataset : dict
+        The output of loadDataset
+    saveTo : str
+        The jsonl file for the per-item results
+    workers : int, optional
+        Number of processes, by default the number of cores
+    chunksize : int, optional
+        Number of items sent to a worker at once
+
+    Returns
+    -------
+    dict
+        The aggregate of the graded items, see showSummary
+    """
+    missing = []
+
+    def pairs():
+        for result in results:
+            key = str(result.get('id'))
+            if key not in dataset:
+                missing.append(key)
+                continue
+            yield {k: result[k] for k in RESULT_KEYS if k in result}, dict(dataset[key])
+
+    total = Counter()
+    badPartition = Counter()
+    errors = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(saveTo, 'w', encoding='utf-8') as f:
+        for result in pool.map(gradeOne, pairs(), chunksize=chunksize):
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+            if 'error' in result:
+                errors += 1
+                continue
+            total['count'] += 1
+            for key in ('NMI', 'answerScore', 'reasonScore'):
+                total[key] += result[key]
+            badPartition[result['badPartition']] += 1
+    count = total['count']
+    return {
+        'graded': count,
+        'errors': errors,
+        'missing': len(missing),
+        'NMI': total['NMI'] / count if count else 0,
+        'answerScore': total['answerScore'] / count if count else 0,
+        'reasonScore': total['reasonScore'] / count if count else 0,
+        'badPartition': dict(badPartition),
+    }
+
+
+def showSummary(summary: dict) -> None:
+    """
+    Display the aggregate of gradeAll.
+    """
+    print("graded: ", summary['graded'])
+    print("errors: ", summary['errors'])
+    print("missing in dataset: ", summary['missing'])
+    print("NMI: ", summary['NMI'])
+    print("answerScore: ", summary['answerScore'])
+    print("reasonScore: ", summary['reasonScore'])
+    for kind, count in sorted(summary['badPartition'].items()):
+        print(f"badPartition {kind}: ", count)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grade many results against the dataset")
+    parser.add_argument('results', help="A result store folder, a folder of result .json files, or a .jsonl file of results with ids")
+    parser.add_argument('--dataset', default="OracleY/ConfRAG", help="A store folder, a .jsonl file of records, or a HuggingFace dataset name")
+    parser.add_argument('--split', default='train')
+    parser.add_argument('--saveTo', default='grades.jsonl', help="The jsonl file for the per-item results")
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    showSummary(gradeAll(loadResults(args.results), loadDataset(args.dataset, args.split), args.saveTo, args.workers))
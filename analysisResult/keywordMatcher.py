@@ -0,0 +1,138 @@
+import json
+import hashlib
+import threading
+
+from collections import OrderedDict, deque
+from config import CACHE_SIZE, AC_MIN_KEYWORDS
+
+
+class KeywordMatcher:
+    """
+    Find which keyword groups appear in a text.
+
+    Group j hits a text if any of its keywords is a substring of the text, which is
+    the rule compare_answer uses. The keywords of all groups are compiled once into
+    an Aho-Corasick automaton, so each text is scanned a single time no matter how
+    many keywords there are. With fewer than AC_MIN_KEYWORDS keywords, plain substring
+    checks are faster in Python and are used instead.
+
+    Parameters
+    ----------
+    groups : list[list[str]]
+        List of keyword groups
+    """
+    def __init__(self, groups: list[list[str]]):
+        self.groups = [[str(keyword) for keyword in keywords] for keywords in groups]
+        # an empty keyword is a substring of every text
+        self.always = frozenset(j for j, keywords in enumerate(self.groups) if '' in keywords)
+        self.automaton = None
+        if sum(len(keywords) for keywords in self.groups) >= AC_MIN_KEYWORDS:
+            self.automaton = self._build()
+
+    def _build(self) -> tuple[list[dict], list[frozenset]]:
+        # trie
+        goto = [{}]
+        out = [set()]
+        for j, keywords in enumerate(self.groups):
+            for keyword in keywords:
+                if keyword == '':
+                    continue
+                node = 0
+                for ch in keyword:
+                    nxt = goto[node].get(ch)
+                    if nxt is None:
+                        nxt = len(goto)
+                        goto[node][ch] = nxt
+                        goto.append({})
+                        out.append(set())
+                    node = nxt
+                out[node].add(j)
+        # failure links in BFS order, then complete the transitions so scanning never follows a failure link
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            delta[node] = {**delta[fail[node]], **goto[node]}
+            for ch, child in goto[node].items():
+                fail[child] = delta[fail[node]].get(ch, 0)
+                out[child] |= out[fail[child]]
+                queue.append(child)
+        return delta, [frozenset(o) for o in out]
+
+    def groups_in(self, text: str) -> set[int]:
+        """
+        Indices of the groups that have a keyword in text.
+        """
+        if self.automaton is None or not isinstance(text, str):
+            return {j for j, keywords in enumerate(self.groups) if any(keyword in text for keyword in keywords)}
+        delta, out = self.automaton
+        hits = set(self.always)
+        node = 0
+        for ch in text:
+            node = delta[node].get(ch, 0)
+            if out[node]:
+                hits |= out[node]
+        return hits
+
+    def hit_matrix(self, texts: list[str]) -> list[set[int]]:
+        """
+        The text x group hit matrix, as the set of hit groups of each text.
+        """
+        return [self.groups_in(text) for text in texts]
+
+
+class RecordMatchers:
+    """
+    Compiled matchers of one dataset record.
+
+    Attributes
+    ----------
+    answers : KeywordMatcher
+        Matcher over the answer_judge_keyword of every answer group
+    reasons : list[KeywordMatcher]
+        For each answer group, matcher over the reason_judge_keyword of its reasons
+    """
+    def __init__(self, data: dict):
+        self.answers = KeywordMatcher([i['answer_judge_keyword'] for i in data['answers']])
+        self.reasons = [KeywordMatcher([r['reason_judge_keyword'] for r in i['reason']]) for i in data['answers']]
+
+
+_cache = OrderedDict()
+_cacheLock = threading.Lock()
+
+
+def getRecordMatchers(data: dict) -> RecordMatchers:
+    """
+    Get the compiled matchers of a record, reusing them across calls.
+
+    Matchers are cached by the record id (and question), keeping the CACHE_SIZE most
+    recently used records, so regrading many results against the same dataset
+    compiles each record once. A record without an id is cached by a hash of its judge
+    keywords, so it never gets the matchers of another record.
+
+    Parameters
+    ----------
+    data : dict
+        A dataset record, see reproduceDataset/ReadMe.md Output part
+
+    Returns
+    -------
+    RecordMatchers
+        The matchers of the record
+    """
+    if 'id' in data:
+        key = ('id', str(data['id']), data.get('question'))
+    else:
+        keywords = [[i['answer_judge_keyword'], [r['reason_judge_keyword'] for r in i['reason']]] for i in data['answers']]
+        key = ('keywords', hashlib.sha256(json.dumps(keywords, ensure_ascii=False, default=str).encode('utf-8')).hexdigest())
+    with _cacheLock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    matchers = RecordMatchers(data)
+    with _cacheLock:
+        _cache[key] = matchers
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return matchers
@@ -0,0 +1,214 @@
+"""
+Provider-side batch processing of chat calls (OpenAI Batch API).
+
+A job turns many chat requests into jsonl request files, uploads them, creates one batch
+per file, polls until the batches end, then downloads the output and error files. The
+result of each request is returned as (content, success), the same tuple chatWithGPT
+returns, so callers parse it the same way (e.g. with jsonClean).
+
+Requests that fail inside a batch (error lines, non-200 responses, or requests missing
+from an expired batch) are submitted again in a new round, up to BATCH_API_MAX_ROUNDS;
+what still fails is returned as a failure. The state of a job (its batch ids) is kept
+in its folder with the custom ids of its requests, so a job interrupted while waiting
+and run again with the same custom ids resumes polling the same batches instead of
+submitting them again, even if the request bodies were built again differently. A caller
+whose requests are not reproducible (e.g. sampled prompts) keeps what it needs to read
+the responses in the folder as well, see generateResult/runAll.py.
+
+Successful responses are also put in the LLM response cache (when enabled) under the
+key of the same online call, and the job is recorded as a "batch_job" span with its
+token usage.
+"""
+
+import os
+import json
+import time
+import hashlib
+from typing import Dict, List, Tuple
+
+from config import DEFAULT_MODEL, DEFAULT_TEMPERATURE, DEFAULT_MAX_TOKENS
+from config import BATCH_API_MAX_REQUESTS, BATCH_API_MAX_FILE_BYTES, BATCH_API_POLL_INTERVAL, BATCH_API_MAX_ROUNDS, BATCH_API_COMPLETION_WINDOW
+from Tools import getClient, getCache, _toMessages
+from cache import LLMCache
+from instrument import span, count
+
+ENDPOINT = "/v1/chat/completions"
+# statuses after which a batch does not change anymore
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def makeRequest(customId: str, messages, model: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE,
+                max_tokens: int = DEFAULT_MAX_TOKENS) -> dict:
+    """One line of a batch request file, with the same parameters as chatWithGPT."""
+    return {"custom_id": customId, "method": "POST", "url": ENDPOINT,
+            "body": {"model": model, "messages": _toMessages(messages), "temperature": temperature, "max_tokens": max_tokens}}
+
+
+def _readLines(content: str) -> List[dict]:
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def parseOutput(lines: List[dict]) -> Dict[str, Tuple[str, bool]]:
+    """custom_id -> (content, success) of the lines of an output or error file."""
+    results = {}
+    for line in lines:
+        response = line.get("response") or {}
+        body = response.get("body") or {}
+        if line.get("error"):
+            results[line["custom_id"]] = (str(line["error"].get("message", line["error"])), False)
+        elif response.get("status_code") != 200:
+            results[line["custom_id"]] = (str(body.get("error", body)), False)
+        else:
+            content = body["choices"][0]["message"]["content"]
+            results[line["custom_id"]] = (content, content is not None)
+            for counter, value in (body.get("usage") or {}).items():
+                if counter in ("prompt_tokens", "completion_tokens"):
+                    count(counter, value or 0)
+    return results
+
+
+class BatchJob:
+    """Run chat requests through the batch API.
+
+    Parameters
+    ----------
+    folder : str
+        Where the request files and the state of the job are kept
+    pollInterval : float, optional
+        Seconds between two status checks, by default from config
+    maxRequests : int, optional
+        Requests per batch, by default from config
+    maxRounds : int, optional
+        Number of submissions of a failed request, by default from config
+    maxBytes : int, optional
+        Bytes per request file (one file per batch), by default from config
+    """
+    def __init__(self, folder: str, pollInterval: float = BATCH_API_POLL_INTERVAL, maxRequests: int = BATCH_API_MAX_REQUESTS,
+                 maxRounds: int = BATCH_API_MAX_ROUNDS, maxBytes: int = BATCH_API_MAX_FILE_BYTES):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.pollInterval = pollInterval
+        self.maxRequests = maxRequests
+        self.maxBytes = maxBytes
+        self.maxRounds = maxRounds
+        self.statePath = os.path.join(folder, "job.json")
+
+    def _loadState(self, ids: str) -> dict:
+        if os.path.exists(self.statePath):
+            with open(self.statePath, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            # a finished job is not resumed, the same requests run again are a new job
+            if state.get("ids") == ids and not state.get("finished"):
+                return state
+        return {"ids": ids, "rounds": []}
+
+    def _saveState(self, state: dict) -> None:
+        tmp = self.statePath + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.statePath)
+
+    def _split(self, requests: List[dict]) -> List[List[bytes]]:
+        """The encoded lines of the requests, in files of at most maxRequests lines and maxBytes bytes."""
+        files = [[]]
+        size = 0
+        for request in requests:
+            line = (json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8")
+            if len(line) > self.maxBytes:
+                raise ValueError(f"request {request['custom_id']} is {len(line)} bytes, more than a request file can hold ({self.maxBytes})")
+            if len(files[-1]) >= self.maxRequests or size + len(line) > self.maxBytes:
+                files.append([])
+                size = 0
+            files[-1].append(line)
+            size += len(line)
+        return [lines for lines in files if lines]
+
+    def _submit(self, requests: List[dict], round: int) -> List[str]:
+        """Upload the requests in files of at most maxRequests lines and maxBytes bytes, create a batch per file."""
+        client = getClient()
+        batchIds = []
+        for k, lines in enumerate(self._split(requests)):
+            path = os.path.join(self.folder, f"requests-{round}-{k:04d}.jsonl")
+            with open(path, "wb") as f:
+                f.writelines(lines)
+            with open(path, "rb") as f:
+                uploaded = client.files.create(file=f, purpose="batch")
+            batch = client.batches.create(input_file_id=uploaded.id, endpoint=ENDPOINT, completion_window=BATCH_API_COMPLETION_WINDOW)
+            batchIds.append(batch.id)
+            print(f"submitted batch {batch.id} with {len(lines)} requests")
+        return batchIds
+
+    def _wait(self, batchIds: List[str]):
+        """Poll until every batch reached a final status, return the batches."""
+        client = getClient()
+        batches = {}
+        while True:
+            for batchId in batchIds:
+                if batchId not in batches or batches[batchId].status not in FINAL_STATUSES:
+                    batches[batchId] = client.batches.retrieve(batchId)
+            pending = [b for b in batches.values() if b.status not in FINAL_STATUSES]
+            if not pending:
+                return [batches[batchId] for batchId in batchIds]
+            counts = [b.request_counts for b in pending if b.request_counts is not None]
+            print(f"{len(pending)} batches in progress, {sum(c.completed for c in counts)}/{sum(c.total for c in counts)} requests completed")
+            time.sleep(self.pollInterval)
+
+    def _collect(self, batches) -> Dict[str, Tuple[str, bool]]:
+        client = getClient()
+        results = {}
+        for batch in batches:
+            for fileId in (batch.output_file_id, batch.error_file_id):
+                if fileId:
+                    results.update(parseOutput(_readLines(client.files.content(fileId).text)))
+            if batch.status != "completed":
+                print(f"batch {batch.id} ended as {batch.status}")
+        return results
+
+    def run(self, requests: List[dict]) -> Dict[str, Tuple[str, bool]]:
+        """Run the requests, see the module docstring.
+
+        Parameters
+        ----------
+        requests : List[dict]
+            Lines from makeRequest, with unique custom ids
+
+        Returns
+        -------
+        Dict[str, Tuple[str, bool]]
+            custom_id -> (content, success) for every request
+        """
+        # the job is the same as an interrupted one if it has the same requests, by custom id
+        ids = hashlib.sha256("\n".join(sorted(request["custom_id"] for request in requests)).encode("utf-8")).hexdigest()
+        state = self._loadState(ids)
+        byId = {request["custom_id"]: request for request in requests}
+        results = {}
+        with span("batch_job", requests=len(requests)) as jobSpan:
+            for round in range(self.maxRounds):
+                todo = [byId[customId] for customId in byId if customId not in results or not results[customId][1]]
+                if not todo:
+                    break
+                if round < len(state["rounds"]):
+                    # submitted before the job was interrupted
+                    batchIds = state["rounds"][round]
+                else:
+                    batchIds = self._submit(todo, round)
+                    state["rounds"].append(batchIds)
+                    self._saveState(state)
+                roundResults = self._collect(self._wait(batchIds))
+                for request in todo:
+                    results[request["custom_id"]] = roundResults.get(request["custom_id"], ("No result in the batch output", False))
+                failed = sum(1 for request in todo if not results[request["custom_id"]][1])
+                print(f"round {round + 1}: {len(todo) - failed} succeeded, {failed} failed")
+            state["finished"] = True
+            self._saveState(state)
+            failed = [customId for customId, (_, success) in results.items() if not success]
+            jobSpan.set(rounds=round + 1, failed=len(failed))
+            if failed:
+                jobSpan.fail(f"{len(failed)} requests failed")
+        cache = getCache()
+        if cache is not None:
+            for customId, (content, success) in results.items():
+                if success:
+                    body = byId[customId]["body"]
+                    cache.put(LLMCache.key(body["model"], body["messages"], body["temperature"], body["max_tokens"]), content)
+        return results
@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+
+import numpy as np
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root)
+sys.path.append(os.path.join(root, 'analysisResult'))
+sys.path.append(os.path.join(root, 'generateResult'))
+sys.path.append(os.path.join(root, 'reproduceDataset'))
+
+from grade import compute_soft_nmi, compute_soft_nmi_batch, compare_answer, bad_partition, test
+from generateIndex import generateIndex
+from generate import generate, PromptBuilder
+from Tools import jsonClean
+from extract import htmlToText
+from dedup import fingerprint, similarity
+from relevance import bm25
+from synthetic import Vocabulary, makeRecord, makeOutput, rawOutput, makeHtml
+
+
+"""
+Offline benchmarks of the grading, prompt-building, page extraction, deduplication and ranking hot paths.
+
+A workload of synthetic records and model outputs (see synthetic.py) is built from a
+seed, then each case calls its function over the workload and records the latency of
+every call. The report gives throughput and latency percentiles per case. Results can
+be saved as a baseline json and compared against later, to catch regressions.
+No model, search or network call is made.
+"""
+
+# workload sizes, any field can be overridden on the command line
+SIZES = {
+    'small': {'records': 100, 'groups': 3, 'websites': 5, 'keywords': 3, 'reasons': 2, 'pageLength': 2000},
+    'medium': {'records': 200, 'groups': 4, 'websites': 8, 'keywords': 5, 'reasons': 3, 'pageLength': 20000},
+    'large': {'records': 200, 'groups': 6, 'websites': 10, 'keywords': 10, 'reasons': 4, 'pageLength': 100000},
+}
+PERCENTILES = (50, 90, 99)
+
+
+class Workload:
+    """Records with a partition and a model output each, built from a seed."""
+    def __init__(self, seed: int = 0, records: int = 100, accuracy: float = 0.7, **sizes):
+        rng = random.Random(seed)
+        vocabulary = Vocabulary(rng)
+        # generateIndex draws from the global random module
+        random.seed(seed)
+        self.records = []
+        self.infos = []
+        self.outputs = []
+        for recordId in range(records):
+            record = makeRecord(rng, vocabulary, recordId, **sizes)
+            _, info = generateIndex(record)
+            output = makeOutput(rng, vocabulary, record, info, accuracy)
+            self.records.append(record)
+            self.infos.append(info)
+            self.outputs.append(output)
+        self.raw = [rawOutput(output) for output in self.outputs]
+        self.predictions = [[answer['index'] for answer in output['answers']] for output in self.outputs]
+        self.builders = [PromptBuilder(record) for record in self.records]
+        # one raw page per record, for the local extraction backend
+        self.pages = [makeHtml(rng, vocabulary, sizes.get('pageLength', 20000)).encode('utf-8') for _ in range(records)]
+        self.sketches = [fingerprint(record['websites'][0]['content']) for record in self.records]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+
+def _gradeOne(w: Workload, i: int):
+    return test({'answer': w.outputs[i], 'info': w.infos[i]}, w.records[i])
+
+
+def _compareAnswers(w: Workload, i: int):
+    answers = [answer['answer'] for answer in w.outputs[i]['answers']]
+    return compare_answer(answers, [answer['answer_judge_keyword'] for answer in w.records[i]['answers']])
+
+
+# name -> function of (workload, record position), one call is one timed operation
+CASES = {
+    'compute_soft_nmi': lambda w, i: compute_soft_nmi(w.infos[i], w.predictions[i]),
+    'compute_soft_nmi_batch[x100]': lambda w, i: compute_soft_nmi_batch(
+        [(w.infos[(i + k) % len(w)], w.predictions[(i + k) % len(w)]) for k in range(100)]),
+    'bad_partition': lambda w, i: bad_partition(w.predictions[i], w.infos[i]),
+    'compare_answer': _compareAnswers,
+    'test': _gradeOne,
+    'generateIndex': lambda w, i: generateIndex(w.records[i]),
+    'generate': lambda w, i: generate(w.records[i]),
+    'PromptBuilder.build[warm]': lambda w, i: w.builders[i].build(),
+    'jsonClean': lambda w, i: jsonClean(w.raw[i], ['answers']),
+    'htmlToText': lambda w, i: htmlToText(w.pages[i], 'https://example.com/page'),
+    'fingerprint': lambda w, i: fingerprint(w.records[i]['websites'][0]['content']),
+    'similarity': lambda w, i: similarity(w.sketches[i], w.sketches[(i + 1) % len(w)]),
+    'bm25': lambda w, i: bm25(w.records[i]['question'], [website['content'] for website in w.records[i]['websites']]),
+}
+
+
+def _presentedOrder(prompt: list[dict]) -> list:
+    """The website indexes of a test prompt, in the order the prompt lists them."""
+    websites = prompt[1]['content'].split('## Website Information\n', 1)[1]
+    return [website['index'] for website in json.loads(websites)]
+
+
+def checkPromptOrder(workload: Workload, samples: int = 4) -> list[str]:
+    """Records whose sampled prompts list the websites in any other order than by index.
+
+    A prompt that lists the websites of a group together would give the grouping the
+    model has to find away, so the order must only depend on which websites are in it.
+    """
+    failures = []
+    for i, record in enumerate(workload.records):
+        builder = PromptBuilder(record)
+        # drawn partitions, and a given one (the gold groups of the workload)
+        for built in builder.build_many((False,), samples, seed=i) + builder.build_many((False,), partitions=[workload.infos[i]]):
+            order = _presentedOrder(built['prompt'])
+            if order != sorted(order, key=int):
+                failures.append(f"record {record['id']}: websites {order} for groups {built['info']}")
+    return failures
+
+
+def timeCase(function, workload: Workload, calls: int, warmup: int = 1) -> list[int]:
+    """Latency in nanoseconds of each of calls calls, cycling over the workload."""
+    for i in range(min(warmup * len(workload), calls)):
+        function(workload, i % len(workload))
+    latencies = []
+    for i in range(calls):
+        start = time.perf_counter_ns()
+        function(workload, i % len(workload))
+        latencies.append(time.perf_counter_ns() - start)
+    return latencies
+
+
+def summarize(latencies: list[int]) -> dict:
+    """Throughput (calls per second) and latency statistics (microseconds)."""
+    values = np.asarray(latencies, dtype=np.float64) / 1000
+    total = values.sum()
+    summary = {
+        'calls': len(latencies),
+        'throughput': len(latencies) / (total / 1e6) if total > 0 else float('inf'),
+        'mean': float(values.mean()),
+        'max': float(values.max()),
+    }
+    for p in PERCENTILES:
+        summary[f'p{p}'] = float(np.percentile(values, p))
+    return summary
+
+
+def runBenchmarks(workload: Workload, cases: list[str], calls: int) -> dict:
+    results = {}
+    for name in cases:
+        results[name] = summarize(timeCase(CASES[name], workload, calls))
+        print(f"  {name}: done", file=sys.stderr)
+    return results
+
+
+def showResults(results: dict, baseline: dict = None) -> None:
+    """Print a table of the results, with the p50 ratio to the baseline if given."""
+    header = f"{'case':<30}{'calls':>8}{'ops/s':>12}{'mean us':>12}" + ''.join(f"{'p%d us' % p:>12}" for p in PERCENTILES) + f"{'max us':>12}"
+    if baseline is not None:
+        header += f"{'p50 vs base':>14}"
+    print(header)
+    for name, r in results.items():
+        line = f"{name:<30}{r['calls']:>8}{r['throughput']:>12.1f}{r['mean']:>12.1f}" + ''.join(f"{r['p%d' % p]:>12.1f}" for p in PERCENTILES) + f"{r['max']:>12.1f}"
+        if baseline is not None:
+            base = baseline['results'].get(name)
+            line += f"{r['p50'] / base['p50']:>13.2f}x" if base else f"{'-':>14}"
+        print(line)
+
+
+def compareBaseline(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Cases whose p50 latency is more than threshold times the baseline."""
+    return [name for name, r in results.items()
+            if name in baseline['results'] and r['p50'] > threshold * baseline['results'][name]['p50']]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark grading and prompt building on synthetic data")
+    parser.add_argument('--size', choices=SIZES, default='small')
+    parser.add_argument('--records', type=int, help="Number of synthetic records")
+    parser.add_argument('--groups', type=int, help="Answer groups per record")
+    parser.add_argument('--websites', type=int, help="Websites per record")
+    parser.add_argument('--keywords', type=int, help="Judge keywords per answer and reason")
+    parser.add_argument('--reasons', type=int, help="Reasons per answer group")
+    parser.add_argument('--pageLength', type=int, help="Characters per page content")
+    parser.add_argument('--accuracy', type=float, default=0.7, help="Probability that a synthetic answer has a right keyword")
+    parser.add_argument('--calls', type=int, default=None, help="Timed calls per case, by default 2 passes over the records")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--save', help="Save the results as a baseline json")
+    parser.add_argument('--compare', help="A baseline json to compare with")
+    parser.add_argument('--threshold', type=float, default=1.25, help="A case regresses when its p50 is this many times the baseline")
+    args = parser.parse_args()
+
+    params = dict(SIZES[args.size])
+    for key in params:
+        if getattr(args, key) is not None:
+            params[key] = getattr(args, key)
+    print(f"building workload {params} (seed {args.seed})", file=sys.stderr)
+    workload = Workload(args.seed, accuracy=args.accuracy, **params)
+    failures = checkPromptOrder(workload)
+    if failures:
+        print("sampled prompts leak the answer groups through the website order:", *failures[:5], sep='\n  ')
+        sys.exit(1)
+    calls = args.calls or 2 * len(workload)
+    results = runBenchmarks(workload, args.cases, calls)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['params'] != params or baseline['seed'] != args.seed:
+            print("warning: the baseline was run on a different workload", file=sys.stderr)
+    showResults(results, baseline)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'params': params, 'seed': args.seed, 'calls': calls,
+                       'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                       'results': results}, f, indent=4)
+        print("baseline saved to", args.save)
+    if baseline is not None:
+        regressions = compareBaseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"regressions (p50 > {args.threshold}x baseline):", ', '.join(regressions))
+            sys.exit(1)
+        print("no regression")
@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+from concurrent.futures import ThreadPoolExecutor
+
+root = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(root))
+sys.path.append(os.path.join(os.path.dirname(root), 'reproduceDataset'))
+
+from bench import summarize, PERCENTILES
+from synthetic import Vocabulary, makeHtml
+
+
+"""
+Benchmark of the local extraction backend (reproduceDataset/extract.py) against the
+reader service, on a corpus of saved HTML pages.
+
+A corpus is a folder with the raw pages and an index.json listing each file with its
+URL; --download builds one from a list of URLs. Without a corpus, synthetic pages are
+used (see synthetic.makeHtml). Three backends can be timed:
+- local: htmlToText on the saved pages, one by one for the latency, then on the
+  process pool for the throughput
+- local-live: fetchText on the URLs (download and extraction), as the pipeline runs it
+- reader: the reader service (READER_URL) on the URLs
+The URL backends run with --concurrency threads, like the crawl of a pipeline.
+"""
+
+
+def loadCorpus(folder: str) -> list[dict]:
+    """[{file, url, html}] of a saved corpus."""
+    with open(os.path.join(folder, 'index.json'), 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    for page in index:
+        with open(os.path.join(folder, page['file']), 'rb') as f:
+            page['html'] = f.read()
+    return index
+
+
+def syntheticCorpus(pages: int, pageLength: int, seed: int) -> list[dict]:
+    rng = random.Random(seed)
+    vocabulary = Vocabulary(rng)
+    return [{'file': None, 'url': f"https://example{k % 20}.com/article/{k}", 'html': makeHtml(rng, vocabulary, pageLength).encode('utf-8')}
+            for k in range(pages)]
+
+
+def downloadCorpus(urlsPath: str, folder: str) -> None:
+    """Save the raw HTML of each URL of a text file (one per line) into folder."""
+    from extract import download
+    os.makedirs(folder, exist_ok=True)
+    with open(urlsPath, 'r', encoding='utf-8') as f:
+        urls = [line.strip() for line in f if line.strip()]
+    index = []
+    for k, url in enumerate(urls):
+        try:
+            status, body, contentType = download(url)
+        except Exception as e:
+            print(f"skip {url}: {e}", file=sys.stderr)
+            continue
+        if status != 200 or not isinstance(body, bytes):
+            print(f"skip {url}: status {status}, {contentType}", file=sys.stderr)
+            continue
+        name = f"{k:05d}.html"
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(body)
+        index.append({'file': name, 'url': url})
+    with open(os.path.join(folder, 'index.json'), 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=4, ensure_ascii=False)
+    print(f"saved {len(index)}/{len(urls)} pages to {folder}")
+
+
+def _timed(function, *args) -> tuple[int, object]:
+    start = time.perf_counter_ns()
+    result = function(*args)
+    return time.perf_counter_ns() - start, result
+
+
+def _report(latencies: list[int], wall: float, pages: int, sizes: list[int]) -> dict:
+    summary = summarize(latencies)
+    # throughput of the whole run, not of the calls one by one
+    summary['throughput'] = pages / wall
+    summary['chars'] = sum(sizes) / max(1, len(sizes))
+    return summary
+
+
+def benchLocal(corpus: list[dict], workers: int) -> tuple[dict, dict]:
+    """Latency of htmlToText one page at a time, and throughput on the process pool."""
+    from extract import htmlToText, getPool, _extract
+    htmlToText(corpus[0]['html'], corpus[0]['url'])
+    start = time.perf_counter()
+    timed = [_timed(htmlToText, page['html'], page['url']) for page in corpus]
+    serial = _report([t for t, _ in timed], time.perf_counter() - start, len(corpus), [len(text) for _, text in timed])
+    pool = getPool()
+    # start the workers before timing
+    list(pool.map(_extract, [page['html'] for page in corpus[:workers]], [page['url'] for page in corpus[:workers]]))
+    start = time.perf_counter()
+    results = list(pool.map(_extract, [page['html'] for page in corpus], [page['url'] for page in corpus], chunksize=4))
+    wall = time.perf_counter() - start
+    pooled = {'calls': len(corpus), 'throughput': len(corpus) / wall, 'failed': sum(1 for status, _ in results if status != 200)}
+    return serial, pooled
+
+
+def benchUrls(function, urls: list[str], concurrency: int) -> dict:
+    """Latency and throughput of function(url) -> (status, text) over the URLs with concurrency threads."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        timed = list(pool.map(lambda url: _timed(function, url), urls))
+    wall = time.perf_counter() - start
+    ok = [(t, text) for t, (status, text) in timed if status == 200]
+    summary = _report([t for t, _ in timed], wall, len(urls), [len(text) for _, text in ok])
+    summary['failed'] = len(timed) - len(ok)
+    return summary
+
+
+def readerText(url: str) -> tuple[int, str]:
+    import requests
+    from config import READER_URL, READER_TIMEOUT
+    response = requests.post(READER_URL, headers={"Content-Type": "application/json"}, json={"url": url}, timeout=READER_TIMEOUT)
+    return response.status_code, response.text
+
+
+def showResults(results: dict) -> None:
+    print(f"{'backend':<16}{'pages':>7}{'pages/s':>10}{'mean ms':>10}" + ''.join(f"{'p%d ms' % p:>10}" for p in PERCENTILES) + f"{'chars':>9}{'failed':>8}")
+    for name, r in results.items():
+        latency = ''.join(f"{r[key] / 1000:>10.1f}" if key in r else f"{'-':>10}" for key in ['mean'] + [f'p{p}' for p in PERCENTILES])
+        chars = f"{r['chars']:>9.0f}" if 'chars' in r else f"{'-':>9}"
+        print(f"{name:<16}{r['calls']:>7}{r['throughput']:>10.1f}{latency}{chars}{r.get('failed', 0):>8}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark local HTML extraction against the reader service")
+    parser.add_argument('--corpus', help="Folder of saved pages with an index.json, synthetic pages if not given")
+    parser.add_argument('--download', metavar='URLS', help="Save the pages of a text file of URLs into --corpus, then exit")
+    parser.add_argument('--pages', type=int, default=200, help="Number of synthetic pages")
+    parser.add_argument('--page-length', type=int, default=20000, help="Characters of article text per synthetic page")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backends', nargs='+', choices=['local', 'local-live', 'reader'], default=['local'])
+    parser.add_argument('--workers', type=int, default=None, help="Processes of the extraction pool, by default EXTRACT_WORKERS")
+    parser.add_argument('--concurrency', type=int, default=8, help="Threads fetching URLs at the same time, CRAWL_WORKERS in a pipeline")
+    args = parser.parse_args()
+
+    if args.workers is not None:
+        import config
+        config.EXTRACT_WORKERS = args.workers
+    from config import EXTRACT_WORKERS
+    if args.download:
+        if not args.corpus:
+            parser.error("--download needs --corpus")
+        downloadCorpus(args.download, args.corpus)
+        sys.exit(0)
+    corpus = loadCorpus(args.corpus) if args.corpus else syntheticCorpus(args.pages, args.page_length, args.seed)
+    print(f"{len(corpus)} pages, {sum(len(page['html']) for page in corpus) / len(corpus) / 1024:.0f} KiB of HTML on average", file=sys.stderr)
+    results = {}
+    if 'local' in args.backends:
+        results['local'], results[f'local pool x{EXTRACT_WORKERS}'] = benchLocal(corpus, EXTRACT_WORKERS)
+    if 'local-live' in args.backends:
+        from extract import fetchText
+        results['local-live'] = benchUrls(fetchText, [page['url'] for page in corpus], args.concurrency)
+    if 'reader' in args.backends:
+        results['reader'] = benchUrls(readerText, [page['url'] for page in corpus], args.concurrency)
+    showResults(results)
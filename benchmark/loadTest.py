@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root)
+sys.path.append(os.path.join(root, 'reproduceDataset'))
+sys.path.append(os.path.join(root, 'generateResult'))
+
+from standIn import addArguments, fromArguments
+
+
+"""
+Load test of the dataset pipeline or the evaluation against the local stand-in.
+
+The stand-in server is started in this process (or an already running one is used
+with --url), config.py is pointed at it through the environment, and the caches are
+kept in memory so every request reaches the stand-in. Many questions (or synthetic
+records) are then run concurrently, and the throughput and the per-stage latency
+percentiles of instrument.py are reported.
+
+With --batch-api, the full-context calls (pipeline) or the test prompts (evaluation) go
+through a batch API job on the stand-in instead, see batchApi.py.
+"""
+
+
+def pointConfigAt(urls: dict) -> None:
+    """Set the environment read by config.py, must run before config is imported."""
+    os.environ.update(urls)
+    os.environ.setdefault('OPENAI_API_KEY', 'stand-in')
+    os.environ.setdefault('SERPAPI_API_KEY', 'stand-in')
+    # memory-only caches, so every run measures the services rather than the caches
+    os.environ['ROBOTS_CACHE_PATH'] = ''
+    os.environ['PAGE_CACHE_PATH'] = ''
+    os.environ['CHECKPOINT_PATH'] = ''
+    os.environ.pop('LLM_CACHE_PATH', None)
+    os.environ.setdefault('BATCH_API_POLL_INTERVAL', '0.5')
+
+
+def runPipelines(count: int, workers: int, hostDelay: float, batchApi: bool = False, extractor: str = 'reader', rank: bool = False) -> dict:
+    import pipeline
+    from batch import runBatch
+    # every stand-in page is on the same host, so the per-host politeness would serialize the crawl
+    pipeline.hostThrottle.delay = hostDelay
+    questions = [{'id': k, 'question': f"Load test question number {k}?"} for k in range(count)]
+    with tempfile.TemporaryDirectory() as folder:
+        return runBatch(questions, os.path.join(folder, 'store'), workers=workers,
+                        jobFolder=os.path.join(folder, 'job') if batchApi else None, extractor=extractor, rank=rank)
+
+
+def runEvaluation(count: int, workers: int, seed: int, batchApi: bool = False) -> dict:
+    from runAll import runAll, runAllBatch
+    from synthetic import Vocabulary, makeRecord
+    rng = random.Random(seed)
+    vocabulary = Vocabulary(rng)
+    records = [makeRecord(rng, vocabulary, k) for k in range(count)]
+    with tempfile.TemporaryDirectory() as folder:
+        if batchApi:
+            return runAllBatch(records, os.path.join(folder, 'store'), os.path.join(folder, 'job'))
+        return runAll(records, folder, workers=workers)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the pipeline or the evaluation against the local stand-in")
+    parser.add_argument('mode', choices=['pipeline', 'evaluation'])
+    parser.add_argument('--count', type=int, default=20, help="Number of questions or records")
+    parser.add_argument('--workers', type=int, default=None, help="Concurrent questions or records, by default from config")
+    parser.add_argument('--host-delay', type=float, default=0.0, help="CRAWL_HOST_DELAY used for the stand-in pages")
+    parser.add_argument('--url', help="Use a stand-in that is already running at this url instead of starting one")
+    parser.add_argument('--extractor', choices=['reader', 'local'], default='reader', help="How the pipeline turns stand-in pages into text")
+    parser.add_argument('--rank', action='store_true', help="Rank the pages of each question by relevance before the full-context calls")
+    parser.add_argument('--batch-api', action='store_true', help="Use a batch API job for the full-context calls or the test prompts")
+    parser.add_argument('--trace', help="Write the trace of the run to this json file")
+    addArguments(parser)
+    args = parser.parse_args()
+
+    standIn = None
+    if args.url:
+        url = args.url.rstrip('/')
+        pointConfigAt({'OPENAI_BASE_URL': url + '/v1', 'SERPAPI_BASE_URL': url, 'READER_URL': url + '/reader'})
+    else:
+        standIn = fromArguments(args).start()
+        pointConfigAt(standIn.urls())
+    checkpoints = None
+    if args.batch_api and args.mode == 'pipeline':
+        # the batch job hands its results to the pipelines through the checkpoints
+        checkpoints = tempfile.TemporaryDirectory()
+        os.environ['CHECKPOINT_PATH'] = checkpoints.name
+    from config import BATCH_WORKERS, EVAL_WORKERS
+    from instrument import tracer
+
+    tracer.keepSpans = bool(args.trace)
+    start = time.perf_counter()
+    if args.mode == 'pipeline':
+        summary = runPipelines(args.count, args.workers or BATCH_WORKERS, args.host_delay, args.batch_api, args.extractor, args.rank)
+    else:
+        summary = runEvaluation(args.count, args.workers or EVAL_WORKERS, args.seed, args.batch_api)
+    elapsed = time.perf_counter() - start
+    print(summary)
+    print(f"{args.count} {args.mode} runs in {elapsed:.1f}s, {args.count / elapsed:.2f} per second")
+    tracer.showSummary()
+    if args.trace:
+        tracer.export(args.trace)
+    if standIn is not None:
+        print("stand-in requests:", standIn.server.counts)
+        standIn.stop()
+    if checkpoints is not None:
+        checkpoints.cleanup()
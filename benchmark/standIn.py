@@ -0,0 +1,469 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import itertools
+import threading
+
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+"""
+Local stand-in for the services the pipeline and the evaluation call.
+
+One HTTP server answers:
+- POST /v1/chat/completions: OpenAI-compatible chat completions. The kind of call is
+  recognized from the user message (keywords, full-context, summarizing, merge or test prompt)
+  and answered with json that follows the schema of the matching prompt file
+- POST /v1/files, GET /v1/files/{id}/content, POST /v1/batches, GET /v1/batches/{id}:
+  the OpenAI batch API, see batchApi.py. A batch is answered in a background thread
+  after the "batch" latency, with the same completions as the chat endpoint; its error
+  rate is the share of requests that fail inside the batch (in the error file)
+- GET /search: a SerpAPI-shaped Google search response
+- POST /reader: reader-style page fetches ({"url": ...} -> page text)
+- GET /site{k}/...: the same pages as HTML with navigation and footer around the text,
+  for the local extractor (EXTRACTOR=local)
+- GET /robots.txt: allows everything
+
+Responses only depend on the request, so a run is reproducible. Each endpoint has a
+latency distribution (log-normal, given by its median and sigma) and an error rate;
+chat errors are 429 or 500 so the client retry path is exercised.
+Point OPENAI_BASE_URL, SERPAPI_BASE_URL and READER_URL at it (see urls()), for example
+with benchmark/loadTest.py.
+"""
+
+# page content marks its viewpoint, so every model answer about the page is consistent
+VIEWPOINT = re.compile(r"viewpoint (\d+)")
+WEBPAGE = re.compile(r"Webpage (\d+):\nAnswer: ([^\n]*)")
+INDEX = re.compile(r'"index": (\d+)')
+CLUSTERS = re.compile(r"until (\d+) clusters")
+SITE = re.compile(r"/site(\d+)/")
+CLUSTER_SET = re.compile(r"^Cluster set \d+:\n(.*)$", re.MULTILINE)
+
+
+class Behaviour:
+    """Latency and failures of one endpoint.
+
+    Parameters
+    ----------
+    median : float
+        Median latency in seconds
+    sigma : float, optional
+        Sigma of the log-normal latency, 0 for a constant latency
+    errorRate : float, optional
+        Probability that a request fails
+    """
+    def __init__(self, median: float, sigma: float = 0.0, errorRate: float = 0.0):
+        self.median = median
+        self.sigma = sigma
+        self.errorRate = errorRate
+
+    def latency(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0.0
+        return rng.lognormvariate(math.log(self.median), self.sigma) if self.sigma > 0 else self.median
+
+
+# endpoint -> default behaviour, roughly the shape of the real services
+DEFAULT_BEHAVIOURS = {
+    'chat': (1.0, 0.5, 0.0),
+    'search': (0.8, 0.3, 0.0),
+    'reader': (1.5, 0.6, 0.0),
+    'batch': (2.0, 0.0, 0.0),
+    'site': (0.3, 0.5, 0.0),
+}
+
+
+def _seed(*parts) -> int:
+    return int.from_bytes(hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode('utf-8')).digest()[:8], 'big')
+
+
+class Responder:
+    """The deterministic content of the responses.
+
+    Parameters
+    ----------
+    baseUrl : str
+        The url of the server, used in search result links
+    viewpoints : int, optional
+        Number of different answers a question has
+    uselessRate : float, optional
+        Share of pages the full-context call marks as not useful
+    results : int, optional
+        Number of organic results of a search
+    pageLength : int, optional
+        Number of characters of a page
+    duplicateRate : float, optional
+        Share of search results (after the first) that mirror the text of an earlier result
+    """
+    def __init__(self, baseUrl: str, viewpoints: int = 3, uselessRate: float = 0.2, results: int = 20, pageLength: int = 8000,
+                 duplicateRate: float = 0.0):
+        self.baseUrl = baseUrl
+        self.viewpoints = viewpoints
+        self.uselessRate = uselessRate
+        self.results = results
+        self.pageLength = pageLength
+        self.duplicateRate = duplicateRate
+        # slug of the result links -> query, so useful pages can be about it
+        self.queries = {}
+
+    def search(self, query: str, num: int) -> dict:
+        slug = hashlib.sha256(query.encode('utf-8')).hexdigest()[:12]
+        self.queries[slug] = query
+        results = [{'position': k + 1, 'title': f"{query} - result {k + 1}",
+                    'link': f"{self.baseUrl}/site{k}/{slug}/page", 'snippet': f"About {query}."}
+                   for k in range(min(num, self.results))]
+        return {'search_metadata': {'status': 'Success'}, 'search_parameters': {'q': query}, 'organic_results': results}
+
+    def page(self, url: str) -> str:
+        site = SITE.search(url)
+        mirror = random.Random(_seed('mirror', url))
+        if site and int(site.group(1)) > 0 and mirror.random() < self.duplicateRate:
+            # the same text under the title of this page
+            original = url.replace(site.group(0), f"/site{mirror.randrange(int(site.group(1)))}/", 1)
+            return '\n'.join([f"Title: page {url}"] + self.page(original).split('\n')[1:])
+        rng = random.Random(_seed('page', url))
+        viewpoint = rng.randrange(self.viewpoints)
+        useless = rng.random() < self.uselessRate
+        words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do']
+        query = self.queries.get(url.rstrip('/').split('/')[-2], '')
+        text = [f"Title: page {url}", '' if useless else f"This page supports viewpoint {viewpoint}. It is about {query}"]
+        while sum(len(line) + 1 for line in text) < self.pageLength:
+            text.append(' '.join(rng.choice(words) for _ in range(12)).capitalize() + '.')
+        return '\n'.join(text)
+
+    def html(self, url: str) -> str:
+        """The page as a website would serve it."""
+        title, *lines = self.page(url).split('\n')
+        paragraphs = ''.join(f"<p>{line}</p>" for line in lines if line)
+        menu = ''.join(f'<li><a href="/site{k}/">Section {k}</a></li>' for k in range(8))
+        return (f"<!DOCTYPE html><html><head><title>{title[len('Title: '):]}</title><script>var x = 1;</script></head>"
+                f"<body><nav><ul>{menu}</ul></nav><article><h1>{title[len('Title: '):]}</h1>{paragraphs}</article>"
+                f"<footer><p>Stand-in footer.</p><ul>{menu}</ul></footer></body></html>")
+
+    def chat(self, messages: list[dict]) -> str:
+        system = next((m['content'] for m in messages if m['role'] == 'system'), '')
+        user = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+        if user.startswith('## Question\n'):
+            return json.dumps(self._answer(system, user), ensure_ascii=False)
+        if user.startswith('Question: ') and '\nWebpage Content: ' in user:
+            return json.dumps(self._fullContext(user), ensure_ascii=False)
+        if user.startswith('Question: ') and '\nCluster set ' in user:
+            return json.dumps(self._merge(user), ensure_ascii=False)
+        if user.startswith('Question: '):
+            return json.dumps(self._summarize(user), ensure_ascii=False)
+        return json.dumps({'question_keyword': user.strip(), 'answer_keywords': []}, ensure_ascii=False)
+
+    def _fullContext(self, user: str) -> dict:
+        match = VIEWPOINT.search(user)
+        if match is None:
+            return {'answer': '', 'reason': [], 'additional': 'meaningless content', 'trust_score': 1}
+        v = match.group(1)
+        return {'answer': f"Answer {v}", 'reason': [f"Reason {v}.1", f"Reason {v}.2"], 'additional': '', 'trust_score': 7}
+
+    def _summarize(self, user: str) -> dict:
+        groups = {}
+        for index, answer in WEBPAGE.findall(user):
+            groups.setdefault(answer, []).append(int(index))
+        answers = []
+        for answer, indexes in groups.items():
+            v = answer.split()[-1]
+            answers.append({'answer': answer, 'answer judge keyword': [answer, f"viewpoint {v}"], 'index': indexes,
+                            'reason': [{'explain': f"Reason {v}.1", 'reason judge keyword': [f"Reason {v}.1"], 'index': indexes}]})
+        return {'answers': answers, 'additional': '', 'contradicts': len(answers) > 1}
+
+    def _merge(self, user: str) -> dict:
+        """Clusters of the same answer joined across the cluster sets, as the merge prompt asks."""
+        merged = {}
+        sets = [json.loads(line) for line in CLUSTER_SET.findall(user)]
+        for clusters in sets:
+            for cluster in clusters['answers']:
+                target = merged.setdefault(cluster['answer'], {**cluster, 'index': [], 'reason': []})
+                target['index'] = sorted(set(target['index']) | set(cluster['index']))
+                for reason in cluster['reason']:
+                    same = next((r for r in target['reason'] if r['explain'] == reason['explain']), None)
+                    if same is None:
+                        target['reason'].append(dict(reason))
+                    else:
+                        same['index'] = sorted(set(same['index']) | set(reason['index']))
+        additional = ' '.join(clusters['additional'] for clusters in sets if clusters['additional'])
+        return {'answers': list(merged.values()), 'additional': additional, 'contradicts': len(merged) > 1}
+
+    def _answer(self, system: str, user: str) -> dict:
+        indexes = sorted({int(i) for i in INDEX.findall(user)})
+        match = CLUSTERS.search(system)
+        clusters = max(1, min(len(indexes), int(match.group(1)) if match else 2))
+        rng = random.Random(_seed('answer', user))
+        rng.shuffle(indexes)
+        answers = []
+        for k in range(clusters):
+            group = sorted(indexes[k::clusters])
+            answers.append({'answer': f"Answer {k}", 'index': group, 'reason': [f"Reason {k}.1"]})
+        return {'answers': answers}
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, behaviours: dict, responder: Responder, seed: int = 0):
+        super().__init__(address, Handler)
+        self.behaviours = behaviours
+        self.responder = responder
+        self.rng = random.Random(seed)
+        self.rngLock = threading.Lock()
+        self.counts = {name: 0 for name in behaviours}
+        # uploaded and produced files, and batches, of the batch API
+        self.files = {}
+        self.batches = {}
+        self.ids = itertools.count(1)
+        self.batchLock = threading.Lock()
+
+    def draw(self, endpoint: str) -> tuple[float, bool]:
+        """Latency and failure of one request."""
+        behaviour = self.behaviours[endpoint]
+        with self.rngLock:
+            self.counts[endpoint] += 1
+            return behaviour.latency(self.rng), self.rng.random() < behaviour.errorRate
+
+    def completion(self, body: dict) -> dict:
+        """The chat completion object answering a request body."""
+        # imported here, so that importing this module does not load config.py before loadTest.py sets its environment
+        from tokenBudget import countTokens
+        messages = body.get('messages', [])
+        content = self.responder.chat(messages)
+        promptTokens = sum(countTokens(m.get('content') or '') for m in messages)
+        completionTokens = countTokens(content)
+        return {
+            'id': f"chatcmpl-standin-{_seed(messages) % 10 ** 12}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stand-in'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': promptTokens, 'completion_tokens': completionTokens, 'total_tokens': promptTokens + completionTokens},
+        }
+
+    def addFile(self, filename: str, purpose: str, content: bytes) -> dict:
+        with self.batchLock:
+            fileId = f"file-standin-{next(self.ids)}"
+            self.files[fileId] = ({'id': fileId, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                                   'filename': filename, 'purpose': purpose, 'status': 'processed'}, content)
+        return self.files[fileId][0]
+
+    def createBatch(self, body: dict) -> dict:
+        with self.batchLock:
+            batchId = f"batch-standin-{next(self.ids)}"
+            self.batches[batchId] = {'id': batchId, 'object': 'batch', 'endpoint': body.get('endpoint'), 'errors': None,
+                                     'input_file_id': body.get('input_file_id'), 'completion_window': body.get('completion_window'),
+                                     'status': 'in_progress', 'output_file_id': None, 'error_file_id': None,
+                                     'created_at': int(time.time()), 'request_counts': {'total': 0, 'completed': 0, 'failed': 0}}
+        threading.Thread(target=self._runBatch, args=(batchId,), daemon=True).start()
+        return self.batches[batchId]
+
+    def _runBatch(self, batchId: str) -> None:
+        batch = self.batches[batchId]
+        if batch['input_file_id'] not in self.files:
+            batch.update(status='failed', errors={'object': 'list', 'data': [{'code': 'invalid_file', 'message': 'input file not found'}]})
+            return
+        lines = [json.loads(line) for line in self.files[batch['input_file_id']][1].decode('utf-8').splitlines() if line.strip()]
+        batch['request_counts']['total'] = len(lines)
+        latency, _ = self.draw('batch')
+        time.sleep(latency)
+        output, errors = [], []
+        for line in lines:
+            with self.rngLock:
+                failed = self.rng.random() < self.behaviours['batch'].errorRate
+                asErrorLine = self.rng.random() < 0.5
+            requestId = f"req-standin-{next(self.ids)}"
+            if not failed:
+                output.append({'id': requestId, 'custom_id': line['custom_id'], 'error': None,
+                               'response': {'status_code': 200, 'request_id': requestId, 'body': self.completion(line['body'])}})
+            elif asErrorLine:
+                errors.append({'id': requestId, 'custom_id': line['custom_id'], 'response': None,
+                               'error': {'code': 'server_error', 'message': 'stand-in batch error'}})
+            else:
+                errors.append({'id': requestId, 'custom_id': line['custom_id'], 'error': None,
+                               'response': {'status_code': 500, 'request_id': requestId,
+                                            'body': {'error': {'message': 'stand-in batch error', 'type': 'server_error'}}}})
+        for key, produced in (('output_file_id', output), ('error_file_id', errors)):
+            if produced:
+                content = ''.join(json.dumps(line, ensure_ascii=False) + '\n' for line in produced).encode('utf-8')
+                batch[key] = self.addFile(f"{batchId}-{key}.jsonl", 'batch_output', content)['id']
+        batch['request_counts'].update(completed=len(output), failed=len(errors))
+        batch.update(status='completed', completed_at=int(time.time()))
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body, contentType: str = 'application/json') -> None:
+        data = (json.dumps(body, ensure_ascii=False) if contentType == 'application/json' else body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _raw(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _upload(self, data: bytes) -> dict:
+        """The fields of a multipart/form-data body, name -> (filename, content)."""
+        header = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode('utf-8')
+        message = BytesParser(policy=HTTP).parsebytes(header + data)
+        return {part.get_param('name', header='content-disposition'): (part.get_filename(), part.get_payload(decode=True))
+                for part in message.iter_parts()}
+
+    def _delay(self, endpoint: str) -> bool:
+        """Wait for the drawn latency, return True if the request should fail."""
+        latency, failed = self.server.draw(endpoint)
+        time.sleep(latency)
+        return failed
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path == '/robots.txt':
+            self._send(200, "User-agent: *\nAllow: /\n", 'text/plain')
+        elif parsed.path.startswith('/v1/files/') or parsed.path.startswith('/v1/batches/'):
+            self._batchApi(parsed.path)
+        elif parsed.path == '/search':
+            query = parse_qs(parsed.query)
+            if self._delay('search'):
+                self._send(500, {'error': 'stand-in search error'})
+                return
+            self._send(200, self.server.responder.search(query.get('q', [''])[0], int(query.get('num', ['10'])[0])))
+        elif parsed.path.startswith('/site'):
+            if self._delay('site'):
+                self._send(503, 'stand-in site error', 'text/plain')
+                return
+            self._send(200, self.server.responder.html(self.server.responder.baseUrl + parsed.path), 'text/html; charset=utf-8')
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        data = self._raw()
+        if path == '/v1/files':
+            fields = self._upload(data)
+            filename, content = fields.get('file', ('upload.jsonl', b''))
+            self._send(200, self.server.addFile(filename, fields.get('purpose', (None, b''))[1].decode('utf-8'), content))
+            return
+        body = json.loads(data or b'{}')
+        if path.endswith('/chat/completions'):
+            self._chat(body)
+        elif path == '/v1/batches':
+            self._send(200, self.server.createBatch(body))
+        elif path == '/reader':
+            if self._delay('reader'):
+                self._send(503, 'stand-in reader error', 'text/plain')
+                return
+            self._send(200, self.server.responder.page(body.get('url', '')), 'text/plain')
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def _chat(self, body: dict) -> None:
+        if self._delay('chat'):
+            with self.server.rngLock:
+                status = 429 if self.server.rng.random() < 0.5 else 500
+            self._send(status, {'error': {'message': 'stand-in error', 'type': 'rate_limit_error' if status == 429 else 'server_error', 'code': None}})
+            return
+        self._send(200, self.server.completion(body))
+
+    def _batchApi(self, path: str) -> None:
+        parts = path.strip('/').split('/')
+        if parts[1] == 'files' and parts[2] in self.server.files:
+            meta, content = self.server.files[parts[2]]
+            if parts[3:] == ['content']:
+                self._send(200, content.decode('utf-8'), 'application/octet-stream')
+            else:
+                self._send(200, meta)
+        elif parts[1] == 'batches' and parts[2] in self.server.batches:
+            self._send(200, self.server.batches[parts[2]])
+        else:
+            self._send(404, {'error': {'message': 'not found', 'type': 'invalid_request_error'}})
+
+
+class StandIn:
+    """Run the stand-in server in a background thread.
+
+    Parameters
+    ----------
+    port : int, optional
+        0 picks a free port
+    behaviours : dict, optional
+        endpoint ("chat", "search", "reader", "batch", "site") -> Behaviour, by default DEFAULT_BEHAVIOURS
+    seed : int, optional
+        Seed of the latency and error draws
+    **responder
+        Passed to Responder
+    """
+    def __init__(self, port: int = 0, behaviours: dict = None, seed: int = 0, **responder):
+        behaviours = {name: Behaviour(*values) for name, values in DEFAULT_BEHAVIOURS.items()} | (behaviours or {})
+        self.server = StandInServer(('127.0.0.1', port), behaviours, None, seed)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.server.responder = Responder(self.url, **responder)
+        self.thread = None
+
+    def urls(self) -> dict:
+        """The environment variables that point config.py at the stand-in."""
+        return {'OPENAI_BASE_URL': self.url + '/v1', 'SERPAPI_BASE_URL': self.url, 'READER_URL': self.url + '/reader'}
+
+    def start(self) -> 'StandIn':
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def parseBehaviour(text: str) -> Behaviour:
+    """Parse "median[,sigma[,errorRate]]", e.g. "0.8,0.5,0.02"."""
+    return Behaviour(*[float(value) for value in text.split(',')])
+
+
+def addArguments(parser: argparse.ArgumentParser) -> None:
+    """Arguments shared by this script and loadTest.py."""
+    for name, (median, sigma, errorRate) in DEFAULT_BEHAVIOURS.items():
+        parser.add_argument(f'--{name}', type=parseBehaviour, default=None,
+                            help=f"Latency median,sigma,errorRate of {name} requests, by default {median},{sigma},{errorRate}")
+    parser.add_argument('--viewpoints', type=int, default=3, help="Number of different answers of a question")
+    parser.add_argument('--useless-rate', type=float, default=0.2, help="Share of pages the full-context call rejects")
+    parser.add_argument('--results', type=int, default=20, help="Organic results per search")
+    parser.add_argument('--page-length', type=int, default=8000, help="Characters per page")
+    parser.add_argument('--duplicate-rate', type=float, default=0.0, help="Share of results mirroring an earlier result")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def fromArguments(args: argparse.Namespace, port: int = 0) -> StandIn:
+    behaviours = {name: getattr(args, name) for name in DEFAULT_BEHAVIOURS if getattr(args, name) is not None}
+    return StandIn(port, behaviours, args.seed, viewpoints=args.viewpoints, uselessRate=args.useless_rate,
+                   results=args.results, pageLength=args.page_length, duplicateRate=args.duplicate_rate)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve local stand-ins of the chat, search and reader services")
+    parser.add_argument('--port', type=int, default=8765)
+    addArguments(parser)
+    args = parser.parse_args()
+    standIn = fromArguments(args, args.port)
+    for name, value in standIn.urls().items():
+        print(f"export {name}={value}")
+    print("serving, press Ctrl+C to stop")
+    try:
+        standIn.server.serve_forever()
+    except KeyboardInterrupt:
+        standIn.stop()
@@ -0,0 +1,201 @@
+import json
+import random
+import string
+
+
+"""
+Synthetic ConfRAG-shaped records and model outputs for the benchmarks.
+
+The records follow reproduceDataset/ReadMe.md Output part, and the outputs follow the
+answer format of generateResult/TestPrompt.txt, so every function under benchmark sees
+the same shapes it sees on the real dataset. Everything is generated from a seed, so a
+benchmark run is reproducible and needs no network.
+"""
+
+
+class Vocabulary:
+    """Random lowercase words, drawn from a fixed pool so keywords reappear in texts."""
+    def __init__(self, rng: random.Random, size: int = 5000):
+        self.rng = rng
+        self.words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))) for _ in range(size)]
+
+    def word(self) -> str:
+        return self.rng.choice(self.words)
+
+    def sentence(self, length: int) -> str:
+        return ' '.join(self.word() for _ in range(length))
+
+    def text(self, chars: int) -> str:
+        """About chars characters of sentences."""
+        parts = []
+        total = 0
+        while total < chars:
+            sentence = self.sentence(self.rng.randint(8, 20)).capitalize() + '.'
+            parts.append(sentence)
+            total += len(sentence) + 1
+        return ' '.join(parts)
+
+
+def makeRecord(rng: random.Random, vocabulary: Vocabulary, recordId: int = 0, groups: int = 3, websites: int = 6,
+               keywords: int = 3, reasons: int = 2, pageLength: int = 20000) -> dict:
+    """Generate one dataset record.
+
+    Parameters
+    ----------
+    rng : random.Random
+        The source of randomness
+    vocabulary : Vocabulary
+        Words used for answers, keywords and page content
+    recordId : int, optional
+        The id of the record
+    groups : int, optional
+        Number of answer groups, at least 2
+    websites : int, optional
+        Number of websites, at least groups + 1 so that one group has several websites
+    keywords : int, optional
+        Number of judge keywords of each answer and each reason
+    reasons : int, optional
+        Number of reasons of each answer group
+    pageLength : int, optional
+        Number of characters of each page content
+
+    Returns
+    -------
+    dict
+        A record that generateIndex can always partition
+    """
+    groups = max(2, groups)
+    websites = max(groups + 1, websites)
+    indexes = list(range(1, websites + 1))
+    rng.shuffle(indexes)
+    # every group gets one website, the rest are spread at random
+    members = [[index] for index in indexes[:groups]]
+    for index in indexes[groups:]:
+        rng.choice(members).append(index)
+    answers = []
+    for group in members:
+        answerKeywords = [vocabulary.word() for _ in range(keywords)]
+        answers.append({
+            'answer': vocabulary.sentence(6) + ' ' + answerKeywords[0],
+            'answer_judge_keyword': answerKeywords,
+            'index': sorted(group),
+            'reason': [{'explain': vocabulary.sentence(12), 'reason_judge_keyword': [vocabulary.word() for _ in range(keywords)]}
+                       for _ in range(reasons)],
+        })
+    groupOf = {index: k for k, group in enumerate(members) for index in group}
+    websiteList = []
+    for index in range(1, websites + 1):
+        answer = answers[groupOf[index]]
+        websiteList.append({
+            'content': vocabulary.text(pageLength),
+            'answer': answer['answer'],
+            'reason': [reason['explain'] for reason in answer['reason']],
+            'additional': vocabulary.sentence(8),
+            'trust score': rng.randint(1, 10),
+            'index': index,
+            'website': f'https://site{recordId}-{index}.example.com/{vocabulary.word()}',
+        })
+    return {
+        'id': recordId,
+        'question': vocabulary.sentence(10).capitalize() + '?',
+        'contradicts': True,
+        'answers': answers,
+        'websites': websiteList,
+        'final_answer': {'answers': answers},
+    }
+
+
+def makeOutput(rng: random.Random, vocabulary: Vocabulary, record: dict, info: list[list[int]], accuracy: float = 0.7) -> dict:
+    """Generate a model output for the websites of a partition.
+
+    Each group of info is answered with a keyword of its true answer with probability
+    accuracy, and some groups are merged or split, so grading goes through both the
+    normal and the bad partition paths.
+
+    Parameters
+    ----------
+    rng : random.Random
+        The source of randomness
+    vocabulary : Vocabulary
+        Words used for wrong answers
+    record : dict
+        The record, from makeRecord
+    info : list[list[int]]
+        The partition given to the model, as returned by generateIndex
+    accuracy : float, optional
+        Probability that an answer or a reason contains a right keyword
+
+    Returns
+    -------
+    dict
+        {"answers": [{"answer", "index", "reason"}]}
+    """
+    groupOf = {index: k for k, answer in enumerate(record['answers']) for index in answer['index']}
+    groups = [list(group) for group in info]
+    if len(groups) > 2 and rng.random() < 0.2:
+        groups[0] = groups[0] + groups.pop(1)
+    elif rng.random() < 0.2:
+        big = [group for group in groups if len(group) > 1]
+        if big:
+            group = big[0]
+            groups.remove(group)
+            groups += [group[:1], group[1:]]
+    answers = []
+    for group in groups:
+        truth = record['answers'][groupOf[group[0]]]
+        if rng.random() < accuracy:
+            answer = vocabulary.sentence(5) + ' ' + rng.choice(truth['answer_judge_keyword'])
+        else:
+            answer = vocabulary.sentence(6)
+        reasons = []
+        for reason in truth['reason']:
+            if rng.random() < accuracy:
+                reasons.append(vocabulary.sentence(8) + ' ' + rng.choice(reason['reason_judge_keyword']))
+            else:
+                reasons.append(vocabulary.sentence(9))
+        answers.append({'answer': answer, 'index': group, 'reason': reasons})
+    return {'answers': answers}
+
+
+def rawOutput(output: dict) -> str:
+    """The output as a model would send it: a json block inside markdown."""
+    return "Here is my answer:\n```json\n" + json.dumps(output, indent=4, ensure_ascii=False) + "\n```"
+
+
+def makeHtml(rng: random.Random, vocabulary: Vocabulary, pageLength: int = 20000, paragraphs: list[str] = None) -> str:
+    """A web page with about pageLength characters of article text, wrapped in the usual
+    boilerplate (scripts, styles, navigation, sidebar, comments, footer) that extraction
+    has to remove. paragraphs are placed first in the article, e.g. to carry a marker."""
+    title = vocabulary.sentence(rng.randint(4, 8)).capitalize()
+    links = ''.join(f'<li><a href="/{vocabulary.word()}">{vocabulary.word().capitalize()}</a></li>' for _ in range(12))
+    head = (f"<head><meta charset=\"utf-8\"><title>{title} | {vocabulary.word().capitalize()} News</title>"
+            f"<style>body {{font-family: sans-serif}} .nav li {{display: inline}}</style>"
+            f"<script>window.dataLayer = [{json.dumps(vocabulary.sentence(20))}];</script></head>")
+    article = [f"<h1>{title}</h1>", f"<p class=\"byline\">By {vocabulary.word().capitalize()} {vocabulary.word().capitalize()}</p>"]
+    article += [f"<p>{paragraph}</p>" for paragraph in paragraphs or []]
+    total = 0
+    while total < pageLength:
+        kind = rng.random()
+        if kind < 0.1:
+            block = f"<h2>{vocabulary.sentence(rng.randint(3, 6)).capitalize()}</h2>"
+        elif kind < 0.2:
+            block = '<ul>' + ''.join(f"<li>{vocabulary.sentence(rng.randint(5, 12))}</li>" for _ in range(rng.randint(3, 6))) + '</ul>'
+        elif kind < 0.25:
+            rows = ''.join('<tr>' + ''.join(f"<td>{vocabulary.word()}</td>" for _ in range(4)) + '</tr>' for _ in range(rng.randint(3, 8)))
+            block = f"<table><tbody>{rows}</tbody></table>"
+        else:
+            text = vocabulary.text(rng.randint(300, 900))
+            words = text.split(' ')
+            position = rng.randrange(len(words))
+            words[position] = f"<a href=\"https://{vocabulary.word()}.com/{vocabulary.word()}\">{words[position]}</a>"
+            block = f"<p>{' '.join(words)}</p>"
+        article.append(block)
+        total += len(block)
+    comments = ''.join(f"<div class=\"comment\"><b>{vocabulary.word()}</b><p>{vocabulary.sentence(rng.randint(5, 15))}</p></div>" for _ in range(5))
+    body = (f"<body><header><nav class=\"nav\"><ul>{links}</ul></nav></header>"
+            f"<main><article>{''.join(article)}</article>"
+            f"<aside class=\"sidebar\"><h3>Related</h3><ul>{links}</ul></aside>"
+            f"<section class=\"comments\">{comments}</section></main>"
+            f"<footer><p>Copyright {vocabulary.word()}. All rights reserved.</p><ul>{links}</ul></footer>"
+            f"<script src=\"/static/app.js\"></script></body>")
+    return f"<!DOCTYPE html><html lang=\"en\">{head}{body}</html>"
@@ -0,0 +1,150 @@
+"""
+Persistent caches backed by SQLite.
+
+SQLite can be shared between threads (one connection guarded by a lock) and between
+processes (file locking with a WAL journal), so the same cache file can be used by a
+batch run with many workers, or by several runs at once.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import List, Dict, Optional
+
+from config import LLM_CACHE_MAX_BYTES, LLM_CACHE_TOUCH_INTERVAL
+
+
+class SqliteCache:
+    """Base class of the caches: one SQLite connection, guarded by a lock.
+
+    Subclasses set SCHEMA and use execute / transaction to access the tables.
+    Hits and misses are counted in the current process.
+    """
+    SCHEMA = ""
+
+    def __init__(self, path: str):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def execute(self, sql: str, params: tuple = ()) -> list:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def transaction(self):
+        """Context manager holding the lock and a write transaction."""
+        return _Transaction(self)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+class _Transaction:
+    def __init__(self, cache: SqliteCache):
+        self.cache = cache
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.cache.lock.acquire()
+        self.cache.conn.execute("BEGIN IMMEDIATE")
+        return self.cache.conn
+
+    def __exit__(self, excType, exc, tb) -> None:
+        try:
+            self.cache.conn.execute("ROLLBACK" if excType is not None else "COMMIT")
+        finally:
+            self.cache.lock.release()
+
+
+class LLMCache(SqliteCache):
+    """Content-addressed cache of chat responses.
+
+    The key is a hash of (model, messages, temperature, max_tokens), so the same
+    call returns the same response on every rerun. Once the stored responses exceed
+    maxBytes, the least recently used ones are evicted.
+    A hit is a plain read: the access time used for eviction is only written again once
+    it is older than touchInterval, so concurrent lookups do not queue for the write lock.
+
+    Parameters
+    ----------
+    path : str
+        The SQLite file of the cache
+    maxBytes : int, optional
+        Maximum total size of the stored responses, by default from config
+    touchInterval : float, optional
+        Seconds before a hit records its access time again, by default from config
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        last_access REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access);
+    CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    INSERT OR IGNORE INTO meta VALUES ('total_size', 0);
+    """
+
+    def __init__(self, path: str, maxBytes: int = LLM_CACHE_MAX_BYTES, touchInterval: float = LLM_CACHE_TOUCH_INTERVAL):
+        super().__init__(path)
+        self.maxBytes = maxBytes
+        self.touchInterval = touchInterval
+
+    @staticmethod
+    def key(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+        payload = json.dumps([model, messages, temperature, max_tokens], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a cached response, None if the key is not cached."""
+        rows = self.execute("SELECT response, last_access FROM responses WHERE key=?", (key,))
+        if not rows:
+            self.misses += 1
+            return None
+        response, lastAccess = rows[0]
+        now = time.time()
+        if now - lastAccess > self.touchInterval:
+            # a single autocommit statement, the lookup itself took no write lock
+            self.execute("UPDATE responses SET last_access=? WHERE key=?", (now, key))
+        self.hits += 1
+        return response
+
+    def put(self, key: str, response: str) -> None:
+        """Store a response, then evict the least recently used ones if the cache is too large."""
+        size = len(response.encode("utf-8"))
+        with self.transaction() as conn:
+            row = conn.execute("SELECT size FROM responses WHERE key=?", (key,)).fetchone()
+            oldSize = row[0] if row is not None else 0
+            conn.execute("INSERT OR REPLACE INTO responses VALUES (?,?,?,?)", (key, response, size, time.time()))
+            conn.execute("UPDATE meta SET value=value+? WHERE name='total_size'", (size - oldSize,))
+            total = conn.execute("SELECT value FROM meta WHERE name='total_size'").fetchone()[0]
+            while total > self.maxBytes:
+                victims = conn.execute("SELECT key, size FROM responses ORDER BY last_access LIMIT 64").fetchall()
+                if not victims:
+                    break
+                for victim, victimSize in victims:
+                    conn.execute("DELETE FROM responses WHERE key=?", (victim,))
+                    total -= victimSize
+                    if total <= self.maxBytes:
+                        break
+                conn.execute("UPDATE meta SET value=? WHERE name='total_size'", (total,))
+
+    def stats(self) -> Dict[str, int]:
+        result = super().stats()
+        count, total = self.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses")[0]
+        result.update({"entries": count, "bytes": total})
+        return result
@@ -10,20 +10,90 @@ import os
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1')
 SERPAPI_API_KEY = os.environ.get('SERPAPI_API_KEY')
+SERPAPI_BASE_URL = os.environ.get('SERPAPI_BASE_URL', 'https://serpapi.com')  # e.g. a local stand-in, see benchmark/standIn.py
 
 # Model Configuration
 DEFAULT_MODEL = "gpt-4o"
 DEFAULT_TEMPERATURE = 0.1
 DEFAULT_MAX_TOKENS = 1000
+MODEL_PRICES = {"gpt-4o": (2.5, 10.0)}  # USD per 1M input / output tokens, for the cost estimate of instrument.py
+TRACE_SAMPLE_SIZE = 10000  # Durations kept per span name for the p50 / p95 of the instrument.py summary
+
+# OpenAI client configuration
+OPENAI_TIMEOUT = 60  # Seconds before a chat request is given up
+OPENAI_MAX_RETRIES = 3  # Retries after a connection error, timeout, rate limit or server error
+OPENAI_BACKOFF_BASE = 1.0  # Seconds, the backoff before retry k is drawn from [0, OPENAI_BACKOFF_BASE * 2**k]
+OPENAI_BACKOFF_MAX = 30.0  # Upper bound of a single backoff in seconds
+OPENAI_MAX_CONNECTIONS = 256  # Size of the shared HTTP connection pool
+
+# Batch API configuration, see batchApi.py
+BATCH_API_MAX_REQUESTS = 50000  # Requests per submitted batch, the provider limit
+BATCH_API_MAX_FILE_BYTES = 190 * 1024 ** 2  # Bytes per request file, under the 200 MB provider limit
+BATCH_API_POLL_INTERVAL = float(os.environ.get('BATCH_API_POLL_INTERVAL', 30))  # Seconds between two status checks of a running batch
+BATCH_API_MAX_ROUNDS = 2  # A request failed inside a batch is submitted again up to this many rounds in total
+BATCH_API_COMPLETION_WINDOW = "24h"  # Completion window asked for each batch
+BATCH_FULL_CONTEXT_WEBSITES = 20  # Search results analyzed per question by batch.py --batch-api
+
+# LLM response cache, disabled unless a path is given
+LLM_CACHE_PATH = os.environ.get('LLM_CACHE_PATH')  # SQLite file of the cache, e.g. "cache/llm.sqlite"
+LLM_CACHE_MAX_BYTES = 2 * 1024 ** 3  # Least recently used responses are evicted above this size
+LLM_CACHE_TOUCH_INTERVAL = 3600  # Seconds before a hit records its access time again, so most hits are plain reads
 
 # Website crawling configuration
 MAX_WEBSITES = 5  # Maximum number of websites fed to the model per question (sampled from ~10 retrieved)
+PARTITION_ENUM_LIMIT = 10000  # generatePartitions enumerates all subsets up to this many candidates
 DEFAULT_USER_AGENT = '*'  # Default User Agent
+MAX_GOOD_WEBSITES = 10  # Stop crawling once this many websites pass the full-context check
+SUMMARY_CHUNK_SIZE = int(os.environ.get('SUMMARY_CHUNK_SIZE', 0))  # Good websites per partial summary of the map-reduce summarization, 0 for one summarizing call
+SUMMARY_WORKERS = 4  # Partial summaries of a question made at the same time
+CRAWL_WORKERS = 8  # Maximum number of websites processed at the same time, by all questions of the process together
+CRAWL_HOST_DELAY = 3  # Minimum seconds between two requests to the same host
+READER_URL = os.environ.get('READER_URL', 'https://r.jina.ai/')  # Reader service used to turn a webpage into text
+READER_TIMEOUT = 60  # Seconds before a reader request is given up
+EXTRACTOR = os.environ.get('EXTRACTOR', 'reader')  # How a webpage becomes text: "reader" (READER_URL) or "local" (reproduceDataset/extract.py)
+EXTRACT_WORKERS = 4  # Processes parsing HTML for the local extractor
+LOCAL_FETCH_USER_AGENT = 'Mozilla/5.0 (compatible; ConfRAG/1.0)'  # User agent of the local extractor downloads
+LOCAL_FETCH_MAX_BYTES = 5 * 1024 ** 2  # Longer pages are cut before parsing
+DEDUP_THRESHOLD = 0.9  # Estimated similarity from which a fetched page is a copy of an earlier one, None to disable
+DEDUP_SKETCH_SIZE = 128  # Hashes kept per page fingerprint, see reproduceDataset/dedup.py
+RELEVANCE_RANKING = os.environ.get('RELEVANCE_RANKING', '0') == '1'  # Fetch all search results, then run the full-context calls in BM25 order
+RELEVANCE_THRESHOLD = 0.1  # With ranking, pages scoring below this share of the best page of the question are pruned
+BM25_K1 = 1.2  # Term frequency saturation of the relevance score
+BM25_B = 0.75  # Length normalization of the relevance score
+ROBOTS_CACHE_PATH = os.environ.get('ROBOTS_CACHE_PATH', 'cache/robots.sqlite')  # Shared robots.txt cache, empty for memory only
+ROBOTS_CACHE_TTL = 24 * 3600  # Seconds before a fetched robots.txt is fetched again
+ROBOTS_NEGATIVE_TTL = 3600  # Seconds before a host that timed out or failed is tried again
+ROBOTS_TIMEOUT = 10  # Seconds before fetching a robots.txt is given up
+PAGE_CACHE_PATH = os.environ.get('PAGE_CACHE_PATH', 'cache/pages.sqlite')  # Shared page content cache, empty for memory only
+PAGE_CACHE_MAX_AGE = 7 * 24 * 3600  # Seconds a fetched page is reused before it is fetched again
+PAGE_CACHE_ERROR_MAX_AGE = 3600  # Seconds a definitive failed fetch (PAGE_CACHE_ERROR_STATUSES) is reused
+PAGE_CACHE_ERROR_STATUSES = (404, 410, 415, 422)  # Failed fetches worth caching: gone, or not extractable (415/422 of the local extractor). 429 and 5xx are never cached
+CHECKPOINT_PATH = os.environ.get('CHECKPOINT_PATH', 'cache/checkpoints')  # Per-stage checkpoints of Pipeline runs, empty to disable
+CHECKPOINT_MAX_AGE = 3 * 24 * 3600  # Seconds a checkpointed stage is reused, older stages are run again
+FULL_CONTEXT_TOKEN_BUDGET = 100000  # Input tokens of a full-context call, longer pages are truncated
+CHARS_PER_TOKEN = 4  # Used to estimate tokens when tiktoken is not available
+
+# Batch dataset building configuration
+BATCH_WORKERS = 4  # Number of questions processed at the same time
+BATCH_SHARD_SIZE = 100  # Number of records per output shard
+BATCH_MAX_ATTEMPTS = 2  # A question is marked as failed after this many unsuccessful runs
+
+# Result store configuration
+RESULT_SHARD_SIZE = 1000  # Number of records per shard of a result store
+RESULT_COMPRESS = True  # Write result store shards gzip compressed
+RESULT_INDEX_FLUSH = 100  # The index of a result store is written every this many records
+
+# Evaluation configuration
+EVAL_WORKERS = 8  # Number of records evaluated at the same time by generateResult/runAll.py
+EVAL_TOKEN_BUDGET = None  # Input tokens of a test prompt, website contents are truncated to fit. None for no limit
 
 # File path
 KEYWORD_PROMPT_PATH = "reproduceDataset/PromptGetKeyWord.txt"
 FULL_CONTEXT_PROMPT_PATH = "reproduceDataset/PromptForFullContext.txt"
 SUMMARIZING_PROMPT_PATH = "reproduceDataset/PromptSummarizingNew.txt"
+MERGE_PROMPT_PATH = "reproduceDataset/PromptMergeSummaries.txt"
 TEST_PROMPT_PATH = "generateResult/TestPrompt.txt"
 
 CACHE_SIZE = 1024  # LRU cache size
+AC_MIN_KEYWORDS = 256  # Keyword matching uses an Aho-Corasick automaton from this many keywords on, below it the C substring scan is faster
+NMI_MATRIX_MIN_ELEMENTS = 300  # A single soft NMI is computed in matrix form from this many elements on, below it the scalar loop is faster
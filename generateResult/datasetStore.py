@@ -0,0 +1,223 @@
+import os
+import sys
+import json
+import argparse
+
+from collections.abc import Mapping
+
+import pyarrow as pa
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+"""
+Packed, memory-mapped dataset store.
+
+A record of the dataset carries the full page content of up to ten websites, while
+the prompt only uses the content of the few websites generateIndex selects.
+The store splits a dataset into two Arrow IPC files:
+- records.arrow: one row per record with id, question, the number of answer groups and of
+  websites in them, the answers (as json), the rest of the record without websites (as
+  json) and the websites without content (as json)
+- pages.arrow: one row per website with the record row, its position in websites and
+  its content
+
+Both files are memory-mapped, so scanning ids, questions or group and website counts
+(e.g. to skip the records that can not form a partition) or loading the answers only
+touches their columns, and the content of a website is read from disk the first time it
+is accessed.
+"""
+
+RECORDS_FILE = 'records.arrow'
+PAGES_FILE = 'pages.arrow'
+
+RECORDS_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('question', pa.string()),
+    ('group_count', pa.int32()),
+    ('website_count', pa.int32()),
+    ('answers', pa.large_string()),
+    ('record', pa.large_string()),
+    ('websites', pa.large_string()),
+])
+PAGES_SCHEMA = pa.schema([
+    ('row', pa.int64()),
+    ('position', pa.int32()),
+    ('content', pa.large_string()),
+])
+
+
+def packDataset(records, saveTo: str, batchSize: int = 256) -> int:
+    """Pack records into a store folder.
+
+    Parameters
+    ----------
+    records : iterable of dict
+        Dataset records, see reproduceDataset/ReadMe.md Output part
+    saveTo : str
+        The folder of the store
+    batchSize : int, optional
+        Number of records written at once
+
+    Returns
+    -------
+    int
+        Number of records packed
+    """
+    os.makedirs(saveTo, exist_ok=True)
+    count = 0
+    with pa.OSFile(os.path.join(saveTo, RECORDS_FILE), 'wb') as recordsSink, \
+            pa.OSFile(os.path.join(saveTo, PAGES_FILE), 'wb') as pagesSink, \
+            pa.ipc.new_file(recordsSink, RECORDS_SCHEMA) as recordsWriter, \
+            pa.ipc.new_file(pagesSink, PAGES_SCHEMA) as pagesWriter:
+        recordRows = {name: [] for name in RECORDS_SCHEMA.names}
+        pageRows = {name: [] for name in PAGES_SCHEMA.names}
+
+        def flush():
+            if recordRows['id']:
+                recordsWriter.write_batch(pa.record_batch(recordRows, schema=RECORDS_SCHEMA))
+            if pageRows['row']:
+                pagesWriter.write_batch(pa.record_batch(pageRows, schema=PAGES_SCHEMA))
+            for rows in (recordRows, pageRows):
+                for column in rows.values():
+                    column.clear()
+
+        for data in records:
+            websites = []
+            for position, website in enumerate(data.get('websites') or []):
+                websites.append({k: v for k, v in website.items() if k != 'content'})
+                if website.get('content') is not None:
+                    pageRows['row'].append(count)
+                    pageRows['position'].append(position)
+                    pageRows['content'].append(website['content'])
+            recordRows['id'].append(str(data.get('id', count)))
+            recordRows['question'].append(data.get('question'))
+            answers = data.get('answers') or []
+            recordRows['group_count'].append(len(answers))
+            recordRows['website_count'].append(len({str(e) for answer in answers for e in answer.get('index', [])}))
+            recordRows['answers'].append(json.dumps(data.get('answers'), ensure_ascii=False))
+            recordRows['record'].append(json.dumps({k: v for k, v in data.items() if k not in ('websites', 'answers')}, ensure_ascii=False))
+            recordRows['websites'].append(json.dumps(websites, ensure_ascii=False))
+            count += 1
+            if len(recordRows['id']) >= batchSize:
+                flush()
+        flush()
+    return count
+
+
+class LazyWebsite(Mapping):
+    """A website of a stored record whose content is read on first access."""
+    def __init__(self, store: 'DatasetStore', row: int, position: int, fields: dict):
+        self.store = store
+        self.row = row
+        self.position = position
+        self.fields = fields
+
+    def __getitem__(self, key):
+        if key == 'content' and 'content' not in self.fields and self.store.hasContent(self.row, self.position):
+            self.fields['content'] = self.store.content(self.row, self.position)
+        return self.fields[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.fields or (key == 'content' and self.store.hasContent(self.row, self.position))
+
+    def __iter__(self):
+        yield from self.fields
+        if 'content' not in self.fields and self.store.hasContent(self.row, self.position):
+            yield 'content'
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+class DatasetStore:
+    """Read a store folder written by packDataset.
+
+    Supports len() and indexing by row like a list of records, so it can be used
+    wherever the dataset split is used.
+
+    Parameters
+    ----------
+    path : str
+        The folder of the store
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.records = pa.ipc.open_file(pa.memory_map(os.path.join(path, RECORDS_FILE))).read_all()
+        self.pages = pa.ipc.open_file(pa.memory_map(os.path.join(path, PAGES_FILE))).read_all()
+        # (record row, website position) -> page row, built from the two small columns only
+        rows = self.pages.column('row').to_pylist()
+        positions = self.pages.column('position').to_pylist()
+        self.pageIndex = {key: k for k, key in enumerate(zip(rows, positions))}
+        self._ids = None
+        self._rows = None
+
+    def __len__(self) -> int:
+        return self.records.num_rows
+
+    def ids(self) -> list[str]:
+        if self._ids is None:
+            self._ids = self.records.column('id').to_pylist()
+        return self._ids
+
+    def questions(self) -> list[str]:
+        return self.records.column('question').to_pylist()
+
+    def groupCounts(self) -> list[int]:
+        """Number of answer groups of each record."""
+        return self.records.column('group_count').to_pylist()
+
+    def websiteCounts(self) -> list[int]:
+        """Number of distinct websites in the answer groups of each record."""
+        return self.records.column('website_count').to_pylist()
+
+    def answers(self, row: int) -> list[dict]:
+        """The answers of the record at row, without decoding the rest of it (None if it has none)."""
+        return json.loads(self.records.column('answers')[row].as_py())
+
+    def rowOf(self, recordId) -> int:
+        if self._rows is None:
+            self._rows = {recordId: row for row, recordId in reversed(list(enumerate(self.ids())))}
+        return self._rows[str(recordId)]
+
+    def hasContent(self, row: int, position: int) -> bool:
+        return (row, position) in self.pageIndex
+
+    def content(self, row: int, position: int) -> str:
+        """The content of the website at position of the record at row."""
+        return self.pages.column('content')[self.pageIndex[(row, position)]].as_py()
+
+    def metadata(self, row: int) -> dict:
+        """The record at row without its websites, e.g. for grading.
+
+        A record packed without an id gets the one of the id column (its position when it
+        was packed), the key runAll saves its result under.
+        """
+        data = json.loads(self.records.column('record')[row].as_py())
+        answers = self.answers(row)
+        if answers is not None:
+            data['answers'] = answers
+        data.setdefault('id', self.records.column('id')[row].as_py())
+        return data
+
+    def __getitem__(self, row: int) -> dict:
+        if row < 0:
+            row += len(self)
+        data = self.metadata(row)
+        websites = json.loads(self.records.column('websites')[row].as_py())
+        data['websites'] = [LazyWebsite(self, row, position, fields) for position, fields in enumerate(websites)]
+        return data
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pack a dataset into a memory-mapped store")
+    parser.add_argument('--dataset', default="OracleY/ConfRAG", help="A .jsonl file of records, or a HuggingFace dataset name")
+    parser.add_argument('--split', default='train')
+    parser.add_argument('--saveTo', required=True, help="The folder of the store")
+    args = parser.parse_args()
+    from runAll import loadRecords
+    print(packDataset(loadRecords(args.dataset, args.split), args.saveTo), "records packed to", args.saveTo)
@@ -1,8 +1,168 @@
 import json
+import textwrap
+
+from functools import lru_cache
 
 from Tools import chatWithGPT, jsonClean
-from generateIndex import generateIndex
-from config import TEST_PROMPT_PATH
+from generateIndex import generateIndex, generatePartitions, GroupStructure, indexOrder
+from tokenBudget import countTokens, truncateTokens, allocateBudget
+from resultStore import ResultStore
+from instrument import span
+from config import TEST_PROMPT_PATH, EVAL_TOKEN_BUDGET
+
+
+@lru_cache(maxsize=None)
+def loadTemplate(path:str)->str:
+    """Read a prompt template once per process."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _indexKey(index):
+    # website indexes may be stored as int or str, match them as int when possible
+    try:
+        return int(index)
+    except (TypeError, ValueError):
+        return str(index)
+
+
+class PromptBuilder:
+    """Build test prompts for one record.
+
+    The index -> website map of the record is built once, and the json text of each
+    website entry is encoded once and reused, so many prompts can be built for the
+    same record (across human_prompt modes and sampled partitions) without filtering
+    or copying data['websites'] again. data is not modified.
+
+    With a token budget, the contents of the selected websites are truncated so that the
+    whole prompt fits in the budget, sharing it fairly between websites. Contents are
+    measured as they are written in the prompt (json-escaped), and the assembled prompt is
+    checked against the budget. The token counts of the contents before and after
+    truncation of the last built prompt are kept in self.tokens.
+
+    Parameters
+    ----------
+    data : dict
+        For more information, please refer to the reproduceDataset/ReadMe.md file.
+    token_budget : int, optional
+        Maximum number of input tokens of a prompt, None for no limit.
+    """
+    def __init__(self,data:dict,token_budget:int=None):
+        self.data=data
+        self.token_budget=token_budget
+        self.tokens=None
+        self.websites={}
+        for website in data['websites']:
+            if 'index' in website:
+                self.websites[_indexKey(website['index'])]=website
+        self.entries={}
+        self.contentTokens={}
+        self._structure=None
+    def structure(self)->GroupStructure:
+        """The group structure of the record, see GroupStructure.usable to check the record up front."""
+        if self._structure is None:
+            self._structure=GroupStructure(self.data)
+        return self._structure
+    @staticmethod
+    def _encode(index,value:str)->str:
+        """The json text of one website entry, indented as inside the website list."""
+        return textwrap.indent(json.dumps({"index":index,"website":value},indent=4,ensure_ascii=False),'    ')
+    def _entry(self,index,human_prompt:bool)->str:
+        key=(index,human_prompt)
+        if key not in self.entries:
+            website=self.websites[_indexKey(index)]
+            self.entries[key]=self._encode(index,website['website'] if human_prompt else website['content'])
+        return self.entries[key]
+    def _assemble(self,entries:list[str],info:list[list[int]])->list[dict]:
+        # same text as json.dumps(list_of_entries,indent=4,ensure_ascii=False)
+        websiteList='[\n'+',\n'.join(entries)+'\n]' if entries else '[]'
+        content=f"## Question\n{self.data['question']}\n\n## Website Information\n"+websiteList
+        system=loadTemplate(TEST_PROMPT_PATH).replace('[CLUSTERING NUMBER]',str(len(info)))
+        return [{"role":"system","content":system},{"role":"user","content":content}]
+    @staticmethod
+    def _escaped(text:str)->str:
+        """A content as it is written inside its json entry (newlines, tabs and quotes escaped)."""
+        return json.dumps(text,ensure_ascii=False)[1:-1]
+    def _fit(self,selected:list,budget:int)->tuple[list[str],list[dict]]:
+        """Entries whose escaped contents share budget tokens, and their token counts."""
+        counts=[self.contentTokens[i] for i in selected]
+        entries=[]
+        tokens=[]
+        for i,count,limit in zip(selected,counts,allocateBudget(counts,max(0,budget))):
+            if count<=limit:
+                entries.append(self._entry(i,False))
+                tokens.append({"index":i,"before":count,"after":count})
+                continue
+            text=self.websites[_indexKey(i)]['content']
+            keep=limit
+            while True:
+                # escaping makes the text longer, cut the raw text until its escaped form fits
+                fitted=truncateTokens(text,keep)
+                after=countTokens(self._escaped(fitted))
+                if after<=limit or keep==0:
+                    break
+                keep=max(0,keep-(after-limit))
+            entries.append(self._encode(i,fitted))
+            tokens.append({"index":i,"before":count,"after":after})
+        return entries,tokens
+    def _fittedEntries(self,selected:list,info:list[list[int]])->list[str]:
+        """Entries whose contents are truncated to fit self.token_budget, recording the token counts."""
+        skeleton=self._assemble([self._encode(i,'') for i in selected],info)
+        budget=self.token_budget-sum(countTokens(message['content']) for message in skeleton)
+        for i in selected:
+            if i not in self.contentTokens:
+                self.contentTokens[i]=countTokens(self._escaped(self.websites[_indexKey(i)]['content']))
+        while True:
+            entries,self.tokens=self._fit(selected,budget)
+            # tokens can merge across the joins of the pieces, check the assembled prompt
+            over=sum(countTokens(message['content']) for message in self._assemble(entries,info))-self.token_budget
+            if over<=0 or budget<=0:
+                return entries
+            budget-=over
+    def build(self,human_prompt:bool=False,manual_index:list[list[int]]=None)->tuple[list[dict],list[list[int]]]:
+        """Build one prompt, see generate for the parameters and the return value."""
+        remaining,info=generateIndex(self.data,manual_index)
+        return self._build(remaining,info,human_prompt)
+    def _build(self,remaining:list[int],info:list[list[int]],human_prompt:bool)->tuple[list[dict],list[list[int]]]:
+        selected=[i for i in remaining if _indexKey(i) in self.websites]
+        self.tokens=None
+        if self.token_budget is not None and not human_prompt:
+            entries=self._fittedEntries(selected,info)
+        else:
+            entries=[self._entry(i,human_prompt) for i in selected]
+        return self._assemble(entries,info),info
+    def build_many(self,human_prompts:tuple[bool,...]=(False,True),samples:int=1,partitions:list[list[list[int]]]=None,seed:int=None)->list[dict]:
+        """Build prompts for several partitions and human_prompt modes.
+
+        Parameters
+        ----------
+        human_prompts : tuple[bool, ...], optional
+            The human_prompt modes to build, by default both
+        samples : int, optional
+            Number of distinct partitions drawn with generatePartitions, used if partitions is None.
+            Fewer are built if the record has fewer valid partitions, none if it is not usable.
+        partitions : list[list[list[int]]], optional
+            Partitions to build prompts for. As with the sampled ones, their websites are listed
+            in index order, so the prompt does not give the groups away
+        seed : int, optional
+            Seed for drawing the partitions
+
+        Returns
+        -------
+        list[dict]
+            One dict per (partition, mode) with keys sample, human_prompt, prompt, info
+            and tokens (see self.tokens)
+        """
+        if partitions is None:
+            selected=generatePartitions(self.data,samples,seed=seed,structure=self.structure())
+        else:
+            selected=[(sorted((i for group in partition for i in group),key=indexOrder),partition) for partition in partitions]
+        result=[]
+        for sample,(remaining,partition) in enumerate(selected):
+            for human_prompt in human_prompts:
+                prompt,info=self._build(remaining,partition,human_prompt)
+                result.append({"sample":sample,"human_prompt":human_prompt,"prompt":prompt,"info":info,"tokens":self.tokens})
+        return result
 
 
 def generate(data:dict, human_prompt:bool=False, manual_index:list[list[int]]=None)->tuple[list[dict],list[list[int]]]:
@@ -12,6 +172,7 @@ def generate(data:dict, human_prompt:bool=False, manual_index:list[list[int]]=No
     This function processes website data to create a structured prompt and grouping
     information, ensuring the number of websites does not exceed MAX_WEBSITES (5).
     It handles various edge cases to maintain valid partitioning of websites.
+    To build many prompts for the same record, use PromptBuilder directly.
 
     Parameters
     ----------
@@ -48,56 +209,34 @@ def generate(data:dict, human_prompt:bool=False, manual_index:list[list[int]]=No
     2. At least one group has multiple websites
     3. Total websites <= MAX_WEBSITES (5)
     """
-    with open(TEST_PROMPT_PATH, 'r', encoding='utf-8') as f:
-        prompt = [{"role":"system", "content":f.read()}]
-    content=f"## Question\n{data['question']}\n\n## Website Information\n"
-    filteredWebs=[]
-    for i in range(len(data['websites'])):
-        if 'index' in data['websites'][i]:
-            filteredWebs.append(data['websites'][i])
-    data['websites']=filteredWebs
-
-    websites={e['index']:e for e in data['websites']}
-    remaining,info=generateIndex(data,manual_index)
-    forPrompt=[]
-    for i in remaining:
-        if human_prompt:
-            if i in data['websites']:
-                forPrompt.append({"index":i,"website":websites[i]['website']})
-            else:
-                for web in websites:
-                    if str(websites[web]['index']) == str(i):
-                        forPrompt.append({"index":i,"website":websites[web]['website']})
-                        break
-        else:
-            if i in data['websites']:
-                forPrompt.append({"index":i,"website":websites[i]['content']})
-            else:
-                for web in websites:
-                    if str(websites[web]['index']) == str(i):
-                        forPrompt.append({"index":i,"website":websites[web]['content']})
-                        break
-    content+=json.dumps(forPrompt,indent=4,ensure_ascii=False)
-    prompt[0]['content']=prompt[0]['content'].replace('[CLUSTERING NUMBER]',str(len(info)))
-    prompt.append({"role":"user","content":content})
-    return prompt,info
+    return PromptBuilder(data).build(human_prompt,manual_index)
 
 class GenerateResult:
-    def __init__(self,data:dict,saveTo:str=None):
+    def __init__(self,data:dict,saveTo:str=None,token_budget:int=EVAL_TOKEN_BUDGET):
         self.data=data
         self.info=None
         self.prompt=None
+        self.tokens=None
         self.saveTo=saveTo
+        self.token_budget=token_budget
+        self.builder=None
     def get_prompt(self,human_prompt:bool=False):
-        self.prompt,self.info=generate(self.data,human_prompt)
+        with span("build_prompt",id=self.data.get('id')):
+            if self.builder is None:
+                self.builder=PromptBuilder(self.data,self.token_budget)
+            self.prompt,self.info=self.builder.build(human_prompt)
+            self.tokens=self.builder.tokens
         return self.prompt
     def get_answer(self):
         if self.prompt is None:
             self.get_prompt()
-        answer,success=chatWithGPT(self.prompt)
+        with span("get_answer",id=self.data.get('id')):
+            return self.parse_answer(*chatWithGPT(self.prompt))
+    def parse_answer(self,response:str,success:bool):
+        """Parse the response to self.prompt, from get_answer or from a batch job (see generateResult/runAll.py)."""
         if not success:
             raise Exception('Failed to get answer from GPT')
-        answer,success=jsonClean(answer,['answers'])
+        answer,success=jsonClean(response,['answers'])
         if not success:
             raise Exception('Failed to parse answer from GPT')
         return answer
@@ -106,7 +245,14 @@ class GenerateResult:
     def process(self):
         answer=self.get_answer()
         toSave={'answer':answer,'info':self.info,'prompt':self.prompt}
-        if self.saveTo is not None:
+        if self.tokens is not None:
+            # token counts of each website content before and after truncation
+            toSave['tokens']=self.tokens
+        if isinstance(self.saveTo,ResultStore):
+            # one compact line keyed by the record id, instead of an indented file per record
+            self.saveTo.append({'id':self.data.get('id'),**toSave})
+            print("Result is generated and saved to",self.saveTo)
+        elif self.saveTo is not None:
             with open(self.saveTo,'w',encoding='utf-8') as f:
                 json.dump(toSave,f,indent=4,ensure_ascii=False)
                 print("Result is generated and saved to",self.saveTo)
@@ -1,9 +1,18 @@
+import math
 import random
-from config import MAX_WEBSITES
+import itertools
+from config import MAX_WEBSITES, PARTITION_ENUM_LIMIT
 
 class InvalidDataException(Exception):
     pass
 
+def indexOrder(index)->tuple:
+    """Sort key of website indexes, which may be stored as int or str: as int when possible."""
+    try:
+        return (0,int(index),'')
+    except (TypeError, ValueError):
+        return (1,0,str(index))
+
 def generateIndex(data:dict, manual_index:list[list[int]]=None)->tuple[list[dict],list[list[int]]]:
     """Generate a valid partition of indexes.
 
@@ -120,3 +129,127 @@ def generateIndex(data:dict, manual_index:list[list[int]]=None)->tuple[list[dict
         if len(remainGroups)==1 or len(remainGroups)==len(remaining):
             raise Exception('Impossible!')
     return remaining,info
+
+
+class GroupStructure:
+    """Group structure of a record, computed once and shared by all samples.
+
+    A subset of websites is a valid partition if it has MAX_WEBSITES websites (or all of
+    them if there are fewer), comes from more than one group, and has at least one group
+    with multiple websites.
+
+    Parameters
+    ----------
+    data : dict
+        Input data dictionary containing answers.
+        See reproduceDataset/ReadMe.md Output part for more details.
+
+    Attributes
+    ----------
+    elements : list
+        All website indexes, in index order. Partitions list their websites in this order,
+        so the order a prompt presents them in tells nothing about their groups
+    groupOf : dict
+        Website index -> group number
+    size : int
+        Number of websites in a partition
+    usable : bool
+        Whether the record can yield any valid partition
+    reason : str
+        Why the record is not usable, None if it is usable
+    """
+    def __init__(self,data:dict):
+        self.groupOf={}
+        for i,group in enumerate(data['answers']):
+            for e in group['index']:
+                self.groupOf[e]=i
+        self.elements=sorted(self.groupOf,key=indexOrder)
+        self.size=min(MAX_WEBSITES,len(self.elements))
+        members={}
+        for e in self.elements:
+            members.setdefault(self.groupOf[e],[]).append(e)
+        self.members=list(members.values())
+        self.reason=None
+        if len(self.members)<=1:
+            self.reason='Question with only one group of answer is not usable!'
+        elif all(len(group)==1 for group in self.members):
+            self.reason='Question with all group only have one website is not usable!'
+        elif self.size<3:
+            self.reason='Not enough websites for a valid partition'
+    @property
+    def usable(self)->bool:
+        return self.reason is None
+    def valid(self,remaining)->bool:
+        groups={self.groupOf[e] for e in remaining}
+        return 1<len(groups)<len(remaining)
+    def info(self,remaining)->list[list]:
+        """Group the selected websites, groups in order of first appearance."""
+        info=[]
+        existedGroup={}
+        for e in remaining:
+            if self.groupOf[e] not in existedGroup:
+                existedGroup[self.groupOf[e]]=len(info)
+                info.append([e])
+            else:
+                info[existedGroup[self.groupOf[e]]].append(e)
+        return info
+
+
+def generatePartitions(data:dict,k:int,seed:int=None,rng:random.Random=None,structure:GroupStructure=None)->list[tuple[list,list[list]]]:
+    """Generate up to k distinct valid partitions of a record.
+
+    Unlike generateIndex, this never raises or retries: whether the record is usable is
+    decided once from its group structure, and every returned partition is valid.
+    When the number of candidate subsets is at most PARTITION_ENUM_LIMIT, all valid subsets
+    are enumerated and k of them are drawn without replacement. Otherwise each partition
+    is built directly (two websites from a group with multiple websites, one from another
+    group, the rest at random) and duplicates are dropped.
+
+    Parameters
+    ----------
+    data : dict
+        Input data dictionary containing answers.
+    k : int
+        Number of partitions wanted
+    seed : int, optional
+        Seed of the random generator, used if rng is None
+    rng : random.Random, optional
+        The random generator to draw from
+    structure : GroupStructure, optional
+        The precomputed structure of data
+
+    Returns
+    -------
+    list[tuple[list, list[list]]]
+        Up to k distinct (remaining, info) pairs, in the same format as generateIndex, with
+        remaining in website index order (only info tells the groups apart).
+        Empty if the record is not usable, fewer than k if it has fewer valid partitions.
+    """
+    if structure is None:
+        structure=GroupStructure(data)
+    if rng is None:
+        rng=random.Random(seed)
+    if not structure.usable or k<=0:
+        return []
+    position={e:p for p,e in enumerate(structure.elements)}
+    if math.comb(len(structure.elements),structure.size)<=PARTITION_ENUM_LIMIT:
+        candidates=[list(c) for c in itertools.combinations(structure.elements,structure.size) if structure.valid(c)]
+        chosen=rng.sample(candidates,min(k,len(candidates)))
+    else:
+        multiGroups=[group for group in structure.members if len(group)>1]
+        chosen=[]
+        seen=set()
+        for _ in range(k*PARTITION_ENUM_LIMIT):
+            if len(chosen)>=k:
+                break
+            group=rng.choice(multiGroups)
+            picked=rng.sample(group,2)
+            picked.append(rng.choice([e for e in structure.elements if structure.groupOf[e]!=structure.groupOf[group[0]]]))
+            rest=[e for e in structure.elements if e not in picked]
+            picked+=rng.sample(rest,structure.size-3)
+            picked.sort(key=position.get)
+            key=frozenset(picked)
+            if key not in seen:
+                seen.add(key)
+                chosen.append(picked)
+    return [(remaining,structure.info(remaining)) for remaining in chosen]
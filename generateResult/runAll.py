@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import argparse
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate import GenerateResult
+from generateIndex import InvalidDataException
+from datasetStore import DatasetStore
+from resultStore import ResultStore, isStore
+from batchApi import BatchJob, makeRequest
+from instrument import tracer
+from config import EVAL_WORKERS, EVAL_TOKEN_BUDGET
+
+# prompt, info and tokens of each request of a batch job, by custom id, in the job folder
+PROMPTS_FILE = "prompts.json"
+
+
+"""
+Evaluate a model on a whole dataset split (or an index range of it).
+
+Records are processed by a bounded pool of concurrent model calls, and each result is
+appended to a ResultStore (sharded jsonl files keyed by id) as soon as it completes,
+one line per record:
+- id: the id of the record (its index in the split if it has no id)
+- status: "done", "failed" (e.g. the answer could not be parsed) or "invalid" (the record
+  can not generate a valid partition)
+- answer, info, prompt (and tokens with a token budget): same as the output of
+  GenerateResult.process, for done records
+- error: str, for failed and invalid records
+
+Rerunning with the same output folder skips records that are done or invalid, and retries
+the failed ones. The output can be graded with analysisResult/gradeAll.py.
+
+With --batch-api FOLDER, the prompts of the pending records are sent as one job of the
+provider batch API (see batchApi.py) instead of one call at a time; the answers are
+parsed and saved into the same records. Requests that still failed after the retry
+rounds of the job are failed records. The partitions are sampled, so the prompt and info
+of each pending record are saved in the job folder before submitting: a rerun after an
+interruption reuses them, resumes the same batches, and grades the answers against the
+info of the prompts that were actually sent.
+"""
+
+
+def loadRecords(source: str, split: str = 'train'):
+    """Load the dataset: a store folder from datasetStore.py, a result store from reproduceDataset/batch.py
+    (done records only), a .jsonl file of records, or a HuggingFace dataset name."""
+    if isStore(source):
+        return [r['data'] for r in ResultStore(source).records(latest=True) if r.get('status') == 'done']
+    if os.path.isdir(source):
+        return DatasetStore(source)
+    if os.path.exists(source):
+        with open(source, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    from datasets import load_dataset
+    return load_dataset(source)[split]
+
+
+def finishedIds(store: ResultStore) -> set[str]:
+    """Ids in the output store that do not need to run again."""
+    return {str(r['id']) for r in store.records(latest=True) if r.get('status') in ('done', 'invalid')}
+
+
+def doneRecord(recordId, generator: GenerateResult, answer) -> dict:
+    result = {'id': recordId, 'status': 'done', 'answer': answer, 'info': generator.get_info(), 'prompt': generator.prompt}
+    if generator.tokens is not None:
+        result['tokens'] = generator.tokens
+    return result
+
+
+def runOne(data: dict, recordId, human_prompt: bool = False, token_budget: int = EVAL_TOKEN_BUDGET) -> dict:
+    """Generate the result of one record, turning errors into a failed record."""
+    try:
+        generator = GenerateResult(data, token_budget=token_budget)
+        generator.get_prompt(human_prompt)
+        return doneRecord(recordId, generator, generator.get_answer())
+    except InvalidDataException as e:
+        return {'id': recordId, 'status': 'invalid', 'error': str(e)}
+    except Exception as e:
+        return {'id': recordId, 'status': 'failed', 'error': str(e)}
+
+
+def runAll(records, saveTo: str, start: int = 0, end: int = None, workers: int = EVAL_WORKERS, human_prompt: bool = False, token_budget: int = EVAL_TOKEN_BUDGET) -> dict:
+    """Evaluate the records in [start, end) concurrently.
+
+    Parameters
+    ----------
+    records : list[dict] or datasets.Dataset
+        The dataset split
+    saveTo : str
+        The folder of the ResultStore the results are appended to
+    start : int, optional
+        The first index to evaluate, by default 0
+    end : int, optional
+        One past the last index to evaluate, by default the end of the split
+    workers : int, optional
+        Number of model calls at the same time, by default from config
+    human_prompt : bool, optional
+        Passed to GenerateResult.get_prompt
+    token_budget : int, optional
+        Input token budget of each prompt, by default from config
+
+    Returns
+    -------
+    dict
+        Number of records per status in this run, and the number skipped
+    """
+    end = len(records) if end is None else min(end, len(records))
+    store = ResultStore(saveTo)
+    finished = finishedIds(store)
+    summary = {'done': 0, 'failed': 0, 'invalid': 0, 'skipped': 0}
+    with ThreadPoolExecutor(max_workers=workers) as pool, store:
+        futures = []
+        for index in range(start, end):
+            data = records[index]
+            recordId = data.get('id', index)
+            if str(recordId) in finished:
+                summary['skipped'] += 1
+                continue
+            futures.append(pool.submit(runOne, data, recordId, human_prompt, token_budget))
+        for future in as_completed(futures):
+            result = future.result()
+            store.append(result)
+            summary[result['status']] += 1
+            print(f"[{summary['done'] + summary['failed'] + summary['invalid']}/{len(futures)}] {result['id']}: {result['status']}")
+    return summary
+
+
+def loadPrompts(jobFolder: str) -> dict:
+    """The prompts saved by savePrompts in a job folder, by custom id."""
+    path = os.path.join(jobFolder, PROMPTS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def savePrompts(jobFolder: str, prompts: dict) -> None:
+    os.makedirs(jobFolder, exist_ok=True)
+    path = os.path.join(jobFolder, PROMPTS_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(prompts, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+
+def runAllBatch(records, saveTo: str, jobFolder: str, start: int = 0, end: int = None, human_prompt: bool = False, token_budget: int = EVAL_TOKEN_BUDGET) -> dict:
+    """Evaluate the records in [start, end) as one batch API job.
+
+    Parameters are the same as runAll, the model calls are replaced by the job:
+
+    jobFolder : str
+        The folder of the BatchJob, an interrupted run restarted with the same folder
+        reuses the prompts it built and waits for the batches it already submitted
+
+    Returns
+    -------
+    dict
+        Number of records per status in this run, and the number skipped
+    """
+    end = len(records) if end is None else min(end, len(records))
+    store = ResultStore(saveTo)
+    finished = finishedIds(store)
+    summary = {'done': 0, 'failed': 0, 'invalid': 0, 'skipped': 0}
+    saved = loadPrompts(jobFolder)
+    with store:
+        pending = {}
+        for index in range(start, end):
+            data = records[index]
+            recordId = data.get('id', index)
+            if str(recordId) in finished:
+                summary['skipped'] += 1
+                continue
+            generator = GenerateResult(data, token_budget=token_budget)
+            try:
+                entry = saved.get(str(recordId))
+                if entry is not None and entry['human_prompt'] == human_prompt and entry['token_budget'] == token_budget:
+                    # built by an interrupted run, whose requests may already be submitted
+                    generator.prompt, generator.info, generator.tokens = entry['prompt'], entry['info'], entry['tokens']
+                else:
+                    generator.get_prompt(human_prompt)
+                pending[str(recordId)] = (recordId, generator)
+            except InvalidDataException as e:
+                store.append({'id': recordId, 'status': 'invalid', 'error': str(e)})
+                summary['invalid'] += 1
+            except Exception as e:
+                store.append({'id': recordId, 'status': 'failed', 'error': str(e)})
+                summary['failed'] += 1
+        print(f"{len(pending)} prompts to submit")
+        if pending:
+            savePrompts(jobFolder, {customId: {'prompt': generator.prompt, 'info': generator.info, 'tokens': generator.tokens,
+                                               'human_prompt': human_prompt, 'token_budget': token_budget}
+                                    for customId, (_, generator) in pending.items()})
+            responses = BatchJob(jobFolder).run([makeRequest(customId, generator.prompt) for customId, (_, generator) in pending.items()])
+            for customId, (recordId, generator) in pending.items():
+                try:
+                    result = doneRecord(recordId, generator, generator.parse_answer(*responses[customId]))
+                except Exception as e:
+                    result = {'id': recordId, 'status': 'failed', 'error': str(e)}
+                store.append(result)
+                summary[result['status']] += 1
+            # the job is over, a later run retrying its failed records samples new prompts
+            os.remove(os.path.join(jobFolder, PROMPTS_FILE))
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evaluate a model on a dataset split")
+    parser.add_argument('--dataset', default="OracleY/ConfRAG", help="A store folder, a .jsonl file of records, or a HuggingFace dataset name")
+    parser.add_argument('--split', default='train')
+    parser.add_argument('--saveTo', default='results/', help="The folder of the result store")
+    parser.add_argument('--start', type=int, default=0)
+    parser.add_argument('--end', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=EVAL_WORKERS)
+    parser.add_argument('--human-prompt', action='store_true')
+    parser.add_argument('--token-budget', type=int, default=EVAL_TOKEN_BUDGET, help="Input token budget of each prompt")
+    parser.add_argument('--batch-api', metavar='FOLDER', help="Send the prompts as a batch API job kept in this folder, instead of online calls")
+    parser.add_argument('--trace', help="Write the timing / token trace of the run to this json file")
+    args = parser.parse_args()
+    tracer.keepSpans = bool(args.trace)
+    records = loadRecords(args.dataset, args.split)
+    if args.batch_api:
+        print(runAllBatch(records, args.saveTo, args.batch_api, args.start, args.end, args.human_prompt, args.token_budget))
+    else:
+        print(runAll(records, args.saveTo, args.start, args.end, args.workers, args.human_prompt, args.token_budget))
+    tracer.showSummary()
+    if args.trace:
+        tracer.export(args.trace)
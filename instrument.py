@@ -0,0 +1,252 @@
+"""
+Structured instrumentation of the pipeline and the evaluation.
+
+Work is recorded as nested spans: a span has a name, attributes, a duration, an
+error if it failed, and counters such as the prompt / completion tokens of a model
+call, retries and cache hits. The current span is kept in a context variable, so
+nested spans find their parent without passing it around; work submitted to a thread
+pool keeps its parent when it is wrapped with inContext.
+
+The module-level tracer aggregates the finished spans of the process per span name as
+they finish, with the counters of child spans rolled up, to find the bottleneck stage
+across a batch in bounded memory. Only when asked to keep them (keepSpans, e.g. for
+--trace) does it also keep the spans themselves, to export them as a JSON trace (Chrome
+trace event format, which also opens in chrome://tracing or Perfetto).
+"""
+
+import json
+import time
+import random
+import functools
+import itertools
+import threading
+import contextvars
+from typing import Dict, List, Optional
+
+from config import MODEL_PRICES, TRACE_SAMPLE_SIZE
+
+_current = contextvars.ContextVar('span', default=None)
+_ids = itertools.count(1)
+
+# counters filled from the usage of a model response
+TOKEN_COUNTERS = ('prompt_tokens', 'completion_tokens')
+
+
+class Span:
+    """One timed unit of work, see span()."""
+    def __init__(self, name: str, parent: Optional['Span'], attrs: dict):
+        self.id = next(_ids)
+        self.name = name
+        self.parent = parent.id if parent is not None else None
+        # the open ancestors, whose counters include those of this span
+        self._parent = parent
+        self.attrs = attrs
+        self.counters: Dict[str, float] = {}
+        self.error = None
+        self.thread = threading.get_ident()
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def add(self, counter: str, value: float = 1) -> None:
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def fail(self, error) -> None:
+        """Mark the span as failed without raising, e.g. when a call returns success False."""
+        self.error = str(error)
+
+
+class _SpanContext:
+    def __init__(self, tracer: 'Tracer', name: str, attrs: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self) -> Span:
+        self.span = Span(self.name, _current.get(), self.attrs)
+        self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, excType, exc, tb) -> None:
+        self.span.duration = time.perf_counter() - self.span._start
+        if exc is not None and self.span.error is None:
+            self.span.error = f"{excType.__name__}: {exc}"
+        _current.reset(self.token)
+        self.tracer.finish(self.span)
+
+
+class _Aggregate:
+    """Running statistics of the spans of one name."""
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        # a uniform sample of the durations for the percentiles, all of them up to sampleSize
+        self.durations: List[float] = []
+        self.counters: Dict[str, float] = {}
+
+
+class Tracer:
+    """Aggregate the finished spans of the process per name.
+
+    Parameters
+    ----------
+    keepSpans : bool, optional
+        Also keep every finished span for export, by default False
+    sampleSize : int, optional
+        Durations kept per span name for the percentiles of the summary, by default from config
+    """
+    def __init__(self, keepSpans: bool = False, sampleSize: int = TRACE_SAMPLE_SIZE):
+        self.lock = threading.Lock()
+        self.keepSpans = keepSpans
+        self.sampleSize = sampleSize
+        self.random = random.Random(0)
+        self.spans: List[Span] = []
+        self.aggregates: Dict[str, _Aggregate] = {}
+
+    def span(self, name: str, **attrs) -> _SpanContext:
+        return _SpanContext(self, name, attrs)
+
+    def _aggregate(self, name: str) -> _Aggregate:
+        aggregate = self.aggregates.get(name)
+        if aggregate is None:
+            aggregate = self.aggregates[name] = _Aggregate()
+        return aggregate
+
+    def finish(self, span: Span) -> None:
+        with self.lock:
+            aggregate = self._aggregate(span.name)
+            aggregate.count += 1
+            aggregate.errors += span.error is not None
+            aggregate.total += span.duration
+            aggregate.max = max(aggregate.max, span.duration)
+            if len(aggregate.durations) < self.sampleSize:
+                aggregate.durations.append(span.duration)
+            else:
+                # reservoir sampling, every duration has the same chance to be in the sample
+                k = self.random.randrange(aggregate.count)
+                if k < self.sampleSize:
+                    aggregate.durations[k] = span.duration
+            # the counters of a span count for its name and for the names of its ancestors
+            owner = span
+            while owner is not None:
+                counters = self._aggregate(owner.name).counters
+                for counter, value in span.counters.items():
+                    counters[counter] = counters.get(counter, 0) + value
+                owner = owner._parent
+            if self.keepSpans:
+                self.spans.append(span)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.spans = []
+            self.aggregates = {}
+
+    def export(self, path: str) -> None:
+        """Write the kept spans as a JSON trace, see keepSpans.
+
+        Each span is a complete event ("ph": "X", times in microseconds), with its
+        attributes, counters, error and parent id in "args".
+        """
+        with self.lock:
+            spans = list(self.spans)
+        origin = min((s.start for s in spans), default=0)
+        events = []
+        for s in sorted(spans, key=lambda s: s.start):
+            events.append({'name': s.name, 'ph': 'X', 'pid': 0, 'tid': s.thread,
+                           'ts': (s.start - origin) * 1e6, 'dur': s.duration * 1e6,
+                           'args': {'id': s.id, 'parent': s.parent, 'error': s.error, **s.attrs, **s.counters}})
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False, default=str)
+
+    def summary(self) -> Dict[str, dict]:
+        """The aggregates per name.
+
+        Returns
+        -------
+        Dict[str, dict]
+            name -> count, errors, total / mean / p50 / p95 / max seconds, and the sum of
+            each counter over the spans and their descendants, plus the estimated cost.
+            Past sampleSize spans of a name, p50 and p95 are estimated from a sample
+        """
+        result = {}
+        with self.lock:
+            for name, aggregate in self.aggregates.items():
+                if aggregate.count == 0:
+                    # only counters rolled up from spans that finished after it, e.g. cancelled work
+                    continue
+                durations = sorted(aggregate.durations)
+                result[name] = {
+                    'count': aggregate.count,
+                    'errors': aggregate.errors,
+                    'total': aggregate.total,
+                    'mean': aggregate.total / aggregate.count,
+                    'p50': _percentile(durations, 50),
+                    'p95': _percentile(durations, 95),
+                    'max': aggregate.max,
+                    **aggregate.counters,
+                }
+        return result
+
+    def showSummary(self) -> None:
+        """Print the summary as a table, slowest total first."""
+        summary = self.summary()
+        print(f"{'span':<16}{'count':>7}{'errors':>7}{'total s':>10}{'mean s':>9}{'p50 s':>9}{'p95 s':>9}{'max s':>9}"
+              f"{'prompt tok':>12}{'compl tok':>11}{'cost $':>9}{'retries':>8}{'cache hit':>10}")
+        for name, s in sorted(summary.items(), key=lambda item: -item[1]['total']):
+            print(f"{name:<16}{s['count']:>7}{s['errors']:>7}{s['total']:>10.2f}{s['mean']:>9.2f}{s['p50']:>9.2f}{s['p95']:>9.2f}{s['max']:>9.2f}"
+                  f"{int(s.get('prompt_tokens', 0)):>12}{int(s.get('completion_tokens', 0)):>11}{s.get('cost', 0):>9.3f}"
+                  f"{int(s.get('retries', 0)):>8}{int(s.get('cache_hits', 0)):>10}")
+
+
+def _percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+tracer = Tracer()
+
+
+def span(name: str, **attrs) -> _SpanContext:
+    """Time a block as a span of the process-wide tracer.
+
+    Example
+    -------
+    with span('fetch', url=url) as s:
+        ...
+        s.add('cache_hits')
+    """
+    return tracer.span(name, **attrs)
+
+
+def current() -> Optional[Span]:
+    """The innermost open span of this context, None outside any span."""
+    return _current.get()
+
+
+def count(counter: str, value: float = 1) -> None:
+    """Add to a counter of the current span, if any."""
+    s = _current.get()
+    if s is not None:
+        s.add(counter, value)
+
+
+def recordUsage(model: str, usage) -> None:
+    """Add the token usage of a model response (and its estimated cost) to the current span."""
+    if usage is None:
+        return
+    for counter in TOKEN_COUNTERS:
+        count(counter, getattr(usage, counter, 0) or 0)
+    if model in MODEL_PRICES:
+        inputPrice, outputPrice = MODEL_PRICES[model]
+        count('cost', ((usage.prompt_tokens or 0) * inputPrice + (usage.completion_tokens or 0) * outputPrice) / 1e6)
+
+
+def inContext(fn):
+    """Wrap fn to run in a copy of the current context, e.g. before submitting it to a thread pool,
+    so the spans it opens are children of the current span."""
+    return functools.partial(contextvars.copy_context().run, fn)
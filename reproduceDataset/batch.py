@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import argparse
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline import Pipeline, EXTRACTORS
+from resultStore import ResultStore
+from batchApi import BatchJob, makeRequest
+from instrument import tracer
+from config import BATCH_WORKERS, BATCH_SHARD_SIZE, BATCH_MAX_ATTEMPTS, BATCH_FULL_CONTEXT_WEBSITES, EXTRACTOR, RELEVANCE_RANKING
+from config import CHECKPOINT_PATH
+
+
+"""
+Batch driver for building a dataset from many questions.
+
+Each question is processed by its own Pipeline, several questions at the same time.
+Finished records are appended to a ResultStore (sharded jsonl files keyed by question),
+one line per question:
+- question: str
+- id: the id given in the question list, if any
+- status: "done" or "failed"
+- attempts: int
+- errorCode: str, only for failed questions
+- data: the output of the Pipeline, see ReadMe.md Output part
+
+When the batch is restarted with the same output folder, questions that are already
+done or failed are skipped. A retried or restarted question resumes from the stage
+checkpoints of its previous run, see Pipeline; the checkpoints of a question are removed
+once it is marked failed.
+
+With --batch-api FOLDER, the full-context calls are first run as one job of the provider
+batch API (see batchApi.py): every question gets its keywords and search results, the
+first BATCH_FULL_CONTEXT_WEBSITES results are fetched, and the responses of the job are
+checkpointed as website stages. The pipelines then run as usual, taking those websites
+from the checkpoints, so only the calls that failed in the job (or websites beyond the
+first ones, when too few are good) are made online.
+"""
+
+
+def loadQuestions(path:str)->list[dict]:
+    """Load the question list.
+
+    Parameters
+    ----------
+    path : str
+        A .jsonl file where each line has a "question" key (and optionally an "id" key),
+        or a text file with one question per line.
+
+    Returns
+    -------
+    list[dict]
+        List of {"question": str} dicts, with "id" if it is given
+    """
+    questions=[]
+    with open(path,'r',encoding='utf-8') as f:
+        for line in f:
+            line=line.strip()
+            if line=='':
+                continue
+            if path.endswith('.jsonl'):
+                item=json.loads(line)
+                questions.append({k:item[k] for k in ('id','question') if k in item})
+            else:
+                questions.append({'question':line})
+    return questions
+
+
+def runQuestion(item:dict,maxAttempts:int=BATCH_MAX_ATTEMPTS,extractor:str=EXTRACTOR,rank:bool=RELEVANCE_RANKING)->dict:
+    """Run the Pipeline on one question, retrying failed runs.
+
+    Parameters
+    ----------
+    item : dict
+        {"question": str} with an optional "id"
+    maxAttempts : int, optional
+        The question is marked as failed after this many unsuccessful runs
+    extractor : str, optional
+        How websites become text, see Pipeline
+    rank : bool, optional
+        Whether websites are analyzed in order of relevance, see Pipeline
+
+    Returns
+    -------
+    dict
+        The record to write, see the module docstring
+    """
+    record=dict(item)
+    for attempt in range(1,maxAttempts+1):
+        pipeline=Pipeline(item['question'],None,extractor=extractor,rank=rank)
+        if 'id' in item:
+            pipeline.data['id']=item['id']
+        try:
+            pipeline.process()
+        except Exception as e:
+            pipeline.errorCode=f"Unexpected error: {e}"
+        record['attempts']=attempt
+        record['data']=pipeline.data
+        if pipeline.errorCode is None:
+            record['status']='done'
+            return record
+        record['errorCode']=pipeline.errorCode
+    record['status']='failed'
+    # the question is given up, a later batch starts it from scratch
+    if pipeline.checkpoint is not None:
+        pipeline.checkpoint.clear()
+    return record
+
+
+def runBatch(questions:list[dict],saveTo:str,workers:int=BATCH_WORKERS,shardSize:int=BATCH_SHARD_SIZE,maxAttempts:int=BATCH_MAX_ATTEMPTS,jobFolder:str=None,extractor:str=EXTRACTOR,rank:bool=RELEVANCE_RANKING)->dict:
+    """Build records for many questions concurrently.
+
+    Parameters
+    ----------
+    questions : list[dict]
+        The output of loadQuestions
+    saveTo : str
+        The folder of the ResultStore
+    workers : int, optional
+        Number of questions processed at the same time
+    shardSize : int, optional
+        Number of records per shard
+    maxAttempts : int, optional
+        Number of runs before a question is marked as failed
+    jobFolder : str, optional
+        If given, the full-context calls are first run as a batch API job kept in this
+        folder, see runFullContextJob
+    extractor : str, optional
+        How websites become text, see Pipeline
+    rank : bool, optional
+        Whether websites are analyzed in order of relevance, see Pipeline
+
+    Returns
+    -------
+    dict
+        Number of questions that are done, failed and skipped in this run
+    """
+    store=ResultStore(saveTo,shardSize)
+    finished={r['question'] for r in store.records(latest=True) if r.get('status') in ('done','failed')}
+    todo=[q for q in questions if q['question'] not in finished]
+    summary={'done':0,'failed':0,'skipped':len(questions)-len(todo)}
+    print(f"{summary['skipped']} questions already finished, {len(todo)} to go")
+    if jobFolder is not None:
+        runFullContextJob(todo,jobFolder,workers,extractor=extractor,rank=rank)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures=[pool.submit(runQuestion,q,maxAttempts,extractor,rank) for q in todo]
+        for future in as_completed(futures):
+            record=future.result()
+            store.append(record,key=record['question'])
+            summary[record['status']]+=1
+            print(f"[{summary['done']+summary['failed']}/{len(todo)}] {record['status']}: {record['question']}")
+    store.close()
+    return summary
+
+
+def runFullContextJob(questions:list[dict],jobFolder:str,workers:int=BATCH_WORKERS,limit:int=BATCH_FULL_CONTEXT_WEBSITES,extractor:str=EXTRACTOR,rank:bool=RELEVANCE_RANKING)->dict:
+    """Run the full-context calls of the questions as a batch API job, see the module docstring.
+
+    Parameters
+    ----------
+    questions : list[dict]
+        The questions still to run
+    jobFolder : str
+        The folder of the BatchJob
+    workers : int, optional
+        Number of questions searched and fetched at the same time
+    limit : int, optional
+        Number of search results analyzed per question
+    extractor : str, optional
+        How websites become text, see Pipeline
+    rank : bool, optional
+        Whether the most relevant search results are analyzed rather than the first ones, see Pipeline
+
+    Returns
+    -------
+    dict
+        Number of calls submitted, and of websites decided by the job
+    """
+    if not CHECKPOINT_PATH:
+        raise ValueError("the batch API job hands its results to the pipelines through checkpoints, set CHECKPOINT_PATH")
+    def prepare(item:dict)->list[dict]:
+        return Pipeline(item['question'],None,extractor=extractor,rank=rank).fullContextCalls(limit)
+    calls={}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for k,prepared in enumerate(pool.map(prepare,questions)):
+            for call in prepared:
+                calls[f"{k}:{call['stage']}"]=(k,call)
+    print(f"{len(calls)} full-context calls to submit")
+    summary={'calls':len(calls),'decided':0}
+    if not calls:
+        return summary
+    responses=BatchJob(jobFolder).run([makeRequest(customId,call['messages']) for customId,(_,call) in calls.items()])
+    for customId,(k,call) in calls.items():
+        if Pipeline(questions[k]['question'],None,extractor=extractor).ingestFullContext(call,*responses[customId]):
+            summary['decided']+=1
+    print(f"{summary['decided']}/{summary['calls']} websites decided by the batch job")
+    return summary
+
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Build dataset records for a list of questions")
+    parser.add_argument('questions',help="A .jsonl file with a question key per line, or a text file with one question per line")
+    parser.add_argument('saveTo',help="The folder of the result store")
+    parser.add_argument('--workers',type=int,default=BATCH_WORKERS)
+    parser.add_argument('--shard-size',type=int,default=BATCH_SHARD_SIZE)
+    parser.add_argument('--max-attempts',type=int,default=BATCH_MAX_ATTEMPTS)
+    parser.add_argument('--batch-api',metavar='FOLDER',help="Run the full-context calls as a batch API job kept in this folder first")
+    parser.add_argument('--extractor',choices=EXTRACTORS,default=EXTRACTOR,help="How websites become text: the reader service, or local HTML extraction")
+    parser.add_argument('--rank',action='store_true',default=RELEVANCE_RANKING,help="Fetch all search results first, and analyze them in order of relevance (BM25), pruning clear non-matches")
+    parser.add_argument('--trace',help="Write the timing / token trace of the batch to this json file")
+    args=parser.parse_args()
+    if args.batch_api and not CHECKPOINT_PATH:
+        parser.error("--batch-api needs checkpoints, set CHECKPOINT_PATH")
+    # the spans themselves are only kept for the trace, the summary table is aggregated as they finish
+    tracer.keepSpans=bool(args.trace)
+    summary=runBatch(loadQuestions(args.questions),args.saveTo,args.workers,args.shard_size,args.max_attempts,args.batch_api,args.extractor,args.rank)
+    print(summary)
+    tracer.showSummary()
+    if args.trace:
+        tracer.export(args.trace)
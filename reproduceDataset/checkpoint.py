@@ -0,0 +1,74 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+
+from typing import Optional
+
+from config import CHECKPOINT_MAX_AGE
+
+
+class Checkpoint:
+    """Per-stage checkpoints of one Pipeline run.
+
+    Each completed stage is a json file in the folder of the question: keywords.json,
+    search.json, website-0007.json (the outcome of the 7th search result) and
+    summary.json. A file is written to a temporary name and moved into place with
+    os.replace, so a crash never leaves a half-written stage; a stage is either fully
+    there or missing, and a missing stage is simply run again. A stage older than maxAge
+    counts as missing.
+
+    Parameters
+    ----------
+    root : str
+        The folder of all checkpoints, see CHECKPOINT_PATH in config
+    question : str
+        The question of the run, its checkpoints live in a folder named by its hash
+    version : str, optional
+        What else the stages depend on (model, prompts, extractor...), see Pipeline. A run
+        with another version does not see these checkpoints
+    maxAge : float, optional
+        Seconds a stage is reused, by default CHECKPOINT_MAX_AGE
+    """
+    def __init__(self,root:str,question:str,version:str="",maxAge:float=CHECKPOINT_MAX_AGE):
+        self.folder=os.path.join(root,hashlib.sha256(f"{version}\n{question}".encode('utf-8')).hexdigest()[:24])
+        self.question=question
+        self.version=version
+        self.maxAge=maxAge
+
+    def _path(self,stage:str)->str:
+        return os.path.join(self.folder,f"{stage}.json")
+
+    def load(self,stage:str)->Optional[dict]:
+        """The saved value of a stage, None if the stage has not completed."""
+        path=self._path(stage)
+        try:
+            if time.time()-os.path.getmtime(path)>self.maxAge:
+                return None
+            with open(path,'r',encoding='utf-8') as f:
+                saved=json.load(f)
+        except (FileNotFoundError,json.JSONDecodeError):
+            return None
+        # two runs with the same hash prefix must not share checkpoints
+        if saved.get('question')!=self.question or saved.get('version','')!=self.version:
+            return None
+        return saved['value']
+
+    def save(self,stage:str,value)->None:
+        os.makedirs(self.folder,exist_ok=True)
+        path=self._path(stage)
+        tmp=f"{path}.{os.getpid()}.tmp"
+        with open(tmp,'w',encoding='utf-8') as f:
+            json.dump({'question':self.question,'version':self.version,'value':value},f,ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp,path)
+
+    def clear(self)->None:
+        """Remove the checkpoints of the question, once its record is complete or it is given up."""
+        shutil.rmtree(self.folder,ignore_errors=True)
+
+
+def websiteStage(i:int)->str:
+    return f"website-{i:04d}"
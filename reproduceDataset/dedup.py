@@ -0,0 +1,128 @@
+import threading
+
+from typing import Optional
+
+import numpy as np
+
+from config import DEDUP_THRESHOLD, DEDUP_SKETCH_SIZE
+
+
+"""
+Near-duplicate detection of fetched pages (syndicated or mirrored copies of an article).
+
+A page is fingerprinted by a bottom-k MinHash sketch: its text is normalized (ASCII
+lowercased, runs of whitespace collapsed), every overlapping 8-byte shingle is hashed,
+and the DEDUP_SKETCH_SIZE smallest distinct hashes are kept. Two sketches estimate the
+Jaccard similarity of the shingle sets of their pages. Everything is vectorized with
+numpy, a 20k character page takes a fraction of a millisecond.
+
+The header the reader service (and the local extractor) puts before the content
+(title, URL) is left out, so copies served under different URLs still match.
+"""
+
+SHINGLE = 8
+# odd 64-bit multiplier (2^64 / golden ratio), a fast multiplicative hash of the shingles
+_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_SPACE = 32
+# ASCII upper case to lower case, whitespace to spaces
+_TABLE = bytes.maketrans(bytes(range(65, 91)) + b'\t\n\r\x0b\x0c', bytes(range(97, 123)) + b'     ')
+CONTENT_MARK = "Markdown Content:"
+
+
+def _normalize(text: str) -> np.ndarray:
+    start = text.find(CONTENT_MARK)
+    if start >= 0:
+        text = text[start + len(CONTENT_MARK):]
+    data = np.frombuffer(text.encode('utf-8', 'ignore').translate(_TABLE), dtype=np.uint8)
+    keep = np.ones(len(data), dtype=bool)
+    keep[1:] = (data[1:] != _SPACE) | (data[:-1] != _SPACE)
+    return data[keep]
+
+
+def fingerprint(text: str, size: int = DEDUP_SKETCH_SIZE) -> np.ndarray:
+    """The bottom-k MinHash sketch of a page.
+
+    Parameters
+    ----------
+    text : str
+        The content of the page
+    size : int, optional
+        Number of hashes kept, by default from config
+
+    Returns
+    -------
+    np.ndarray
+        Up to size sorted distinct uint64 hashes, fewer for very short pages
+    """
+    data = _normalize(text)
+    if len(data) < SHINGLE:
+        data = np.concatenate([data, np.zeros(SHINGLE - len(data), dtype=np.uint8)])
+    # every overlapping 8-byte window read as one integer, without copying the windows
+    shingles = np.ndarray((len(data) - SHINGLE + 1,), dtype='<u8', buffer=data, strides=(1,))
+    # multiplicative hashing: the high bits, which decide the order, depend on every byte
+    hashes = shingles * _MULTIPLIER
+    # the hashes are uniform, so the smallest ones are below a cutoff, found without sorting
+    fraction = 4 * size / len(hashes)
+    while fraction < 1:
+        smallest = np.unique(hashes[hashes < np.uint64(int(fraction * 2 ** 64))])
+        if len(smallest) >= size:
+            return smallest[:size]
+        # a page repeating itself has fewer distinct shingles
+        fraction *= 4
+    return np.unique(hashes)[:size]
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the pages of two sketches.
+
+    The share of the k smallest hashes of both sketches together that are in both.
+    """
+    k = min(len(a), len(b))
+    if k == 0:
+        return 0.0
+    merged = np.concatenate([a, b])
+    merged.sort()
+    repeated = merged[1:] == merged[:-1]
+    # each sketch has distinct hashes, so a repeated hash is in both
+    shared = merged[1:][repeated]
+    union = merged[np.concatenate([[True], ~repeated])]
+    return np.count_nonzero(shared <= union[k - 1]) / k
+
+
+class DuplicateIndex:
+    """Sketches of the pages of one question, by search index, shared by the crawl threads.
+
+    Parameters
+    ----------
+    threshold : float, optional
+        Estimated similarity from which two pages are copies, by default from config
+    """
+    def __init__(self, threshold: float = DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.sketches = {}
+
+    def add(self, index: int, url: str, content: str) -> np.ndarray:
+        """Fingerprint a page once, and return its sketch."""
+        with self.lock:
+            if index in self.sketches:
+                return self.sketches[index][1]
+        sketch = fingerprint(content)
+        with self.lock:
+            return self.sketches.setdefault(index, (url, sketch))[1]
+
+    def find(self, index: int, sketch: np.ndarray) -> Optional[tuple[str, float]]:
+        """The first page before index (in search order) that the page is a copy of.
+
+        Returns
+        -------
+        Optional[tuple[str, float]]
+            (url, similarity) of that page, None if the page is not a copy of an earlier one
+        """
+        with self.lock:
+            earlier = sorted((j, entry) for j, entry in self.sketches.items() if j < index)
+        for _, (url, other) in earlier:
+            score = similarity(sketch, other)
+            if score >= self.threshold:
+                return url, score
+        return None
@@ -0,0 +1,203 @@
+import threading
+import multiprocessing
+
+from typing import Optional, Union
+from concurrent.futures import ProcessPoolExecutor
+
+import requests
+import lxml.html
+
+from readability import Document
+from readability.htmls import build_doc, shorten_title
+from lxml_html_clean import Cleaner
+
+from config import EXTRACT_WORKERS, LOCAL_FETCH_USER_AGENT, LOCAL_FETCH_MAX_BYTES, READER_TIMEOUT
+
+
+"""
+Local extraction backend: download the raw HTML of a page and turn it into text.
+
+The main content is found with readability, cleaned with lxml_html_clean, and rendered
+as markdown-like text (headings, paragraphs, lists, tables, links) in the same layout
+as the reader service ("Title: ...", "URL Source: ...", "Markdown Content:"), so the
+prompts see the same kind of content with either backend.
+
+Parsing is CPU-bound, so it runs on a process pool shared by all crawl threads of the
+process, while the threads only download. Select it with EXTRACTOR in config or the
+extractor argument of Pipeline.
+"""
+
+# statuses of pages that were downloaded but give no text
+UNSUPPORTED_TYPE = 415
+UNPARSEABLE = 422
+
+HEADINGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+BLOCK_TAGS = HEADINGS | {
+    'p', 'div', 'section', 'article', 'main', 'header', 'footer', 'aside', 'nav', 'form', 'ul', 'ol', 'li', 'dl', 'dt',
+    'dd', 'table', 'thead', 'tbody', 'tfoot', 'tr', 'td', 'th', 'blockquote', 'pre', 'figure', 'figcaption', 'hr',
+}
+PREFIXES = {'li': '- ', 'blockquote': '> ', 'dd': '  '}
+
+CLEANER = Cleaner(scripts=True, javascript=True, comments=True, style=True, inline_style=True, links=True, meta=True,
+                  page_structure=False, processing_instructions=True, embedded=True, frames=True, forms=True,
+                  remove_unknown_tags=False, safe_attrs_only=True, safe_attrs={'href'})
+
+
+def _clean(text: str) -> str:
+    """Collapse the whitespace of each line, dropping empty lines."""
+    lines = (' '.join(line.split()) for line in text.split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+def _inline(element) -> str:
+    """The text of an element without block children, with links as [text](href)."""
+    parts = [element.text or '']
+    for child in element:
+        if child.tag == 'br':
+            parts.append('\n')
+        elif child.tag == 'a' and (child.get('href') or '').startswith('http'):
+            text = ' '.join(_inline(child).split())
+            parts.append(f"[{text}]({child.get('href')})" if text else '')
+        elif isinstance(child.tag, str):
+            parts.append(_inline(child))
+        parts.append(child.tail or '')
+    return ''.join(parts)
+
+
+def _hasBlock(element) -> bool:
+    return any(isinstance(d.tag, str) and d.tag in BLOCK_TAGS for d in element.iterdescendants())
+
+
+def _blocks(element, out: list[str]) -> None:
+    """Append the blocks of text of an element to out."""
+    tag = element.tag
+    if not isinstance(tag, str):
+        return
+    if tag in HEADINGS:
+        out.append('#' * int(tag[1]) + ' ' + ' '.join(_inline(element).split()))
+    elif tag == 'pre':
+        out.append('```\n' + element.text_content().strip('\n') + '\n```')
+    elif tag == 'tr':
+        cells = [' '.join(_inline(cell).split()) for cell in element if cell.tag in ('td', 'th')]
+        out.append('| ' + ' | '.join(cells) + ' |')
+    elif tag == 'hr':
+        out.append('---')
+    elif not _hasBlock(element):
+        text = _clean(_inline(element))
+        if text:
+            out.append(PREFIXES.get(tag, '') + text)
+    else:
+        if element.text and element.text.strip():
+            out.append(_clean(element.text))
+        for child in element:
+            _blocks(child, out)
+            if child.tail and child.tail.strip():
+                out.append(_clean(child.tail))
+
+
+def _join(blocks: list[str]) -> str:
+    """Blocks separated by a blank line, except consecutive list items or table rows."""
+    parts = []
+    for k, block in enumerate(blocks):
+        if k > 0:
+            kind = block[:2] if block[:2] in ('- ', '| ') else None
+            parts.append('\n' if kind is not None and blocks[k - 1].startswith(kind) else '\n\n')
+        parts.append(block)
+    return ''.join(parts)
+
+
+def htmlToText(html: Union[str, bytes], url: str = '') -> str:
+    """Extract the main content of a page as markdown-like text.
+
+    Parameters
+    ----------
+    html : Union[str, bytes]
+        The page, bytes are decoded from the charset the page declares
+    url : str, optional
+        The URL of the page, relative links are resolved against it
+
+    Returns
+    -------
+    str
+        The text in the layout of the reader service
+    """
+    # the title from a plain parse: short_title() would clean and parse the whole page once more
+    title = ' '.join(shorten_title(build_doc(html)[0]).split())
+    # links are made absolute on the extracted part only, not on the whole page as Document(url=...) does
+    tree = lxml.html.fromstring(Document(html).summary(html_partial=True))
+    tree = CLEANER.clean_html(tree)
+    if url:
+        tree.make_links_absolute(url, resolve_base_href=False)
+    out = []
+    _blocks(tree, out)
+    return f"Title: {title}\n\nURL Source: {url}\n\nMarkdown Content:\n{_join(out)}"
+
+
+def _extract(html: bytes, url: str) -> tuple[int, Optional[str]]:
+    try:
+        return 200, htmlToText(html, url)
+    except Exception:
+        return UNPARSEABLE, None
+
+
+_pool = None
+_poolLock = threading.Lock()
+
+
+def getPool() -> ProcessPoolExecutor:
+    """The extraction pool of the process, created on first use."""
+    global _pool
+    with _poolLock:
+        if _pool is None:
+            # spawn rather than fork, the pool is created while crawl threads are running
+            _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def download(url: str, timeout: float = READER_TIMEOUT) -> tuple[int, Optional[Union[bytes, str]], str]:
+    """Download a page, keeping at most LOCAL_FETCH_MAX_BYTES.
+
+    Returns
+    -------
+    tuple
+        (status, body, content type), body is None if the status is not 200, and
+        already decoded for text/plain
+    """
+    with requests.get(url, headers={'User-Agent': LOCAL_FETCH_USER_AGENT}, timeout=timeout, stream=True) as response:
+        contentType = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if response.status_code != 200:
+            return response.status_code, None, contentType
+        body = bytearray()
+        for chunk in response.iter_content(64 * 1024):
+            body.extend(chunk)
+            if len(body) >= LOCAL_FETCH_MAX_BYTES:
+                break
+        if contentType == 'text/plain':
+            return 200, bytes(body).decode(response.encoding or 'utf-8', 'replace'), contentType
+        return 200, bytes(body), contentType
+
+
+def fetchText(url: str, timeout: float = READER_TIMEOUT) -> tuple[int, Optional[str]]:
+    """Get the text of a page with the local backend, the counterpart of the reader service.
+
+    Parameters
+    ----------
+    url : str
+        The URL of the page
+    timeout : float, optional
+        Seconds before the download is given up, by default READER_TIMEOUT
+
+    Returns
+    -------
+    tuple
+        (status, content), content is None if the status is not 200. Pages that are not
+        HTML or plain text are UNSUPPORTED_TYPE, pages readability can not parse UNPARSEABLE
+    """
+    status, body, contentType = download(url, timeout)
+    if status != 200:
+        return status, None
+    if contentType == 'text/plain':
+        return 200, body
+    if contentType not in ('', 'text/html', 'application/xhtml+xml'):
+        return UNSUPPORTED_TYPE, None
+    return getPool().submit(_extract, body, url).result()
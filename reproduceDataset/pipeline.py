@@ -1,9 +1,12 @@
 import os
 import sys
 import json
+import hashlib
 import requests
-import urllib.robotparser
 import time
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -12,7 +15,18 @@ from urllib.parse import urlparse
 from serpapi import GoogleSearch
 
 from Tools import chatWithGPT, jsonClean
-from config import SERPAPI_API_KEY, DEFAULT_USER_AGENT, KEYWORD_PROMPT_PATH, FULL_CONTEXT_PROMPT_PATH, SUMMARIZING_PROMPT_PATH
+from tokenBudget import countTokens, fitTexts
+from resultStore import ResultStore
+from instrument import span, count, inContext
+from config import SERPAPI_API_KEY, SERPAPI_BASE_URL, DEFAULT_USER_AGENT, KEYWORD_PROMPT_PATH, FULL_CONTEXT_PROMPT_PATH, SUMMARIZING_PROMPT_PATH, MERGE_PROMPT_PATH
+from config import FULL_CONTEXT_TOKEN_BUDGET, SUMMARY_CHUNK_SIZE, SUMMARY_WORKERS, DEFAULT_MODEL, DEFAULT_TEMPERATURE, DEFAULT_MAX_TOKENS
+from config import MAX_GOOD_WEBSITES, CRAWL_WORKERS, CRAWL_HOST_DELAY, READER_URL, READER_TIMEOUT, ROBOTS_CACHE_PATH, PAGE_CACHE_PATH
+from config import CHECKPOINT_PATH, BATCH_FULL_CONTEXT_WEBSITES, EXTRACTOR, DEDUP_THRESHOLD, RELEVANCE_RANKING, RELEVANCE_THRESHOLD
+from webCache import RobotsCache, PageCache
+from checkpoint import Checkpoint, websiteStage
+from extract import fetchText
+from dedup import DuplicateIndex
+from relevance import bm25
 
 
 """
@@ -22,6 +36,11 @@ It is only used in getWebsites function.
 If you want to alter the way to get websites, you can change the function.
 """
 
+GoogleSearch.BACKEND = SERPAPI_BASE_URL
+
+# shared by all pipelines in the process, and persisted so other runs reuse it
+pageCache=PageCache(PAGE_CACHE_PATH)
+
 
 def is_allowed_by_robots(url:str, user_agent:str=DEFAULT_USER_AGENT)->bool:
     """Check if a URL is allowed to be crawled according to robots.txt.
@@ -29,6 +48,7 @@ def is_allowed_by_robots(url:str, user_agent:str=DEFAULT_USER_AGENT)->bool:
     We automatically respected robots.txt policies for all websites by using Python's robotparser before any retrieval.
     Only publicly accessible pages were processed. No login-restricted, private, or sensitive content was accessed or stored.
     All collected content is used solely for academic research and will not be redistributed in full text.
+    robots.txt is fetched once per host and reused, see RobotsCache.
     Parameters
     ----------
     url : str
@@ -41,14 +61,10 @@ def is_allowed_by_robots(url:str, user_agent:str=DEFAULT_USER_AGENT)->bool:
     bool
         True if the URL is allowed to be crawled, False otherwise
     """
-    
-    parsed_url = urlparse(url)
-    robots_url = f"{parsed_url.scheme}://{parsed_url.netloc}/robots.txt"
-
-    rp = urllib.robotparser.RobotFileParser()
-    rp.set_url(robots_url)
     try:
-        rp.read()
+        rp = robotsCache.parser(url)
+        if rp is None:
+            return True
         return rp.can_fetch(user_agent, url)
     except:
         return True
@@ -72,23 +88,95 @@ def getWebsites(q:str)->tuple[list[str],bool]:
         - websites: List of website URLs from search results
         - success_status: Boolean indicating if the search was successful
     """
-    try:
-        params = {
-            "engine": "google",
-            "q": q,
-            "num":40,
-            "api_key": SERPAPI_API_KEY
-        }
-        search = GoogleSearch(params)
-        results = search.get_dict()
-        organic_results = results["organic_results"]
-        answer=[]
-        for result in organic_results:
-            if "link" in result.keys() and (type(result['link']) is str):
-                answer.append(result['link'])
-        return answer,True
-    except Exception as e:
-        return [],False
+    with span("search",query=q) as searchSpan:
+        try:
+            params = {
+                "engine": "google",
+                "q": q,
+                "num":40,
+                "api_key": SERPAPI_API_KEY
+            }
+            search = GoogleSearch(params)
+            results = search.get_dict()
+            organic_results = results["organic_results"]
+            answer=[]
+            for result in organic_results:
+                if "link" in result.keys() and (type(result['link']) is str):
+                    answer.append(result['link'])
+            searchSpan.set(results=len(answer))
+            return answer,True
+        except Exception as e:
+            searchSpan.fail(e)
+            return [],False
+
+# extraction backends, see EXTRACTOR in config
+EXTRACTORS=("reader","local")
+
+
+def fetchWebsite(url:str,extractor:str=EXTRACTOR)->tuple[int,str]:
+    """Get the text of a website.
+
+    The page cache is checked first, so a page fetched by an earlier question or run
+    does not need the network until it expires.
+
+    Parameters
+    ----------
+    url : str
+        The URL of the website
+    extractor : str, optional
+        "reader" to ask the reader service, or "local" to download the HTML and extract
+        the text in this process (see extract.py), by default from config. The page cache
+        keeps the texts of each backend apart
+
+    Returns
+    -------
+    tuple
+        (status, content), content is None if the status is not 200
+    """
+    # the reader keeps the default namespace of the cache
+    namespace = "" if extractor == "reader" else extractor
+    cached = pageCache.get(url, namespace)
+    if cached is not None:
+        count("cache_hits")
+        return cached
+    hostThrottle.wait(url)
+    if extractor == "local":
+        status, content = fetchText(url)
+    else:
+        headers = {"Content-Type": "application/json"}
+        payload = {"url": url}
+        response = requests.post(READER_URL, headers=headers, json=payload, timeout=READER_TIMEOUT)
+        status, content = response.status_code, response.text if response.status_code == 200 else None
+    pageCache.put(url, status, content, namespace)
+    return status, content
+
+
+class HostThrottle:
+    """Per-host politeness for concurrent crawling.
+
+    Requests to the same host are spaced by at least `delay` seconds, while
+    different hosts are crawled in parallel.
+    """
+    def __init__(self,delay:float=CRAWL_HOST_DELAY):
+        self.delay=delay
+        self.lock=threading.Lock()
+        self.nextSlot={}
+    def wait(self,url:str)->None:
+        host=urlparse(url).netloc.lower()
+        with self.lock:
+            now=time.monotonic()
+            slot=max(now,self.nextSlot.get(host,now))
+            self.nextSlot[host]=slot+self.delay
+        if slot>now:
+            time.sleep(slot-now)
+
+# shared by all pipelines in the process, so concurrent questions are polite to the same host as well
+hostThrottle=HostThrottle()
+# robots.txt requests count against the host like page requests
+robotsCache=RobotsCache(ROBOTS_CACHE_PATH,throttle=hostThrottle.wait)
+# shared by all pipelines in the process as well: concurrent questions (batch workers)
+# crawl at most CRAWL_WORKERS websites at once in total
+crawlPool=ThreadPoolExecutor(max_workers=CRAWL_WORKERS,thread_name_prefix="crawl")
 
 # Read prompt file
 with open(KEYWORD_PROMPT_PATH, "r", encoding='utf-8') as f:
@@ -97,72 +185,502 @@ with open(FULL_CONTEXT_PROMPT_PATH, 'r') as f:
     FCprompt = f.read()
 with open(SUMMARIZING_PROMPT_PATH, 'r') as f:
     Summarizingprompt = f.read()
+with open(MERGE_PROMPT_PATH, 'r') as f:
+    Mergeprompt = f.read()
+
+
+def checkpointVersion(extractor:str)->str:
+    """Digest of what the checkpointed stages depend on besides the question.
+
+    A change of model, sampling settings, prompts, extractor or the settings deciding websites
+    and summaries gives new checkpoints instead of reusing the stages of the old setup.
+    """
+    parts=[DEFAULT_MODEL,DEFAULT_TEMPERATURE,DEFAULT_MAX_TOKENS,keywordPrompt,FCprompt,Summarizingprompt,Mergeprompt,extractor,
+           FULL_CONTEXT_TOKEN_BUDGET,DEDUP_THRESHOLD,SUMMARY_CHUNK_SIZE]
+    return hashlib.sha256(json.dumps(parts,ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
 
 
 class Pipeline:
-    def __init__(self,question:str,saveTo:str):
+    """Build one dataset record from a question.
+
+    Parameters
+    ----------
+    question : str
+        The question to build the record for
+    saveTo : str or ResultStore
+        Where to save the json file, or a ResultStore to append the record to (keyed by
+        its id, or the question). If None, the result is only kept in self.data
+    checkpointTo : str, optional
+        The folder of the per-stage checkpoints, by default CHECKPOINT_PATH. A run of the
+        same question resumes from the completed stages (keywords, search, each website,
+        summary), and the checkpoints are removed once the run succeeds. They are kept apart
+        for each model, prompts and extractor (see checkpointVersion), and expire after
+        CHECKPOINT_MAX_AGE. None to disable
+    extractor : str, optional
+        How a website becomes text, "reader" or "local", by default from config. See fetchWebsite
+    rank : bool, optional
+        Fetch all search results first, then make the full-context calls in order of
+        relevance to the question (BM25, see relevance.py), skipping the pages scoring
+        below RELEVANCE_THRESHOLD of the best one. By default RELEVANCE_RANKING
+
+    A fetched website whose content is a near-duplicate of an earlier search result
+    (DEDUP_THRESHOLD, see dedup.py) gets no full-context call, and is recorded with the
+    URL it duplicates instead of its own analysis.
+    """
+    def __init__(self,question:str,saveTo:str,checkpointTo:str=CHECKPOINT_PATH,extractor:str=EXTRACTOR,rank:bool=RELEVANCE_RANKING):
+        if extractor not in EXTRACTORS:
+            raise ValueError(f"unknown extractor {extractor}, expected one of {EXTRACTORS}")
         self.question = question
+        self.extractor = extractor
+        self.rank = rank
         self.saveTo = saveTo
         self.errorCode = None
         self.data={'question':question}
-    def _process(self)->None:
-        # search for websites
-        print("search for websites...")
-        response,success=chatWithGPT([
-            {"role": "system", "content": keywordPrompt},
-            {"role": "user", "content": self.question}
-        ])
+        self.stop=threading.Event()
+        self.checkpoint=Checkpoint(checkpointTo,question,checkpointVersion(extractor)) if checkpointTo else None
+        self.duplicates=DuplicateIndex() if DEDUP_THRESHOLD is not None else None
+        # full-context calls made by the crawl threads
+        self.calls=0
+        self.lock=threading.Lock()
+    def _stage(self,name:str,run):
+        """Load a completed stage from the checkpoint, or run it and save its value.
+
+        run returns the value of the stage, or None (with self.errorCode set) if it failed.
+        """
+        if self.checkpoint is not None:
+            saved=self.checkpoint.load(name)
+            if saved is not None:
+                print(f"{name} loaded from checkpoint")
+                return saved
+        value=run()
+        if value is not None and self.checkpoint is not None:
+            self.checkpoint.save(name,value)
+        return value
+    def _crawlWebsite(self,i:int,url:str)->dict:
+        """Fetch one website and run the full-context analysis on it.
+
+        This runs inside a crawl worker thread, so it does not touch self.data.
+        The outcome is committed later by _crawl, in search order.
+        A final outcome is checkpointed, and a rerun takes it from the checkpoint.
+
+        Parameters
+        ----------
+        i : int
+            The index of the website in the search results (starting from 1)
+        url : str
+            The URL of the website
+
+        Returns
+        -------
+        dict
+            - content: The text of the website, None if it could not be fetched
+            - result: The full-context result, None if the website is not a good website
+            - tokens: The token counts of the content before and after truncation to
+              FULL_CONTEXT_TOKEN_BUDGET, only if the full-context call was made
+            - duplicate_of, similarity: The earlier website the content is a copy of, only
+              if it was found before the full-context call
+        """
+        with span("website",index=i,url=url) as websiteSpan:
+            if self.checkpoint is not None:
+                saved=self.checkpoint.load(websiteStage(i))
+                if saved is not None and saved['url']==url:
+                    websiteSpan.set(outcome="checkpoint")
+                    return {k:v for k,v in saved.items() if k!='url'}
+            outcome,final=self._analyzeWebsite(i,url,websiteSpan)
+            if final and self.checkpoint is not None:
+                self.checkpoint.save(websiteStage(i),{'url':url,**outcome})
+        return outcome
+    def _analyzeWebsite(self,i:int,url:str,websiteSpan)->tuple[dict,bool]:
+        """The work of _crawlWebsite.
+
+        Returns the outcome, and whether it is final: a decision a rerun would repeat
+        (disallowed, duplicate, not useful or good), which is checkpointed. Failures worth retrying
+        (fetch errors, failed or unparsable calls) and cancelled work are not final.
+        """
+        outcome={'content':None,'result':None}
+        try:
+            if self.stop.is_set():
+                return outcome,False
+            content,final=self._fetchWebsite(url,websiteSpan)
+            if content is None:
+                return outcome,final
+            outcome['content'] = content
+            if self._duplicate(i,url,outcome):
+                websiteSpan.set(outcome="duplicate")
+                return outcome,True
+            if self.stop.is_set():
+                return outcome,False
+            with span("full_context") as fcSpan:
+                with self.lock:
+                    self.calls+=1
+                messages,outcome['tokens']=self._fullContextMessages(content)
+                error=self._judge(outcome,*chatWithGPT(messages))
+                if error is not None:
+                    fcSpan.fail(error)
+                    return outcome,False
+            websiteSpan.set(outcome="not useful" if outcome['result'] is None else "good")
+            return outcome,True
+        except Exception as e:
+            websiteSpan.fail(e)
+        return outcome,False
+    def _fetchWebsite(self,url:str,websiteSpan)->tuple[str,bool]:
+        """Check robots.txt and fetch a website.
+
+        Returns the content (None if it is not fetched), and whether that is final (disallowed).
+        """
+        with span("robots"):
+            allowed=is_allowed_by_robots(url)
+        if not allowed:
+            websiteSpan.set(outcome="disallowed")
+            return None,True
+        with span("fetch",extractor=self.extractor) as fetchSpan:
+            status,content = fetchWebsite(url,self.extractor)
+            fetchSpan.set(status=status)
+        if status != 200:
+            websiteSpan.set(outcome="fetch failed")
+            return None,False
+        return content,False
+    def _duplicate(self,i:int,url:str,outcome:dict)->bool:
+        """Fingerprint the content of a website, and mark the outcome if it is a copy of an earlier website.
+
+        Only the websites fingerprinted so far are compared; _commit checks again against
+        all earlier websites, so the decision does not depend on the order threads finish.
+        """
+        if self.duplicates is None:
+            return False
+        with span("dedup") as dedupSpan:
+            match=self.duplicates.find(i,self.duplicates.add(i,url,outcome['content']))
+            dedupSpan.set(duplicate=match is not None)
+        if match is None:
+            return False
+        outcome['duplicate_of'],outcome['similarity']=match[0],round(match[1],3)
+        return True
+    def _fullContextMessages(self,content:str)->tuple[list[dict],dict]:
+        """The messages of the full-context call on a website, and the token counts of its content before and after truncation."""
+        # keep the whole call within the input budget, the saved content is not truncated
+        overhead=countTokens(FCprompt)+countTokens(f"Question: {self.data['question']}\nWebpage Content: ")
+        (pageText,),(tokens,) = fitTexts([content],FULL_CONTEXT_TOKEN_BUDGET-overhead)
+        return [{"role":"system","content":FCprompt},
+                {"role":"user","content":f"Question: {self.data['question']}\nWebpage Content: {pageText}"}],tokens
+    @staticmethod
+    def _judge(outcome:dict,response:str,success:bool)->str:
+        """Apply the response of a full-context call to the outcome of a website.
+
+        Sets outcome['result'] for a good website. Returns None once the website is
+        decided, or the error if the call failed or its response could not be parsed.
+        """
         if not success:
-            self.errorCode="Failed to chat with GPT when getting keywords\n" + response
-            return
-        keywords,success=jsonClean(response,['question_keyword','answer_keywords'])
-        # the answer_keywords is deprecated.
+            return response
+        FCresult,success = jsonClean(response,['answer','reason','additional','trust_score'])
+        # trust_score is deprecated.
         if not success:
-            self.errorCode="Failed to parse keywords to json\n" + keywordPrompt
-            return
+            return FCresult
+        if FCresult['additional']!='':
+            # we ask model to provide abnormal cases in additional
+            # if additional is not empty, it means the website is not a good website
+            return None
+        outcome['result']=FCresult
+        return None
+    def fullContextCalls(self,limit:int=BATCH_FULL_CONTEXT_WEBSITES)->list[dict]:
+        """Prepare the full-context calls of this question for a batch API job.
+
+        The keywords and search stages are run (or loaded), and the first `limit` search
+        results (the `limit` most relevant ones with rank) without a website checkpoint
+        are fetched. The job then runs the calls, and
+        ingestFullContext checkpoints their outcomes, so process() afterwards takes those
+        websites from the checkpoints and only calls the model online for the websites
+        that are still undecided. Used by reproduceDataset/batch.py --batch-api.
+
+        Returns
+        -------
+        list[dict]
+            One dict per call with stage, url, tokens and messages. Empty if the keywords
+            or the search failed (self.errorCode is set), process() will retry them.
+        """
+        if self.checkpoint is None:
+            raise ValueError("batch full-context calls need checkpoints, set checkpointTo")
+        keywords=self._stage("keywords",self._keywords)
+        if keywords is None:
+            return []
         self.data["question_keyword"]=keywords['question_keyword']
-        print("get websites...")
+        websites=self._stage("search",self._search)
+        if websites is None:
+            return []
+        calls=[]
+        order=list(enumerate(websites,1))
+        if self.rank:
+            # the pruned websites are only reached if the others do not fill the limit
+            order,fallback,_=self._rank(websites)
+            order+=fallback
+        for i,url in order[:limit]:
+            saved=self.checkpoint.load(websiteStage(i))
+            if saved is not None:
+                if self.duplicates is not None and saved['content'] is not None:
+                    self.duplicates.add(i,url,saved['content'])
+                continue
+            with span("website",index=i,url=url) as websiteSpan:
+                try:
+                    content,final=self._fetchWebsite(url,websiteSpan)
+                except Exception as e:
+                    websiteSpan.fail(e)
+                    continue
+                if content is None:
+                    if final:
+                        self.checkpoint.save(websiteStage(i),{'url':url,'content':None,'result':None})
+                    continue
+                outcome={'content':content,'result':None}
+                if self._duplicate(i,url,outcome):
+                    websiteSpan.set(outcome="duplicate")
+                    self.checkpoint.save(websiteStage(i),{'url':url,**outcome})
+                    continue
+                messages,tokens=self._fullContextMessages(content)
+                websiteSpan.set(outcome="batched")
+                calls.append({'stage':websiteStage(i),'url':url,'tokens':tokens,'messages':messages})
+        return calls
+    def ingestFullContext(self,call:dict,response:str,success:bool)->bool:
+        """Checkpoint the outcome of a call from fullContextCalls, given its response from the job.
+
+        Returns whether the website is decided; an undecided one is analyzed again by process().
+        """
+        # the content is not kept in the call, it is in the page cache since fullContextCalls
+        status,content=fetchWebsite(call['url'],self.extractor)
+        if status!=200:
+            return False
+        outcome={'content':content,'result':None,'tokens':call['tokens']}
+        if self._judge(outcome,response,success) is not None:
+            return False
+        self.checkpoint.save(call['stage'],{'url':call['url'],**outcome})
+        return True
+    def _commit(self,i:int,url:str,outcome:dict,goodWebsites:list[int])->None:
+        if outcome['content'] is not None and self._duplicate(i,url,outcome):
+            # a copy is recorded by the website it duplicates, even if its full-context call was made
+            self.data["websites"][url]={'duplicate_of':outcome['duplicate_of'],'similarity':outcome['similarity']}
+            count("duplicates")
+            print(f"website {i} is a duplicate of {outcome['duplicate_of']}")
+            return
+        if outcome['content'] is not None:
+            self.data["websites"][url]["content"] = outcome['content']
+        if outcome.get('tokens') is not None:
+            # token counts of the content before and after truncation for the full-context call
+            self.data["websites"][url]["tokens"] = outcome['tokens']
+        if outcome['result'] is None:
+            return
+        self.data['websites'][url]|=outcome['result']
+        self.data['websites'][url]['index']=i
+        goodWebsites.append(i)
+        print(f"process website successfully: {i}")
+    def _crawl(self,order:list[tuple[int,str]],quota:int=MAX_GOOD_WEBSITES)->list[int]:
+        """Process the websites concurrently until quota good ones are found.
+
+        The websites run on crawlPool, so at most CRAWL_WORKERS websites are in flight at the
+        same time across all pipelines, and requests to the same host are spaced by
+        CRAWL_HOST_DELAY seconds.
+        Outcomes are committed strictly in the given order, so goodWebsites and the index of
+        each website are the same as processing the websites one by one.
+        Once the quota is reached, websites that have not started are cancelled and the
+        results of the ones still running are dropped.
+
+        Parameters
+        ----------
+        order : list[tuple[int,str]]
+            (index in the search results, URL) of the websites, in the order to process
+            them: search order, or relevance order with rank
+        quota : int, optional
+            Number of good websites to find, by default MAX_GOOD_WEBSITES
+
+        Returns
+        -------
+        list[int]
+            The indexes of the good websites, in the given order
+        """
+        goodWebsites=[]
+        outcomes={}
+        nextCommit=0
+        tasks=iter(enumerate(order))
+        pending={}
+        try:
+            while True:
+                for k,(i,url) in tasks:
+                    # in the context of the caller, so the website spans are children of its span
+                    pending[crawlPool.submit(inContext(self._crawlWebsite),i,url)]=k
+                    if len(pending)>=CRAWL_WORKERS:
+                        break
+                if not pending:
+                    break
+                done,_=wait(pending,return_when=FIRST_COMPLETED)
+                for future in done:
+                    outcomes[pending.pop(future)]=future.result()
+                while nextCommit in outcomes and len(goodWebsites)<quota:
+                    self._commit(*order[nextCommit],outcomes.pop(nextCommit),goodWebsites)
+                    nextCommit+=1
+                if len(goodWebsites)>=quota:
+                    break
+        finally:
+            self.stop.set()
+            # the pool is shared, only the websites of this pipeline are cancelled
+            for future in pending:
+                future.cancel()
+        return goodWebsites
+    def _prefetch(self,i:int,url:str)->str:
+        """The content of a website to rank it: from its checkpoint, or fetched (and so in the page cache for _crawlWebsite)."""
+        if self.checkpoint is not None:
+            saved=self.checkpoint.load(websiteStage(i))
+            if saved is not None and saved['url']==url:
+                return saved['content']
+        with span("prefetch",index=i,url=url) as prefetchSpan:
+            try:
+                return self._fetchWebsite(url,prefetchSpan)[0]
+            except Exception as e:
+                prefetchSpan.fail(e)
+                return None
+    def _rank(self,websites:list[str])->tuple[list[tuple[int,str]],list[tuple[int,str]],dict]:
+        """Fetch all websites, and order them by relevance to the question and its keyword.
+
+        Near-duplicates are set aside first, in search order as _commit would. The other
+        pages are scored with BM25, and the ones below RELEVANCE_THRESHOLD of the best
+        score (or without any word of the question) are pruned: they get a full-context call
+        only if the others do not fill the quota.
+
+        Returns
+        -------
+        tuple
+            - order: (index, URL) of the websites to analyze, most relevant first, ties in search order
+            - fallback: (index, URL) of the pruned websites, in the same order
+            - notes: URL -> the fields to record for the website: relevance and pruned
+              (with its content), or duplicate_of and similarity
+        """
+        # one context per task, a context can not be entered by two threads at once
+        futures=[crawlPool.submit(inContext(self._prefetch),i,url) for i,url in enumerate(websites,1)]
+        contents=[future.result() for future in futures]
+        notes={}
+        candidates=[]
+        for i,(url,content) in enumerate(zip(websites,contents),1):
+            if content is None:
+                continue
+            outcome={'content':content}
+            if self._duplicate(i,url,outcome):
+                notes[url]={'duplicate_of':outcome['duplicate_of'],'similarity':outcome['similarity']}
+            else:
+                candidates.append((i,url,content))
+        with span("rank",websites=len(candidates)) as rankSpan:
+            scores=bm25(f"{self.question} {self.data['question_keyword']}",[content for _,_,content in candidates])
+            best=max(scores,default=0)
+            order,fallback=[],[]
+            for (i,url,content),score in sorted(zip(candidates,scores),key=lambda item:-item[1]):
+                notes[url]={'relevance':round(score,3)}
+                if score<=0 or score<RELEVANCE_THRESHOLD*best:
+                    notes[url]|={'content':content,'pruned':True}
+                    fallback.append((i,url))
+                else:
+                    order.append((i,url))
+            rankSpan.set(pruned=len(fallback))
+        return order,fallback,notes
+    def _keywords(self)->dict:
+        with span("keywords") as keywordSpan:
+            response,success=chatWithGPT([
+                {"role": "system", "content": keywordPrompt},
+                {"role": "user", "content": self.question}
+            ])
+            if not success:
+                self.errorCode="Failed to chat with GPT when getting keywords\n" + response
+                keywordSpan.fail(self.errorCode)
+                return None
+            keywords,success=jsonClean(response,['question_keyword','answer_keywords'])
+            # the answer_keywords is deprecated.
+            if not success:
+                self.errorCode="Failed to parse keywords to json\n" + keywordPrompt
+                keywordSpan.fail(self.errorCode)
+                return None
+            return keywords
+    def _search(self)->list[str]:
         websites,success=getWebsites(self.data["question_keyword"])
         if not success:
             self.errorCode="Failed to get websites\n"
+            return None
+        return websites
+    @staticmethod
+    def _summaryCall(prompt:str,content:str)->tuple[dict,str]:
+        """One summarizing or merging call, returns (result, None) or (None, error)."""
+        result,success = chatWithGPT([{"role":"system","content":prompt},{"role":"user","content":content}])
+        if not success:
+            return None,f"Error in summarize GPTCall: {result}"
+        result,success = jsonClean(result,['answers','additional','contradicts'])
+        if not success:
+            return None,f"Error in summarize jsonClean: {result}"
+        return result,None
+    def _mapReduce(self,header:str,entries:list[str])->tuple[dict,str]:
+        """Summarize chunks of SUMMARY_CHUNK_SIZE good websites in parallel, then merge their clusters.
+
+        Each chunk gets the summarizing prompt, so its clusters have the usual schema with the
+        indexes of its websites; one call with the merge prompt then joins the clusters of all
+        chunks that express the same viewpoint. Returns (result, None) or (None, error).
+        """
+        chunks=[header+''.join(entries[k:k+SUMMARY_CHUNK_SIZE]) for k in range(0,len(entries),SUMMARY_CHUNK_SIZE)]
+        def summarizeChunk(chunk:str)->tuple[dict,str]:
+            with span("summarize_map") as mapSpan:
+                result,error=self._summaryCall(Summarizingprompt,chunk)
+                if error is not None:
+                    mapSpan.fail(error)
+                return result,error
+        with ThreadPoolExecutor(max_workers=SUMMARY_WORKERS) as pool:
+            futures=[pool.submit(inContext(summarizeChunk),chunk) for chunk in chunks]
+            partials=[future.result() for future in futures]
+        for _,error in partials:
+            if error is not None:
+                return None,error
+        sets=''.join(f"Cluster set {k}:\n{json.dumps(result,ensure_ascii=False)}\n\n" for k,(result,_) in enumerate(partials,1))
+        with span("summarize_reduce",sets=len(partials)) as reduceSpan:
+            result,error=self._summaryCall(Mergeprompt,header+sets)
+            if error is not None:
+                reduceSpan.fail(error)
+            return result,error
+    def _summarize(self,content:str,header:str,entries:list[str])->dict:
+        """Summarize the good websites: content is header and entries joined, one entry per website.
+
+        With SUMMARY_CHUNK_SIZE set and more good websites than that, the summary is made
+        by _mapReduce, so no single call sees all websites.
+        """
+        with span("summarize",websites=len(entries)) as summarizeSpan:
+            if SUMMARY_CHUNK_SIZE and len(entries)>SUMMARY_CHUNK_SIZE:
+                result,error=self._mapReduce(header,entries)
+            else:
+                result,error=self._summaryCall(Summarizingprompt,content)
+            if error is not None:
+                self.errorCode=error
+                summarizeSpan.fail(self.errorCode)
+                return None
+            # kept with its input, a summary is only reused for the same good websites
+            return {'content':content,'result':result}
+    def _process(self)->None:
+        # search for websites
+        print("search for websites...")
+        keywords=self._stage("keywords",self._keywords)
+        if keywords is None:
+            return
+        self.data["question_keyword"]=keywords['question_keyword']
+        print("get websites...")
+        websites=self._stage("search",self._search)
+        if websites is None:
             return
         # process websites
         print("get contents of websites...")
         self.data["websites"]={website:{} for website in websites}
-        goodWebsites=[]
-        for i,url in enumerate(websites,1):
-            try:
-                if not is_allowed_by_robots(url):
-                    continue
-                headers = {"Content-Type": "application/json"}
-                payload = {"url": url}
-                response = requests.post("https://r.jina.ai/", headers=headers, json=payload)
-                if response.status_code == 200:
-                    self.data["websites"][url]["content"] = response.text
-                else:
-                    continue
-                FCresult,success = chatWithGPT([{"role":"system","content":FCprompt},
-                                                {"role":"user","content":f"Question: {self.data['question']}\nWebpage Content: {self.data['websites'][url]['content']}"}])
-                if not success:
-                    continue
-                FCresult,success = jsonClean(FCresult,['answer','reason','additional','trust_score'])
-                # trust_score is deprecated.
-                if not success:
-                    continue
-                if FCresult['additional']!='':
-                    # we ask model to provide abnormal cases in additional
-                    # if additional is not empty, it means the website is not a good website
-                    continue
-                self.data['websites'][url]|=FCresult
-                self.data['websites'][url]['index']=i
-                goodWebsites.append(i)
-                print(f"process website successfully: {i}")
-                if len(goodWebsites)>=10:
-                    break
-            except Exception as e:
-                continue
-            time.sleep(3)
-                
+        with span("crawl",websites=len(websites)) as crawlSpan:
+            order=list(enumerate(websites,1))
+            if self.rank:
+                order,fallback,notes=self._rank(websites)
+                for url,note in notes.items():
+                    self.data["websites"][url]|=note
+            goodWebsites=self._crawl(order)
+            if self.rank:
+                calls=self.calls
+                if len(goodWebsites)<MAX_GOOD_WEBSITES and fallback:
+                    # the ranked websites ran out: fall back to the pruned ones, best first
+                    self.stop.clear()
+                    goodWebsites+=self._crawl(fallback,MAX_GOOD_WEBSITES-len(goodWebsites))
+                crawlSpan.set(pruned=len(fallback),fallbackCalls=self.calls-calls)
+                print(f"relevance ranking: {len(fallback)} websites pruned, {self.calls-calls} of them analyzed as a fallback, {self.calls} calls made for {len(goodWebsites)} good websites")
+            crawlSpan.set(good=len(goodWebsites),calls=self.calls)
         if len(goodWebsites)<3:
             # this could be changed to a warning
             # in practice, we use 3 here
@@ -170,22 +688,25 @@ class Pipeline:
             return
         # summarize the answer
         print("summarize the answer...")
-        content=f"Question: {self.data['question']}\n"
+        header=f"Question: {self.data['question']}\n"
+        entries=[]
         # filter out websites without index
         content_websites = [i for i in self.data['websites'].keys() if 'index' in self.data['websites'][i].keys()]
         for k in sorted(content_websites,key=lambda x:self.data['websites'][x]['index']):
             answer=self.data['websites'][k]['answer']
             reason=str(self.data['websites'][k]['reason'])
-            content+=f"Webpage {self.data['websites'][k]['index']}:\nAnswer: {answer}\nReason: {reason}\n\n"
+            entries.append(f"Webpage {self.data['websites'][k]['index']}:\nAnswer: {answer}\nReason: {reason}\n\n")
+        content=header+''.join(entries)
         
-        result,success = chatWithGPT([{"role":"system","content":Summarizingprompt},{"role":"user","content":content}])
-        if not success:
-            self.errorCode=f"Error in summarize GPTCall: {result}"
-            return
-        result,success = jsonClean(result,['answers','additional','contradicts'])
-        if not success:
-            self.errorCode=f"Error in summarize jsonClean: {result}"
+        summary=self._stage("summary",lambda:self._summarize(content,header,entries))
+        if summary is not None and summary['content']!=content:
+            # the good websites changed since the checkpoint (e.g. a retried website succeeded)
+            summary=self._summarize(content,header,entries)
+            if summary is not None:
+                self.checkpoint.save("summary",summary)
+        if summary is None:
             return
+        result=summary['result']
         self.data['final_answer']=result
         self.data['websites']=list(self.data['websites'].values())
         self.data['contradicts']=self.data['final_answer']['contradicts']
@@ -199,18 +720,29 @@ class Pipeline:
                 r['reason_judge_keyword']=r['reason judge keyword']
                 r.pop('reason judge keyword')
     def _save(self)->None:
+        if isinstance(self.saveTo,ResultStore):
+            self.saveTo.append(self.data,key=self.data.get('id',self.question))
+            return
         with open(self.saveTo,'w') as f:
             json.dump(self.data,f,ensure_ascii=False)
     def process(self)->None:
-        self._process()
+        with span("pipeline",question=self.question) as pipelineSpan:
+            self._process()
+            if self.errorCode is not None:
+                pipelineSpan.fail(self.errorCode)
+            elif self.checkpoint is not None:
+                self.checkpoint.clear()
         if self.errorCode is not None:
             print("Program Failed due to the following error:")
             print(self.errorCode)
-            self._save()
-            print("Intermediate result is saved to",self.saveTo)
-        else:
+            if self.saveTo is not None:
+                self._save()
+                print("Intermediate result is saved to",self.saveTo)
+        elif self.saveTo is not None:
             self._save()
             print("Program Finished Successfully and saved to",self.saveTo)
+        else:
+            print("Program Finished Successfully")
 if __name__=="__main__":
     pipeline=Pipeline("Which one is better? Genshin Impact or Honkai Impact 3rd?","test.json")
     pipeline.process()
@@ -0,0 +1,67 @@
+import re
+import math
+
+from collections import Counter
+
+from config import BM25_K1, BM25_B
+
+
+"""
+Local lexical relevance of fetched pages to a question, used to rank the websites of a
+question before the full-context calls (see Pipeline, rank).
+
+Pages are scored with BM25 against the words of the question and its search keyword.
+The document frequencies come from the pages of the question themselves, so a word
+that every result contains (the topic of the search) weighs little, and the words that
+set the pages apart decide the order. No model call is made.
+"""
+
+WORD = re.compile(r"\w+")
+STOPWORDS = frozenset("""
+a about an and are as at be been but by can could do does did for from has have how i if in into is it its
+may might more most of on one or other should so than that the their them then there these they this those to
+was were what when where which who whom why will with would you your
+""".split())
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased words of a text, without stopwords."""
+    return [word for word in WORD.findall(text.lower()) if word not in STOPWORDS]
+
+
+def bm25(query: str, documents: list[str], k1: float = BM25_K1, b: float = BM25_B) -> list[float]:
+    """BM25 score of each document for the query.
+
+    Parameters
+    ----------
+    query : str
+        The text to match, e.g. the question and its keyword
+    documents : list[str]
+        The texts to score, also the collection the document frequencies are taken from
+    k1 : float, optional
+        Saturation of the term frequency, by default from config
+    b : float, optional
+        Strength of the length normalization, by default from config
+
+    Returns
+    -------
+    list[float]
+        One score per document, 0 for a document without any word of the query
+    """
+    terms = set(tokenize(query))
+    counts, lengths = [], []
+    for document in documents:
+        words = WORD.findall(document.lower())
+        # only the words of the query are counted, the length is in words of any kind
+        counts.append(Counter(word for word in words if word in terms))
+        lengths.append(len(words))
+    average = sum(lengths) / len(lengths) if lengths and sum(lengths) else 1
+    n = len(documents)
+    # the Lucene idf, log(1 + ...), positive even for a word in more than half of the documents
+    idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+           for term in terms for df in [sum(1 for c in counts if term in c)] if df}
+    scores = []
+    for c, length in zip(counts, lengths):
+        norm = k1 * (1 - b + b * length / average)
+        scores.append(sum(weight * c[term] * (k1 + 1) / (c[term] + norm) for term, weight in idf.items() if term in c))
+    return scores
@@ -0,0 +1,242 @@
+import time
+import zlib
+import hashlib
+import threading
+import urllib.error
+import urllib.request
+import urllib.robotparser
+
+from typing import Callable, Optional
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+
+from cache import SqliteCache
+from config import ROBOTS_CACHE_TTL, ROBOTS_NEGATIVE_TTL, ROBOTS_TIMEOUT, PAGE_CACHE_MAX_AGE, PAGE_CACHE_ERROR_MAX_AGE, PAGE_CACHE_ERROR_STATUSES
+
+
+"""
+Caches shared by the crawl step of the pipeline: robots.txt and fetched pages.
+
+They are SQLite-backed (see cache.py), so the threads of one pipeline, the questions of
+a batch and separate runs all reuse what was fetched before.
+"""
+
+
+class RobotsCache(SqliteCache):
+    """Per-host cache of robots.txt.
+
+    Each host (scheme://netloc) is fetched at most once per TTL. Hosts that time out,
+    can not be reached, or answer with a server error are cached for the shorter
+    negativeTtl, so a dead host does not cost a timeout for every URL on it.
+    Threads asking for the same host wait for a single fetch.
+
+    Parameters
+    ----------
+    path : str, optional
+        The SQLite file of the cache, by default in memory only
+    ttl : float, optional
+        Seconds before a fetched robots.txt expires, by default from config
+    negativeTtl : float, optional
+        Seconds before a failed fetch expires, by default from config
+    timeout : float, optional
+        Seconds before fetching a robots.txt is given up, by default from config
+    throttle : Callable[[str], None], optional
+        Called with the URL of a robots.txt before fetching it, e.g. to space the requests
+        to a host, by default None
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS robots (
+        host TEXT PRIMARY KEY,
+        status INTEGER NOT NULL,
+        body TEXT,
+        fetched_at REAL NOT NULL
+    );
+    """
+    # status of a fetch that did not get any HTTP response
+    NO_RESPONSE = 0
+
+    def __init__(self, path: str = None, ttl: float = ROBOTS_CACHE_TTL, negativeTtl: float = ROBOTS_NEGATIVE_TTL, timeout: float = ROBOTS_TIMEOUT,
+                 throttle: Optional[Callable[[str], None]] = None):
+        super().__init__(path or ":memory:")
+        self.ttl = ttl
+        self.negativeTtl = negativeTtl
+        self.timeout = timeout
+        self.throttle = throttle
+        self.memory = {}
+        self.hostLocks = {}
+
+    def _hostLock(self, host: str) -> threading.Lock:
+        with self.lock:
+            return self.hostLocks.setdefault(host, threading.Lock())
+
+    def _expiry(self, status: int, fetchedAt: float) -> float:
+        if status == self.NO_RESPONSE or status >= 500:
+            return fetchedAt + self.negativeTtl
+        return fetchedAt + self.ttl
+
+    def _fetch(self, host: str) -> tuple[int, Optional[str]]:
+        """Fetch robots.txt, return (status, body)."""
+        if self.throttle is not None:
+            self.throttle(f"{host}/robots.txt")
+        try:
+            with urllib.request.urlopen(f"{host}/robots.txt", timeout=self.timeout) as f:
+                return 200, f.read().decode("utf-8")
+        except urllib.error.HTTPError as err:
+            return err.code, None
+        except Exception:
+            return self.NO_RESPONSE, None
+
+    def _build(self, host: str, status: int, body: Optional[str]) -> Optional[urllib.robotparser.RobotFileParser]:
+        """Build the parser the same way RobotFileParser.read would. None means no usable answer."""
+        if status == self.NO_RESPONSE:
+            return None
+        rp = urllib.robotparser.RobotFileParser(f"{host}/robots.txt")
+        if status == 200:
+            rp.parse(body.splitlines())
+        elif status in (401, 403):
+            rp.disallow_all = True
+        elif 400 <= status < 500:
+            rp.allow_all = True
+        return rp
+
+    def parser(self, url: str) -> Optional[urllib.robotparser.RobotFileParser]:
+        """Get the robots.txt parser for the host of a URL.
+
+        Returns
+        -------
+        Optional[RobotFileParser]
+            The parser, or None if robots.txt could not be fetched
+        """
+        parsed_url = urlparse(url)
+        host = f"{parsed_url.scheme}://{parsed_url.netloc}"
+        entry = self.memory.get(host)
+        if entry is not None and entry[1] > time.time():
+            self.hits += 1
+            return entry[0]
+        with self._hostLock(host):
+            # another thread may have fetched it while we were waiting
+            entry = self.memory.get(host)
+            now = time.time()
+            if entry is not None and entry[1] > now:
+                self.hits += 1
+                return entry[0]
+            rows = self.execute("SELECT status, body, fetched_at FROM robots WHERE host=?", (host,))
+            if rows and self._expiry(rows[0][0], rows[0][2]) > now:
+                self.hits += 1
+                status, body, fetchedAt = rows[0]
+            else:
+                self.misses += 1
+                status, body = self._fetch(host)
+                fetchedAt = time.time()
+                self.execute("INSERT OR REPLACE INTO robots VALUES (?,?,?,?)", (host, status, body, fetchedAt))
+            rp = self._build(host, status, body)
+            self.memory[host] = (rp, self._expiry(status, fetchedAt))
+            return rp
+
+
+def normalizeUrl(url: str) -> str:
+    """Normalize a URL so that trivial variants share one cache entry.
+
+    The scheme and host are lowercased, default ports and the fragment are dropped,
+    an empty path becomes "/" and the query parameters are sorted.
+    """
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    netloc = parsed.netloc.lower()
+    if (scheme == "http" and netloc.endswith(":80")) or (scheme == "https" and netloc.endswith(":443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    return urlunparse((scheme, netloc, parsed.path or "/", parsed.params, query, ""))
+
+
+class PageCache(SqliteCache):
+    """Compressed, content-addressed store of fetched pages.
+
+    Pages are keyed by the normalized URL and remember the status and time of the fetch.
+    Texts made by different extraction backends are kept apart by a namespace; the reader
+    service uses the default (empty) namespace, so its pages keep the keys they always had.
+    The text is stored zlib-compressed under its sha256, so mirrors with the same text
+    are stored once. A page is served until it is older than maxAge (errorMaxAge for
+    pages that did not return 200). Only definitive failures (errorStatuses, e.g. 404) are
+    stored; a rate limit or server error is not, so a retry fetches the page again.
+
+    Parameters
+    ----------
+    path : str, optional
+        The SQLite file of the cache, by default in memory only
+    maxAge : float, optional
+        Seconds a fetched page is served from the cache, by default from config
+    errorMaxAge : float, optional
+        Seconds a failed fetch is served from the cache, by default from config
+    errorStatuses : tuple, optional
+        Statuses of the failed fetches that are stored, by default from config
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS pages (
+        url_key TEXT PRIMARY KEY,
+        url TEXT NOT NULL,
+        status INTEGER NOT NULL,
+        content_hash TEXT,
+        fetched_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS blobs (
+        hash TEXT PRIMARY KEY,
+        data BLOB NOT NULL
+    );
+    """
+
+    def __init__(self, path: str = None, maxAge: float = PAGE_CACHE_MAX_AGE, errorMaxAge: float = PAGE_CACHE_ERROR_MAX_AGE,
+                 errorStatuses: tuple = PAGE_CACHE_ERROR_STATUSES):
+        super().__init__(path or ":memory:")
+        self.maxAge = maxAge
+        self.errorMaxAge = errorMaxAge
+        self.errorStatuses = frozenset(errorStatuses)
+
+    @staticmethod
+    def key(url: str, namespace: str = "") -> str:
+        name = f"{namespace}:{normalizeUrl(url)}" if namespace else normalizeUrl(url)
+        return hashlib.sha256(name.encode("utf-8")).hexdigest()
+
+    def get(self, url: str, namespace: str = "") -> Optional[tuple[int, Optional[str]]]:
+        """Get a cached fetch, made by the backend of the namespace.
+
+        Returns
+        -------
+        Optional[tuple[int, Optional[str]]]
+            (status, content) of the fetch, None if the page is not cached or too old.
+            content is None when the status is not 200.
+        """
+        rows = self.execute(
+            "SELECT status, fetched_at, data FROM pages LEFT JOIN blobs ON pages.content_hash=blobs.hash WHERE url_key=?",
+            (self.key(url, namespace),))
+        if not rows:
+            self.misses += 1
+            return None
+        status, fetchedAt, data = rows[0]
+        maxAge = self.maxAge if status == 200 else self.errorMaxAge
+        if time.time() - fetchedAt > maxAge:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return status, zlib.decompress(data).decode("utf-8") if data is not None else None
+
+    def put(self, url: str, status: int, content: Optional[str], namespace: str = "") -> None:
+        """Store the result of a fetch. content is only kept when the status is 200.
+
+        A failure whose status is not in errorStatuses (429, 5xx, ...) is not stored, and
+        leaves an earlier entry of the page as it is.
+        """
+        if status != 200 and status not in self.errorStatuses:
+            return
+        contentHash = None
+        with self.transaction() as conn:
+            if status == 200 and content is not None:
+                raw = content.encode("utf-8")
+                contentHash = hashlib.sha256(raw).hexdigest()
+                if conn.execute("SELECT 1 FROM blobs WHERE hash=?", (contentHash,)).fetchone() is None:
+                    conn.execute("INSERT INTO blobs VALUES (?,?)", (contentHash, zlib.compress(raw)))
+            key = self.key(url, namespace)
+            old = conn.execute("SELECT content_hash FROM pages WHERE url_key=?", (key,)).fetchone()
+            conn.execute("INSERT OR REPLACE INTO pages VALUES (?,?,?,?,?)", (key, url, status, contentHash, time.time()))
+            if old is not None and old[0] is not None and old[0] != contentHash:
+                # drop the old text if no other page points to it
+                conn.execute("DELETE FROM blobs WHERE hash=? AND NOT EXISTS (SELECT 1 FROM pages WHERE content_hash=?)", (old[0], old[0]))
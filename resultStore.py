@@ -0,0 +1,247 @@
+"""
+Append-only store of result records in sharded jsonl files.
+
+A store is a folder of shards (shard-00000.jsonl, or shard-00000.jsonl.gz when
+compressed) and an index.json file. Each record is one compact json line, written
+with a single write and fsync, so a crash can only cut the last line of a shard.
+When compressed, each line is its own gzip member, so any record can still be read
+on its own. A reopened store never appends to an existing shard, it starts a new one.
+
+The index maps each key to the (shard, offset) of its last record, for random access.
+It is rewritten atomically (os.replace) every RESULT_INDEX_FLUSH records and on close;
+records written after the last index flush are found again by scanning the end of
+the shards when the store is opened.
+"""
+
+import os
+import re
+import gzip
+import json
+import zlib
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import RESULT_SHARD_SIZE, RESULT_COMPRESS, RESULT_INDEX_FLUSH
+
+INDEX_FILE = "index.json"
+SHARD_PATTERN = re.compile(r"^shard-(\d{5})\.jsonl(\.gz)?$")
+# bytes handed to the decoder at a time when scanning a compressed shard
+SCAN_CHUNK = 64 * 1024
+
+
+def isStore(path: str) -> bool:
+    """Whether path is a folder written by ResultStore."""
+    return os.path.isdir(path) and (os.path.exists(os.path.join(path, INDEX_FILE))
+                                    or any(SHARD_PATTERN.match(name) for name in os.listdir(path)))
+
+
+class ResultStore:
+    """Append records to rotating jsonl shards, with an index for random access.
+
+    Safe to share between threads of one process. Records with the same key are
+    all kept; get() and records(latest=True) return the last one.
+
+    Parameters
+    ----------
+    path : str
+        The folder of the store
+    shardSize : int, optional
+        Number of records per shard, by default from config
+    compress : bool, optional
+        Write gzip shards, by default from config. Existing shards are read either way
+    """
+    def __init__(self, path: str, shardSize: int = RESULT_SHARD_SIZE, compress: bool = RESULT_COMPRESS):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.shardSize = shardSize
+        self.compress = compress
+        self.lock = threading.Lock()
+        # key -> [shard name, offset] of its last record
+        self.index: Dict[str, List] = {}
+        # shard name -> indexed size in bytes
+        self.sizes: Dict[str, int] = {}
+        self._loadIndex()
+        numbers = [int(SHARD_PATTERN.match(name).group(1)) for name in self.shards()]
+        self.shard = max(numbers) + 1 if numbers else 0
+        self.count = 0
+        self.pending = 0
+
+    def __str__(self) -> str:
+        return self.path
+
+    def shards(self) -> List[str]:
+        """Names of the shards, in write order."""
+        return sorted(name for name in os.listdir(self.path) if SHARD_PATTERN.match(name))
+
+    @staticmethod
+    def _encode(record: dict, compress: bool) -> bytes:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        return gzip.compress(line, mtime=0) if compress else line
+
+    @staticmethod
+    def _scan(data: bytes, compressed: bool, start: int = 0) -> Iterator[Tuple[int, dict]]:
+        """Yield (offset, record) of the complete records in a shard from start."""
+        offset = start
+        view = memoryview(data)
+        while offset < len(data):
+            if compressed:
+                # the member is fed in chunks, so a record never copies the rest of the shard
+                decoder = zlib.decompressobj(wbits=31)
+                parts = []
+                position = offset
+                try:
+                    while not decoder.eof and position < len(data):
+                        chunk = view[position:position + SCAN_CHUNK]
+                        parts.append(decoder.decompress(chunk))
+                        position += len(chunk)
+                except zlib.error:
+                    return
+                if not decoder.eof:
+                    return
+                end = position - len(decoder.unused_data)
+                line = b"".join(parts)
+            else:
+                end = data.find(b"\n", offset)
+                if end == -1:
+                    return
+                line = data[offset:end]
+                end += 1
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = None
+            if record is not None:
+                yield offset, record
+            offset = end
+
+    def _read(self, name: str) -> bytes:
+        with open(os.path.join(self.path, name), "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def _key(record: dict, key) -> str:
+        if key is None:
+            key = record.get("id")
+        return None if key is None else str(key)
+
+    def _loadIndex(self) -> None:
+        indexPath = os.path.join(self.path, INDEX_FILE)
+        if os.path.exists(indexPath):
+            with open(indexPath, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self.index = saved.get("index", {})
+            self.sizes = saved.get("sizes", {})
+        # records written after the last index flush
+        for name in self.shards():
+            size = os.path.getsize(os.path.join(self.path, name))
+            start = self.sizes.get(name, 0)
+            if size == start:
+                continue
+            for offset, record in self._scan(self._read(name), name.endswith(".gz"), start):
+                key = self._key(record, record.get("_key"))
+                if key is not None:
+                    self.index[key] = [name, offset]
+            self.sizes[name] = size
+
+    def _flushIndex(self) -> None:
+        indexPath = os.path.join(self.path, INDEX_FILE)
+        tmp = indexPath + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"index": self.index, "sizes": self.sizes}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, indexPath)
+        self.pending = 0
+
+    def append(self, record: dict, key=None) -> None:
+        """Append a record.
+
+        Parameters
+        ----------
+        record : dict
+            The record, must be json serializable
+        key : optional
+            The key of the record for get(), by default its "id". When it is given,
+            it is stored in the record as "_key" so the index can be rebuilt
+        """
+        if key is not None:
+            record = {**record, "_key": str(key)}
+        key = self._key(record, key)
+        data = self._encode(record, self.compress)
+        with self.lock:
+            if self.count >= self.shardSize:
+                self.shard += 1
+                self.count = 0
+            name = f"shard-{self.shard:05d}.jsonl" + (".gz" if self.compress else "")
+            with open(os.path.join(self.path, name), "ab") as f:
+                offset = f.tell()
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.count += 1
+            self.sizes[name] = offset + len(data)
+            if key is not None:
+                self.index[key] = [name, offset]
+            self.pending += 1
+            if self.pending >= RESULT_INDEX_FLUSH:
+                self._flushIndex()
+
+    def get(self, key) -> Optional[dict]:
+        """The last record of a key, None if there is none."""
+        with self.lock:
+            location = self.index.get(str(key))
+        if location is None:
+            return None
+        name, offset = location
+        with open(os.path.join(self.path, name), "rb") as f:
+            f.seek(offset)
+            if name.endswith(".gz"):
+                line = gzip.GzipFile(fileobj=f).readline()
+            else:
+                line = f.readline()
+        return self._strip(json.loads(line))
+
+    @staticmethod
+    def _strip(record: dict) -> dict:
+        record.pop("_key", None)
+        return record
+
+    def keys(self) -> List[str]:
+        with self.lock:
+            return list(self.index)
+
+    def __contains__(self, key) -> bool:
+        return str(key) in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def records(self, latest: bool = False) -> Iterator[dict]:
+        """Stream the records in write order, one shard in memory at a time.
+
+        Parameters
+        ----------
+        latest : bool, optional
+            Only yield the last record of each key (records without a key are all yielded)
+        """
+        with self.lock:
+            index = {tuple(location) for location in self.index.values()} if latest else None
+        for name in self.shards():
+            for offset, record in self._scan(self._read(name), name.endswith(".gz")):
+                if latest and self._key(record, record.get("_key")) is not None and (name, offset) not in index:
+                    continue
+                yield self._strip(record)
+
+    def flush(self) -> None:
+        """Write the index now."""
+        with self.lock:
+            self._flushIndex()
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "ResultStore":
+        return self
+
+    def __exit__(self, excType, exc, tb) -> None:
+        self.close()
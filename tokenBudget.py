@@ -0,0 +1,117 @@
+"""
+Token counting and token-budgeted truncation of prompt inputs.
+
+Tokens are counted with tiktoken when it is installed and its encoding can be loaded,
+otherwise they are estimated from the number of characters (CHARS_PER_TOKEN).
+"""
+
+import math
+from functools import lru_cache
+from typing import List, Dict, Tuple
+
+from config import DEFAULT_MODEL, CHARS_PER_TOKEN
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+@lru_cache(maxsize=None)
+def getEncoder(model: str = DEFAULT_MODEL):
+    """Get the tiktoken encoder of a model, None if tiktoken can not be used.
+
+    The result is cached, so a failed load (e.g. no network to download the encoding)
+    is only tried once.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        try:
+            return tiktoken.get_encoding("o200k_base")
+        except Exception:
+            return None
+    except Exception:
+        return None
+
+
+def countTokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    """Count (or estimate) the number of tokens of a text."""
+    encoder = getEncoder(model)
+    if encoder is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def truncateTokens(text: str, limit: int, model: str = DEFAULT_MODEL) -> str:
+    """Keep the beginning of a text that fits in limit tokens."""
+    limit = max(0, limit)
+    encoder = getEncoder(model)
+    if encoder is None:
+        return text[:limit * CHARS_PER_TOKEN]
+    tokens = encoder.encode(text, disallowed_special=())
+    if len(tokens) <= limit:
+        return text
+    return encoder.decode(tokens[:limit])
+
+
+def allocateBudget(lengths: List[int], budget: int) -> List[int]:
+    """Share a token budget fairly between texts (max-min fairness).
+
+    Texts shorter than an equal share keep all their tokens, and what they leave
+    is shared equally by the longer ones.
+
+    Parameters
+    ----------
+    lengths : List[int]
+        Number of tokens of each text
+    budget : int
+        Total number of tokens
+
+    Returns
+    -------
+    List[int]
+        Number of tokens allowed for each text, in the same order
+    """
+    allocation = [0] * len(lengths)
+    remaining = max(0, budget)
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    for k, i in enumerate(order):
+        share = remaining // (len(order) - k)
+        allocation[i] = min(lengths[i], share)
+        remaining -= allocation[i]
+    return allocation
+
+
+def fitTexts(texts: List[str], budget: int, model: str = DEFAULT_MODEL, counts: List[int] = None) -> Tuple[List[str], List[Dict[str, int]]]:
+    """Truncate texts so that together they fit in a token budget.
+
+    Parameters
+    ----------
+    texts : List[str]
+        The texts to fit
+    budget : int
+        Total number of tokens for all texts
+    model : str, optional
+        The model whose tokenizer is used, by default from config
+    counts : List[int], optional
+        The number of tokens of each text if already known
+
+    Returns
+    -------
+    Tuple[List[str], List[Dict[str, int]]]
+        - The texts, truncated where needed
+        - For each text, its number of tokens "before" and "after" truncation
+    """
+    before = counts if counts is not None else [countTokens(text, model) for text in texts]
+    allocation = allocateBudget(before, budget)
+    fitted = []
+    tokens = []
+    for text, count, limit in zip(texts, before, allocation):
+        if count > limit:
+            text = truncateTokens(text, limit, model)
+        fitted.append(text)
+        tokens.append({"before": count, "after": min(count, limit)})
+    return fitted, tokens